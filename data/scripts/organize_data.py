@@ -613,19 +613,37 @@ class DataOrganizer:
         console.print("[green]✓ floor_plans/ 目錄整理完成（4 個類別已分類）[/green]")
 
     def _generate_dataset_metadata(self, dataset_path: Path, year: str) -> Dict[str, Any]:
-        """生成數據集元數據"""
-        bin_files = list(dataset_path.rglob("*.bin"))
-        layers = set([f.parent.name for f in bin_files if f.parent.name.startswith("L")])
+        """
+        生成數據集元數據
 
-        total_size = sum(f.stat().st_size for f in bin_files) / (1024 * 1024)  # MB
+        圖磚存於 NLSC_tile_store/{layer}.sqlite 時，資料夾內只有 manifest.json，
+        改以 manifest 的圖磚清單統計，不需逐一讀取檔案
+        """
+        manifest_file = dataset_path / "manifest.json"
+        bin_files = list(dataset_path.rglob("*.bin"))
+        storage = "files"
+
+        if all(f.name == "LAYER.bin" for f in bin_files) and manifest_file.exists():
+            with open(manifest_file, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            tiles = manifest.get("tiles") or manifest.get("building_tiles") or []
+            layers = set(f"L{t['level']}" for t in tiles)
+            file_count = len(tiles)
+            total_size = sum(t["size"] for t in tiles) / (1024 * 1024)  # MB
+            storage = "tile_store"
+        else:
+            layers = set([f.parent.name for f in bin_files if f.parent.name.startswith("L")])
+            file_count = len(bin_files)
+            total_size = sum(f.stat().st_size for f in bin_files) / (1024 * 1024)  # MB
 
         return {
             "name": dataset_path.name,
             "year": year,
-            "file_count": len(bin_files),
+            "file_count": file_count,
             "total_size_mb": round(total_size, 2),
             "layers": sorted(list(layers)),
-            "has_manifest": (dataset_path / "manifest.json").exists()
+            "has_manifest": manifest_file.exists(),
+            "storage": storage
         }
 
     def _create_raw_readme(self):
@@ -639,6 +657,7 @@ class DataOrganizer:
 ```
 raw/
 ├── README.md                    # 本文件
+├── NLSC_tile_store/            # 每個圖層一個 SQLite 圖磚庫（{layer}.sqlite）
 ├── NLSC_3D_tiles/              # 3D Tiles 數據集
 │   ├── metadata.json           # 數據集元數據
 │   ├── 109_A_yangming/         # 109 年陽明校區
@@ -18,13 +18,18 @@ NYCU Guangfu Campus tile coordinates (from browser network capture):
   L7: R52-55, C96-99
   Higher levels: computed by doubling row/col from parent
 """
+import argparse
 import gzip
 import json
 import os
 import struct
 import sys
-import time
-import urllib.request
+
+from oview import DownloadEngine, layer_query, tile_query
+from oview.engine import EMPTY
+from oview.layerprobe import decode_layer
+from oview.negcache import NegativeCache
+from oview.tilecache import TileCache
 
 # Configuration
 SERVERS = [
@@ -51,81 +56,39 @@ HEADERS = {
     "Referer": "https://3dmaps.nlsc.gov.tw/",
 }
 
-server_idx = 0
+# Requests kept in flight against each mirror (the server's polite limit)
+MAX_IN_FLIGHT_PER_MIRROR = 4
+# Request rate ceiling per mirror; backs off on 429 / 5xx (oview/ratelimit.py)
+MAX_REQUESTS_PER_SECOND_PER_MIRROR = 20.0
 
+ENGINE = DownloadEngine(SERVERS, HEADERS, per_mirror=MAX_IN_FLIGHT_PER_MIRROR,
+                        timeout=30, rate=MAX_REQUESTS_PER_SECOND_PER_MIRROR)
 
-def get_server():
-    """Round-robin server selection."""
-    global server_idx
-    server = SERVERS[server_idx % len(SERVERS)]
-    server_idx += 1
-    return server
+# Coordinates that came back empty are not re-requested for this many days;
+# run with --refresh-empty to ask for all of them again
+EMPTY_CACHE_TTL_DAYS = 30
 
 
 def fetch_tile(layer, level, row, col, docname="NODE", retries=2):
     """Fetch a single tile from the oview server with retry and server rotation."""
-    for attempt in range(retries + 1):
-        server = get_server()
-        url = (
-            f"{server}?type=modelset&format=integrate"
-            f"&name={layer}&level={level}&Row={row}&Col={col}"
-            f"&docname={docname}&epsg=4326"
-        )
-        req = urllib.request.Request(url, headers=HEADERS)
-        try:
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                if resp.status == 200:
-                    data = resp.read()
-                    if len(data) > 0:
-                        return data
-                return None
-        except Exception as e:
-            if attempt < retries:
-                time.sleep(0.5)
-            continue
-    return None
+    return ENGINE.fetch_one(tile_query(layer, level, row, col, docname),
+                            retries=retries)
 
 
 def fetch_terrain_tile(level, row, col, terrain_name="2023_10M"):
     """Fetch a terrain tile."""
-    server = get_server()
-    url = (
-        f"{server}?type=terrain&format=integrate"
-        f"&name={terrain_name}&level={level}&Row={row}&Col={col}"
-        f"&docname=DEMNODE&epsg=4326"
-    )
-    req = urllib.request.Request(url, headers=HEADERS)
-    try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            if resp.status == 200:
-                data = resp.read()
-                if len(data) > 0:
-                    return data
-            return None
-    except Exception:
-        return None
+    return ENGINE.fetch_one(
+        tile_query(terrain_name, level, row, col, "DEMNODE", kind="terrain"),
+        retries=0)
 
 
 def fetch_layer_info(layer):
     """Fetch the LAYER metadata."""
-    server = get_server()
-    url = (
-        f"{server}?type=modelset&format=integrate"
-        f"&name={layer}&docname=LAYER"
-    )
-    req = urllib.request.Request(url, headers=HEADERS)
-    try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            if resp.status == 200:
-                data = resp.read()
-                try:
-                    data = gzip.decompress(data)
-                except Exception:
-                    pass
-                return data
-    except Exception as e:
-        print(f"  Error fetching layer info: {e}")
+    data = ENGINE.fetch_one(layer_query(layer))
+    if data is None:
+        print(f"  Error fetching layer info: no response for {layer}")
         return None
+    return decode_layer(data)
 
 
 def compute_children(level, row_min, row_max, col_min, col_max):
@@ -138,43 +101,78 @@ def compute_children(level, row_min, row_max, col_min, col_max):
 
 
 def download_level_range(layer, level, row_min, row_max, col_min, col_max,
-                         output_dir, delay=0.05):
-    """Download all tiles in a given range at a specific level."""
-    downloaded = []
-    total = (row_max - row_min + 1) * (col_max - col_min + 1)
-    count = 0
+                         output_dir, negative_cache=None, tile_cache=None):
+    """
+    Download all tiles in a given range at a specific level.
+
+    Coordinates in `negative_cache` (known empty) are not requested, and new
+    empty responses are added to it. Tiles in `tile_cache` (shared with 06
+    and 08) are reused instead of fetched, and new tiles go into its store.
+    """
+    coords = [
+        (row, col)
+        for row in range(row_min, row_max + 1)
+        for col in range(col_min, col_max + 1)
+    ]
+    if negative_cache is not None:
+        coords = [(row, col) for row, col in coords
+                  if not negative_cache.is_empty(level, row, col)]
+    found = {}
 
     tile_dir = os.path.join(output_dir, f"L{level}")
-    os.makedirs(tile_dir, exist_ok=True)
-
-    for row in range(row_min, row_max + 1):
-        for col in range(col_min, col_max + 1):
-            count += 1
-            data = fetch_tile(layer, level, row, col)
-            if data is not None:
-                filename = os.path.join(tile_dir, f"R{row}_C{col}.bin")
+    if tile_cache is None or tile_cache.write_files:
+        os.makedirs(tile_dir, exist_ok=True)
+
+    to_fetch = []
+    for i, (row, col) in enumerate(coords):
+        data = tile_cache.get(layer, level, row, col) if tile_cache is not None else None
+        if data is None:
+            to_fetch.append(i)
+            continue
+        tile_cache.place(layer, level, row, col, os.path.join(tile_dir, f"R{row}_C{col}.bin"))
+        found[i] = (level, row, col, len(data))
+
+    total = len(to_fetch)
+    count = 0
+
+    def on_result(j, result):
+        nonlocal count
+        count += 1
+        i = to_fetch[j]
+        row, col = coords[i]
+        outcome, data = result
+        if negative_cache is not None:
+            if outcome == EMPTY:
+                negative_cache.add(level, row, col)
+            elif data is not None:
+                negative_cache.discard(level, row, col)
+        if data is not None:
+            filename = os.path.join(tile_dir, f"R{row}_C{col}.bin")
+            if tile_cache is not None:
+                tile_cache.store(layer, level, row, col, data, filename)
+            else:
                 with open(filename, "wb") as f:
                     f.write(data)
-                downloaded.append((level, row, col, len(data)))
-                sys.stdout.write(
-                    f"\r  L{level}: {count}/{total} | "
-                    f"R{row}_C{col}: {len(data):,} bytes | "
-                    f"Found: {len(downloaded)}  "
-                )
-                sys.stdout.flush()
-            else:
-                sys.stdout.write(
-                    f"\r  L{level}: {count}/{total} | "
-                    f"R{row}_C{col}: empty | "
-                    f"Found: {len(downloaded)}  "
-                )
-                sys.stdout.flush()
+            found[i] = (level, row, col, len(data))
+            status = f"{len(data):,} bytes"
+        else:
+            status = "empty"
+        sys.stdout.write(
+            f"\r  L{level}: {count}/{total} | "
+            f"R{row}_C{col}: {status} | "
+            f"Found: {len(found)}  "
+        )
+        sys.stdout.flush()
 
-            if delay > 0:
-                time.sleep(delay)
+    ENGINE.fetch_many(
+        [tile_query(layer, level, *coords[i]) for i in to_fetch],
+        on_result=on_result,
+        with_outcome=True,
+    )
 
     print()
-    return downloaded
+    # Row-major order, as the serial loop produced it
+    return [found[i] for i in sorted(found)]
 
 
 def analyze_binary(data, label=""):
@@ -286,6 +284,39 @@ def analyze_binary(data, label=""):
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description='Download NLSC 3D tiles for NYCU Guangfu Campus')
+    parser.add_argument('--rate', type=float, default=MAX_REQUESTS_PER_SECOND_PER_MIRROR,
+                        help='Max requests per second per NLSC mirror; backs off '
+                             'on 429 / 5xx / timeouts '
+                             f'(default: {MAX_REQUESTS_PER_SECOND_PER_MIRROR:g})')
+    parser.add_argument('--hedge-ratio', type=float, default=0.05,
+                        help='Max share of requests hedged to a second mirror '
+                             'after the p95 latency (default: 0.05, 0 = off)')
+    parser.add_argument('--refresh-tiles', action='store_true',
+                        help='Re-download tiles already in the shared tile cache')
+    parser.add_argument('--write-bin', action='store_true',
+                        help='Also write loose L*/R*_C*.bin files')
+    parser.add_argument('--refresh-empty', action='store_true',
+                        help='Re-request tiles cached as empty by earlier runs')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record-cassette', metavar='PATH',
+                          help='Record every oview answer into a cassette file; only a '
+                               'cold run (--refresh-tiles --refresh-empty) records a complete one')
+    cassette.add_argument('--replay-cassette', metavar='PATH',
+                          help='Answer from a recorded cassette, without network')
+    args = parser.parse_args()
+
+    ENGINE.limiter.set_rate(args.rate)
+    ENGINE.hedging.max_ratio = args.hedge_ratio
+    ENGINE.hedging.enabled = args.hedge_ratio > 0
+    # --record-cassette PATH saves every answer; --replay-cassette PATH
+    # re-runs offline from such a file (oview/cassette.py)
+    if args.record_cassette:
+        ENGINE.use_cassette(args.record_cassette, "record")
+    elif args.replay_cassette:
+        ENGINE.use_cassette(args.replay_cassette, "replay")
+
     output_dir = os.path.join(OUTPUT_DIR, f"NLSC_3D_tiles_{LAYER_NAME}")
     os.makedirs(output_dir, exist_ok=True)
 
@@ -298,6 +329,13 @@ def main():
     print()
 
     all_downloaded = []
+    negative_cache = NegativeCache.for_layer(
+        OUTPUT_DIR, LAYER_NAME, ttl_days=EMPTY_CACHE_TTL_DAYS,
+        refresh=args.refresh_empty)
+    # Shared with 06/08; --refresh-tiles downloads cached tiles again and
+    # --write-bin also writes the loose L*/R*_C*.bin files
+    tile_cache = TileCache.for_raw_dir(
+        OUTPUT_DIR, refresh=args.refresh_tiles, write_files=args.write_bin)
 
     # Step 1: Get layer info
     print("Step 1: Fetching layer metadata...")
@@ -318,7 +356,8 @@ def main():
         print(f"\nLevel {level}: R[{rmin}-{rmax}] x C[{cmin}-{cmax}]")
         tiles = download_level_range(
             LAYER_NAME, level, rmin, rmax, cmin, cmax,
-            output_dir, delay=0.05
+            output_dir, negative_cache=negative_cache,
+            tile_cache=tile_cache,
         )
         all_downloaded.extend(tiles)
         print(f"  Downloaded: {len(tiles)} tiles")
@@ -350,7 +389,8 @@ def main():
 
         tiles = download_level_range(
             LAYER_NAME, target_level, rmin, rmax, cmin, cmax,
-            output_dir, delay=0.03
+            output_dir, negative_cache=negative_cache,
+            tile_cache=tile_cache,
         )
         all_downloaded.extend(tiles)
         print(f"  Downloaded: {len(tiles)} tiles")
@@ -368,20 +408,16 @@ def main():
     if all_downloaded:
         largest = max(all_downloaded, key=lambda x: x[3])
         l, r, c, s = largest
-        sample_file = os.path.join(output_dir, f"L{l}", f"R{r}_C{c}.bin")
         print(f"\nLargest tile: L{l}/R{r}_C{c} ({s:,} bytes)")
-        with open(sample_file, "rb") as f:
-            sample_data = f.read()
+        sample_data = tile_cache.read(LAYER_NAME, l, r, c)
         analyze_binary(sample_data, f"L{l}/R{r}_C{c}")
 
         # Also analyze a mid-size tile
         mid_tiles = sorted(all_downloaded, key=lambda x: x[3])
         mid = mid_tiles[len(mid_tiles) // 2]
         l2, r2, c2, s2 = mid
-        sample_file2 = os.path.join(output_dir, f"L{l2}", f"R{r2}_C{c2}.bin")
         print(f"\nMid-size tile: L{l2}/R{r2}_C{c2} ({s2:,} bytes)")
-        with open(sample_file2, "rb") as f:
-            sample_data2 = f.read()
+        sample_data2 = tile_cache.read(LAYER_NAME, l2, r2, c2)
         analyze_binary(sample_data2, f"L{l2}/R{r2}_C{c2}")
 
     # Step 5: Also download terrain tiles for the same area
@@ -404,16 +440,22 @@ def main():
         t_dir = os.path.join(terrain_dir, f"L{level}")
         os.makedirs(t_dir, exist_ok=True)
 
-        for row in range(rmin, rmax + 1):
-            for col in range(cmin, cmax + 1):
-                data = fetch_terrain_tile(level, row, col)
-                if data:
-                    filename = os.path.join(t_dir, f"R{row}_C{col}.bin")
-                    with open(filename, "wb") as f:
-                        f.write(data)
-                    terrain_downloaded.append((level, row, col, len(data)))
-                    print(f"  Terrain L{level}/R{row}_C{col}: {len(data):,} bytes")
-                time.sleep(0.05)
+        coords = [
+            (row, col)
+            for row in range(rmin, rmax + 1)
+            for col in range(cmin, cmax + 1)
+        ]
+        results = ENGINE.fetch_many([
+            tile_query("2023_10M", level, row, col, "DEMNODE", kind="terrain")
+            for row, col in coords
+        ])
+        for (row, col), data in zip(coords, results):
+            if data:
+                filename = os.path.join(t_dir, f"R{row}_C{col}.bin")
+                with open(filename, "wb") as f:
+                    f.write(data)
+                terrain_downloaded.append((level, row, col, len(data)))
+                print(f"  Terrain L{level}/R{row}_C{col}: {len(data):,} bytes")
 
     # Summary
     print("\n" + "=" * 60)
@@ -422,6 +464,14 @@ def main():
 
     total_tiles = len(all_downloaded)
     total_bytes = sum(d[3] for d in all_downloaded)
+    negative_cache.save()
+    print(f"Requests:       {ENGINE.summary()}")
+    for line in ENGINE.report():
+        print(f"  {line}")
+    print(f"  {negative_cache.summary()}")
+    print(f"  {tile_cache.summary()}")
+    tile_cache.close()
+    ENGINE.close()
     print(f"Building tiles: {total_tiles}")
     print(f"Building data:  {total_bytes / 1024 / 1024:.2f} MB")
 
@@ -12,13 +12,21 @@ Tile coordinate formula (EPSG:4326, PilotGaea oview):
   Col = floor(lon * 2^L / 160)
   Row = floor(lat * 2^L / 60)
 """
-import gzip
 import json
 import math
 import os
 import sys
-import time
-import urllib.request
+
+from oview import DownloadEngine, tile_query
+from oview.covering import campus_covering
+from oview.engine import EMPTY
+from oview.layerprobe import DEFAULT_TTL_HOURS, LayerProbe
+from oview.negcache import DEFAULT_TTL_DAYS, NegativeCache
+from oview.ratelimit import DEFAULT_RATE
+from oview.scheduler import (RANK_OTHER, DownloadScheduler, FetchBatch, Wait, building_ranks,
+                             run_steps)
+from oview.tilecache import TileCache
+from oview.tilestore import TileStore
 
 if sys.stdout.encoding != 'utf-8':
     sys.stdout.reconfigure(encoding='utf-8')
@@ -63,14 +71,62 @@ CAMPUSES = {
     },
 }
 
-server_idx = 0
+# Requests kept in flight against each mirror (--per-mirror)
+ENGINE = DownloadEngine(SERVERS, HEADERS, per_mirror=4, timeout=30)
+
+# Per-layer caches of empty coordinates, shared by campuses on the same layer
+NEGATIVE_CACHES = {}
+EMPTY_CACHE_SETTINGS = {'ttl_days': DEFAULT_TTL_DAYS, 'refresh': False}
+
+# Layer-keyed tile cache shared with the other campuses and scripts 01, 08
+TILE_CACHES = {}
+TILE_CACHE_SETTINGS = {'refresh': False, 'write_files': False}
+
+
+def tile_cache_for(output_base_dir):
+    cache = TILE_CACHES.get(output_base_dir)
+    if cache is None:
+        cache = TILE_CACHES[output_base_dir] = TileCache.for_raw_dir(
+            output_base_dir, **TILE_CACHE_SETTINGS)
+    return cache
+
+
+# Grid cells skipped per campus because they lie outside its boundary polygon
+COVERING_SKIPPED = {}
+
+# Concurrent LAYER probes for every candidate layer of the requested campuses
+LAYER_PROBES = {}
+LAYER_PROBE_SETTINGS = {'ttl_hours': DEFAULT_TTL_HOURS, 'refresh': False}
+
+# Older years tried when a campus's layer is not published
+FALLBACK_YEARS = ['112', '111', '110', '109']
 
 
-def get_server():
-    global server_idx
-    server = SERVERS[server_idx % len(SERVERS)]
-    server_idx += 1
-    return server
+def layer_probe_for(output_base_dir):
+    probe = LAYER_PROBES.get(output_base_dir)
+    if probe is None:
+        probe = LAYER_PROBES[output_base_dir] = LayerProbe.for_raw_dir(
+            output_base_dir, ENGINE.companion(), **LAYER_PROBE_SETTINGS)
+    return probe
+
+
+def layer_candidates(campus):
+    """The campus's layer, then the same region in FALLBACK_YEARS."""
+    region = campus['layer'].split('_')[1]
+    candidates = [campus['layer']]
+    for year in FALLBACK_YEARS:
+        alt_layer = f'{year}_{region}'
+        if alt_layer not in candidates:
+            candidates.append(alt_layer)
+    return candidates
+
+
+def negative_cache_for(output_base_dir, layer):
+    cache = NEGATIVE_CACHES.get(layer)
+    if cache is None:
+        cache = NEGATIVE_CACHES[layer] = NegativeCache.for_layer(
+            output_base_dir, layer, **EMPTY_CACHE_SETTINGS)
+    return cache
 
 
 def lonlat_to_tile(lon, lat, level):
@@ -94,50 +150,113 @@ def bbox_to_tile_range(bbox, level, buffer_tiles=1):
 
 
 def fetch_tile(layer, level, row, col, retries=2):
-    for attempt in range(retries + 1):
-        server = get_server()
-        url = (
-            f"{server}?type=modelset&format=integrate"
-            f"&name={layer}&level={level}&Row={row}&Col={col}"
-            f"&docname=NODE&epsg=4326"
-        )
-        req = urllib.request.Request(url, headers=HEADERS)
-        try:
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                if resp.status == 200:
-                    data = resp.read()
-                    if len(data) > 0:
-                        return data
-                return None
-        except Exception:
-            if attempt < retries:
-                time.sleep(0.5)
+    return ENGINE.fetch_one(tile_query(layer, level, row, col), retries=retries)
+
+
+def download_tile_grid(*args, **kwargs):
+    """download_tile_grid_steps() run on ENGINE; returns the tile records."""
+    return run_steps(download_tile_grid_steps(*args, **kwargs), ENGINE)
+
+
+def download_tile_grid_steps(campus_key, layer, level, r_min, r_max, c_min, c_max,
+                             tile_dir, progress=True, negative_cache=None,
+                             covering=None, tile_cache=None):
+    """
+    Download every tile in R[r_min-r_max] x C[c_min-c_max] concurrently
+    (a steps generator, see oview/scheduler.py).
+
+    Coordinates known to be empty from `negative_cache`, and with a
+    `covering` the cells outside the campus boundary, are skipped. Tiles in
+    `tile_cache` are reused instead of fetched, and fetched tiles are stored
+    there (tile_dir only gets .bin files when the cache writes them).
+    Returns tile records in row-major order, as the serial loop produced them.
+    """
+    coords = [
+        (row, col)
+        for row in range(r_min, r_max + 1)
+        for col in range(c_min, c_max + 1)
+    ]
+    if covering is not None:
+        inside = [(row, col) for row, col in coords
+                  if covering.overlaps_tile(level, row, col)]
+        COVERING_SKIPPED[campus_key] = (COVERING_SKIPPED.get(campus_key, 0)
+                                        + len(coords) - len(inside))
+        coords = inside
+    if negative_cache is not None:
+        coords = [(row, col) for row, col in coords
+                  if not negative_cache.is_empty(level, row, col)]
+    found = {}
+
+    def record(row, col, size):
+        return {
+            'campus': campus_key,
+            'level': level,
+            'row': row,
+            'col': col,
+            'size': size,
+        }
+
+    # Tiles another campus or script already fetched are reused, not fetched
+    to_fetch = []
+    for i, (row, col) in enumerate(coords):
+        data = tile_cache.get(layer, level, row, col) if tile_cache is not None else None
+        if data is None:
+            to_fetch.append(i)
             continue
-    return None
-
+        tile_cache.place(layer, level, row, col, os.path.join(tile_dir, f'R{row}_C{col}.bin'))
+        found[i] = record(row, col, len(data))
+
+    total = len(to_fetch)
+    count = 0
+
+    def on_result(j, result):
+        nonlocal count
+        count += 1
+        i = to_fetch[j]
+        row, col = coords[i]
+        outcome, data = result
+        if negative_cache is not None:
+            if outcome == EMPTY:
+                negative_cache.add(level, row, col)
+            elif data is not None:
+                negative_cache.discard(level, row, col)
+        if data is not None:
+            filename = os.path.join(tile_dir, f'R{row}_C{col}.bin')
+            if tile_cache is not None:
+                tile_cache.store(layer, level, row, col, data, filename)
+            else:
+                os.makedirs(tile_dir, exist_ok=True)
+                with open(filename, 'wb') as f:
+                    f.write(data)
+            found[i] = record(row, col, len(data))
+            status = f'{len(data):,} bytes'
+        else:
+            status = 'empty'
+        if progress:
+            sys.stdout.write(
+                f'\r  L{level}: {count}/{total} | '
+                f'R{row}_C{col}: {status} | '
+                f'Found: {len(found)}  '
+            )
+        else:
+            sys.stdout.write(f'\r  L{level}: {count}/{total} | Found: {len(found)}  ')
+        sys.stdout.flush()
 
-def fetch_layer_info(layer):
-    server = get_server()
-    url = (
-        f"{server}?type=modelset&format=integrate"
-        f"&name={layer}&docname=LAYER"
+    yield FetchBatch(
+        [tile_query(layer, level, *coords[i]) for i in to_fetch],
+        on_result=on_result,
+        with_outcome=True,
     )
-    req = urllib.request.Request(url, headers=HEADERS)
-    try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            if resp.status == 200:
-                data = resp.read()
-                try:
-                    data = gzip.decompress(data)
-                except Exception:
-                    pass
-                return data
-    except Exception as e:
-        return None
-
-
-def download_campus(campus_key, output_base_dir, levels=(5, 6, 7)):
-    """Download tiles for a specific campus."""
+    return [found[i] for i in sorted(found)]
+
+
+def download_campus(*args, **kwargs):
+    """download_campus_steps() run on ENGINE; returns the tile records."""
+    return run_steps(download_campus_steps(*args, **kwargs), ENGINE)
+
+
+def download_campus_steps(campus_key, output_base_dir, levels=(5, 6, 7)):
+    """Download tiles for a specific campus (a steps generator)."""
     campus = CAMPUSES[campus_key]
     name = campus['name']
     layer = campus['layer']
@@ -149,23 +268,18 @@ def download_campus(campus_key, output_base_dir, levels=(5, 6, 7)):
     print(f'BBox: {bbox}')
     print(f'{"=" * 60}')
 
-    # Check if layer exists
+    # Check if layer exists; the year fallbacks are probed at the same time
     print(f'\nChecking layer {layer}...')
-    layer_data = fetch_layer_info(layer)
-    if not layer_data:
+    probe = layer_probe_for(output_base_dir)
+    found_layer, layer_data = yield Wait(probe.first_available, layer_candidates(campus))
+    if found_layer is None:
         print(f'  WARNING: Layer {layer} not available or returned empty data.')
-        print(f'  Trying alternative layer names...')
-        # Try without year prefix
-        for year in ['112', '111', '110', '109']:
-            alt_layer = f"{year}_{layer.split('_')[1]}"
-            layer_data = fetch_layer_info(alt_layer)
-            if layer_data:
-                print(f'  Found alternative: {alt_layer}')
-                layer = alt_layer
-                break
-        if not layer_data:
-            print(f'  FAILED: No available layer found. Skipping campus.')
-            return []
+        print(f'  FAILED: No available layer found. Skipping campus.')
+        return []
+    if found_layer != layer:
+        print(f'  WARNING: Layer {layer} not available or returned empty data.')
+        print(f'  Found alternative: {found_layer}')
+        layer = found_layer
 
     print(f'  Layer {layer} exists ({len(layer_data):,} bytes metadata)')
 
@@ -179,6 +293,16 @@ def download_campus(campus_key, output_base_dir, levels=(5, 6, 7)):
         f.write(layer_data)
 
     all_downloaded = []
+    negative_cache = negative_cache_for(output_base_dir, layer)
+    tile_cache = tile_cache_for(output_base_dir)
+
+    # Campus boundary polygon, if data/boundaries/<campus>.geojson exists
+    covering, is_polygon = campus_covering(
+        os.path.dirname(output_base_dir), campus_key, bbox)
+    if is_polygon:
+        print(f'  Boundary: {covering.name} (grid cells outside it are skipped)')
+    else:
+        covering = None
 
     for level in levels:
         r_min, r_max, c_min, c_max = bbox_to_tile_range(bbox, level, buffer_tiles=1)
@@ -186,40 +310,15 @@ def download_campus(campus_key, output_base_dir, levels=(5, 6, 7)):
         print(f'\nLevel {level}: R[{r_min}-{r_max}] x C[{c_min}-{c_max}] ({total} tiles)')
 
         tile_dir = os.path.join(output_dir, f'L{level}')
-        os.makedirs(tile_dir, exist_ok=True)
-
-        count = 0
-        found = 0
-        for row in range(r_min, r_max + 1):
-            for col in range(c_min, c_max + 1):
-                count += 1
-                data = fetch_tile(layer, level, row, col)
-                if data is not None:
-                    filename = os.path.join(tile_dir, f'R{row}_C{col}.bin')
-                    with open(filename, 'wb') as f:
-                        f.write(data)
-                    all_downloaded.append({
-                        'campus': campus_key,
-                        'level': level,
-                        'row': row,
-                        'col': col,
-                        'size': len(data),
-                    })
-                    found += 1
-                    sys.stdout.write(
-                        f'\r  L{level}: {count}/{total} | '
-                        f'R{row}_C{col}: {len(data):,} bytes | '
-                        f'Found: {found}  '
-                    )
-                    sys.stdout.flush()
-                else:
-                    sys.stdout.write(
-                        f'\r  L{level}: {count}/{total} | '
-                        f'R{row}_C{col}: empty | '
-                        f'Found: {found}  '
-                    )
-                    sys.stdout.flush()
-                time.sleep(0.05)
+        if tile_cache.write_files:
+            os.makedirs(tile_dir, exist_ok=True)
+
+        tiles = yield from download_tile_grid_steps(campus_key, layer, level, r_min, r_max,
+                                   c_min, c_max, tile_dir,
+                                   negative_cache=negative_cache, covering=covering,
+                                   tile_cache=tile_cache)
+        all_downloaded.extend(tiles)
+        found = len(tiles)
 
         print(f'\r  Level {level}: {found} tiles downloaded' + ' ' * 40)
 
@@ -252,38 +351,26 @@ def download_campus(campus_key, output_base_dir, levels=(5, 6, 7)):
                 print(f'\n  Level {target_level}: R[{rmin}-{rmax}] x C[{cmin}-{cmax}] ({total} tiles)')
 
                 tile_dir = os.path.join(output_dir, f'L{target_level}')
-                os.makedirs(tile_dir, exist_ok=True)
+                if tile_cache.write_files:
+                    os.makedirs(tile_dir, exist_ok=True)
 
-                count = 0
-                found = 0
-                for row in range(rmin, rmax + 1):
-                    for col in range(cmin, cmax + 1):
-                        count += 1
-                        data = fetch_tile(layer, target_level, row, col)
-                        if data is not None:
-                            filename = os.path.join(tile_dir, f'R{row}_C{col}.bin')
-                            with open(filename, 'wb') as f:
-                                f.write(data)
-                            all_downloaded.append({
-                                'campus': campus_key,
-                                'level': target_level,
-                                'row': row,
-                                'col': col,
-                                'size': len(data),
-                            })
-                            found += 1
-                        time.sleep(0.03)
-
-                    sys.stdout.write(
-                        f'\r  L{target_level}: {count}/{total} | Found: {found}  '
-                    )
-                    sys.stdout.flush()
+                tiles = yield from download_tile_grid_steps(campus_key, layer, target_level,
+                                           rmin, rmax, cmin, cmax, tile_dir,
+                                           progress=False,
+                                           negative_cache=negative_cache,
+                                           covering=covering, tile_cache=tile_cache)
+                all_downloaded.extend(tiles)
+                found = len(tiles)
 
                 print(f'\r  Level {target_level}: {found} tiles downloaded' + ' ' * 40)
 
                 if found == 0:
                     break
 
+    negative_cache.save()
+    # The manifest lists tiles by coordinate; make them visible in the store
+    tile_cache.commit()
+
     # Save manifest
     total_bytes = sum(t['size'] for t in all_downloaded)
     manifest = {
@@ -308,6 +395,34 @@ def download_campus(campus_key, output_base_dir, levels=(5, 6, 7)):
     return all_downloaded
 
 
+def campus_priority(campus_key, output_base_dir):
+    """
+    (priority, expected) for a scheduler job. This script's manifests do not
+    record BUILD_ID, so the tile store's has_build_id flags of the tiles in
+    the campus's previous manifest rank them (building_ranks); the job is
+    expected to find as many tiles as that manifest lists. (None, None)
+    without a previous manifest.
+    """
+    candidates = layer_candidates(CAMPUSES[campus_key])
+    for layer in candidates:
+        path = os.path.join(output_base_dir, f'NLSC_3D_tiles_{layer}_{campus_key}',
+                            'manifest.json')
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            tiles = json.load(f).get('tiles', [])
+        records = []
+        if TileStore.exists(output_base_dir, layer):
+            store = tile_cache_for(output_base_dir).store_for(layer)
+            for t in tiles:
+                info = store.info(t['level'], t['row'], t['col'])
+                if info is not None:
+                    records.append(dict(t, has_build_id=info['has_build_id']))
+        ranks = building_ranks(records, candidates)
+        return (lambda query: ranks.get(query, RANK_OTHER)), len(tiles) or None
+    return None, None
+
+
 def main():
     project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     output_base_dir = os.path.join(project_dir, 'data', 'raw')
@@ -324,8 +439,55 @@ def main():
                         help=f'Campus keys to download: {list(CAMPUSES.keys())}')
     parser.add_argument('--levels', type=str, default='5,6,7',
                         help='Comma-separated levels to download (default: 5,6,7)')
+    parser.add_argument('--per-mirror', type=int, default=4,
+                        help='Requests in flight per NLSC mirror (default: 4)')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help='Max requests per second per NLSC mirror; backs off '
+                             f'on 429 / 5xx / timeouts (default: {DEFAULT_RATE:g})')
+    parser.add_argument('--hedge-ratio', type=float, default=0.05,
+                        help='Max share of requests hedged to a second mirror '
+                             'after the p95 latency (default: 0.05, 0 = off)')
+    parser.add_argument('--refresh-tiles', action='store_true',
+                        help='Re-download tiles already in the shared tile cache')
+    parser.add_argument('--write-bin', action='store_true',
+                        help='Also write loose L*/R*_C*.bin files into each campus folder')
+    parser.add_argument('--refresh-empty', action='store_true',
+                        help='Re-request tiles cached as empty by earlier runs')
+    parser.add_argument('--empty-ttl-days', type=float, default=DEFAULT_TTL_DAYS,
+                        help='Days an empty tile stays cached '
+                             f'(default: {DEFAULT_TTL_DAYS:g})')
+    parser.add_argument('--refresh-layers', action='store_true',
+                        help='Probe layers cached as missing by earlier runs again')
+    parser.add_argument('--layer-ttl-hours', type=float, default=DEFAULT_TTL_HOURS,
+                        help='Hours a missing layer stays cached '
+                             f'(default: {DEFAULT_TTL_HOURS:g})')
+    parser.add_argument('--sequential', action='store_true',
+                        help='Download one campus after another instead of all '
+                             'campuses from one priority queue')
+    parser.add_argument('--progress-interval', type=float, default=5.0,
+                        help='Seconds between per-campus progress / ETA lines '
+                             '(default: 5, 0 = off)')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record-cassette', metavar='PATH',
+                          help='Record every oview answer into a cassette file; only a '
+                               'cold run (--refresh-tiles --refresh-empty) records a complete one')
+    cassette.add_argument('--replay-cassette', metavar='PATH',
+                          help='Answer from a recorded cassette, without network')
     args = parser.parse_args()
 
+    ENGINE.per_mirror = max(1, args.per_mirror)
+    ENGINE.limiter.set_rate(args.rate)
+    if args.record_cassette:
+        ENGINE.use_cassette(args.record_cassette, 'record')
+    elif args.replay_cassette:
+        ENGINE.use_cassette(args.replay_cassette, 'replay')
+    ENGINE.hedging.max_ratio = args.hedge_ratio
+    ENGINE.hedging.enabled = args.hedge_ratio > 0
+    EMPTY_CACHE_SETTINGS.update(ttl_days=args.empty_ttl_days,
+                                refresh=args.refresh_empty)
+    TILE_CACHE_SETTINGS.update(refresh=args.refresh_tiles, write_files=args.write_bin)
+    LAYER_PROBE_SETTINGS.update(ttl_hours=args.layer_ttl_hours, refresh=args.refresh_layers)
+
     levels = tuple(int(x) for x in args.levels.split(','))
 
     print(f'\nCampuses to download:')
@@ -336,12 +498,33 @@ def main():
         else:
             print(f'  - {key}: UNKNOWN (skipping)')
 
+    # Probe the candidate layers of all campuses at once, in the background
+    layer_probe_for(output_base_dir).start(
+        [layer for key in args.campuses if key in CAMPUSES
+         for layer in layer_candidates(CAMPUSES[key])])
+
     all_results = {}
-    for key in args.campuses:
-        if key not in CAMPUSES:
-            continue
-        tiles = download_campus(key, output_base_dir, levels=levels)
-        all_results[key] = tiles
+    scheduler = None
+    if args.sequential:
+        for key in args.campuses:
+            if key not in CAMPUSES:
+                continue
+            tiles = download_campus(key, output_base_dir, levels=levels)
+            all_results[key] = tiles
+    else:
+        # All campuses at once, sharing ENGINE's slots and rate
+        scheduler = DownloadScheduler(ENGINE, progress_interval=args.progress_interval)
+        for key in args.campuses:
+            if key not in CAMPUSES:
+                continue
+            priority, expected = campus_priority(key, output_base_dir)
+            scheduler.add(key, download_campus_steps(key, output_base_dir, levels=levels),
+                          priority=priority, expected=expected)
+        print(f'\nScheduling {len(scheduler.jobs)} campuses from one priority queue '
+              f'(BUILD_ID tiles of earlier runs first)')
+        scheduler.run()
+        for job in scheduler.jobs:
+            all_results[job.name] = job.result or []
 
     # Summary
     print(f'\n{"=" * 60}')
@@ -355,9 +538,28 @@ def main():
         grand_total_tiles += len(tiles)
         grand_total_bytes += total_bytes
         status = f'{len(tiles)} tiles, {total_bytes / 1024 / 1024:.2f} MB' if tiles else 'FAILED'
+        if key in COVERING_SKIPPED:
+            status += f' ({COVERING_SKIPPED[key]} grid tiles outside boundary skipped)'
         print(f'  {campus["name"]}: {status}')
 
     print(f'\n  Grand total: {grand_total_tiles} tiles, {grand_total_bytes / 1024 / 1024:.2f} MB')
+    print(f'  Requests: {ENGINE.summary()}')
+    if scheduler is not None:
+        print(f'    {scheduler.summary()}')
+        for line in scheduler.progress_lines():
+            print(f'    {line}')
+    for line in ENGINE.report():
+        print(f'    {line}')
+    for layer in sorted(NEGATIVE_CACHES):
+        print(f'    {NEGATIVE_CACHES[layer].summary()}')
+    for cache in TILE_CACHES.values():
+        print(f'    {cache.summary()}')
+        cache.close()
+    for probe in LAYER_PROBES.values():
+        probe.save()
+        print(f'    {probe.summary()}')
+        probe.engine.close()
+    ENGINE.close()
 
 
 if __name__ == '__main__':
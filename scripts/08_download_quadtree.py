@@ -17,15 +17,29 @@ Usage:
   python scripts/08_download_quadtree.py boai yangming gueiren
   python scripts/08_download_quadtree.py --all-layers gueiren
 """
-import collections
-import gzip
+import functools
+import glob
 import json
 import math
 import os
-import struct
 import sys
-import time
-import urllib.request
+
+from nlsc_tile import field_projection, header_info, parse_tile_columns
+from oview import DownloadEngine, tile_query
+from oview.covering import (Covering, boundary_path, campus_covering,
+                            covering_savings)
+from oview.engine import EMPTY, FAILED, NOT_MODIFIED
+from oview.journal import FetchJournal, read_valid_tile, tile_path
+from oview.layerinfo import parse_layer_info, previous_fingerprint
+from oview.layerprobe import DEFAULT_TTL_HOURS, LayerProbe
+from oview.negcache import DEFAULT_TTL_DAYS, NegativeCache
+from oview.pipeline import (DEFAULT_QUEUE_SIZE, PARSE_CAMPUSES, TILE_MARGIN, BuildingCollector,
+                            ParsePipeline, save_campus_buildings)
+from oview.ratelimit import DEFAULT_RATE
+from oview.scheduler import (RANK_OTHER, DownloadScheduler, FetchBatch, Wait,
+                             building_ranks, run_steps)
+from oview.tilecache import TileCache
+from oview.tilestore import dataset_order
 
 if sys.stdout.encoding != 'utf-8':
     sys.stdout.reconfigure(encoding='utf-8')
@@ -83,77 +97,51 @@ CAMPUSES = {
     },
 }
 
-server_idx = 0
+# Requests kept in flight against each mirror (--per-mirror)
+# and the request rate ceiling per mirror (--rate)
+ENGINE = DownloadEngine(SERVERS, HEADERS, per_mirror=4, timeout=20, rate=DEFAULT_RATE)
 
+# Per-layer caches of empty coordinates, shared by campuses on the same layer
+NEGATIVE_CACHES = {}
+EMPTY_CACHE_SETTINGS = {'ttl_days': DEFAULT_TTL_DAYS, 'refresh': False}
 
-def get_server():
-    global server_idx
-    server = SERVERS[server_idx % len(SERVERS)]
-    server_idx += 1
-    return server
 
+# Layer-keyed tile cache shared by all campuses (and scripts 01, 06)
+TILE_CACHES = {}
+TILE_CACHE_SETTINGS = {'refresh': False, 'write_files': False}
 
-def fetch_tile(layer, level, row, col, retries=2):
-    """Fetch a single tile from the NLSC oview server."""
-    for attempt in range(retries + 1):
-        server = get_server()
-        url = (
-            f"{server}?type=modelset&format=integrate"
-            f"&name={layer}&level={level}&Row={row}&Col={col}"
-            f"&docname=NODE&epsg=4326"
-        )
-        req = urllib.request.Request(url, headers=HEADERS)
-        try:
-            with urllib.request.urlopen(req, timeout=20) as resp:
-                if resp.status == 200:
-                    data = resp.read()
-                    if len(data) > 0:
-                        return data
-                return None
-        except Exception:
-            if attempt < retries:
-                time.sleep(0.5)
-            continue
-    return None
 
+def tile_cache_for(raw_dir):
+    cache = TILE_CACHES.get(raw_dir)
+    if cache is None:
+        cache = TILE_CACHES[raw_dir] = TileCache.for_raw_dir(raw_dir, **TILE_CACHE_SETTINGS)
+    return cache
+
+
+# Concurrent LAYER probes for every candidate layer of the requested campuses
+LAYER_PROBES = {}
+LAYER_PROBE_SETTINGS = {'ttl_hours': DEFAULT_TTL_HOURS, 'refresh': False}
+
+
+def layer_probe_for(raw_dir):
+    probe = LAYER_PROBES.get(raw_dir)
+    if probe is None:
+        probe = LAYER_PROBES[raw_dir] = LayerProbe.for_raw_dir(
+            raw_dir, ENGINE.companion(), **LAYER_PROBE_SETTINGS)
+    return probe
+
+
+def negative_cache_for(raw_dir, layer):
+    cache = NEGATIVE_CACHES.get(layer)
+    if cache is None:
+        cache = NEGATIVE_CACHES[layer] = NegativeCache.for_layer(
+            raw_dir, layer, **EMPTY_CACHE_SETTINGS)
+    return cache
 
-def fetch_layer_info(layer):
-    """Fetch layer metadata."""
-    server = get_server()
-    url = (
-        f"{server}?type=modelset&format=integrate"
-        f"&name={layer}&docname=LAYER"
-    )
-    req = urllib.request.Request(url, headers=HEADERS)
-    try:
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            if resp.status == 200:
-                data = resp.read()
-                if len(data) > 0:
-                    try:
-                        data = gzip.decompress(data)
-                    except Exception:
-                        pass
-                    return data
-    except Exception:
-        pass
-    return None
-
-
-def tile_geo_bbox(level, row, col):
-    """
-    Calculate geographic bounding box of a tile.
-    PilotGaea formula: Col = floor(lon * 2^L / 160), Row = floor(lat * 2^L / 60)
-    Inverse: lon = [C * 160/2^L, (C+1) * 160/2^L], lat = [R * 60/2^L, (R+1) * 60/2^L]
-    """
-    lon_size = 160.0 / (2 ** level)
-    lat_size = 60.0 / (2 ** level)
-    return (
-        col * lon_size,           # lon_min
-        (col + 1) * lon_size,     # lon_max
-        row * lat_size,           # lat_min
-        (row + 1) * lat_size,     # lat_max
-    )
+
+def fetch_tile(layer, level, row, col, retries=2):
+    """Fetch a single tile from the NLSC oview server."""
+    return ENGINE.fetch_one(tile_query(layer, level, row, col), retries=retries)
 
 
 def bbox_overlap(bbox1, bbox2):
@@ -164,123 +152,451 @@ def bbox_overlap(bbox1, bbox2):
 
 def parse_tile_header(data):
     """Parse tile header to get level, row, col, and children."""
-    if data[:2] == b'\x1f\x8b':
-        try:
-            data = gzip.decompress(data)
-        except Exception:
-            pass
-
-    info = {'size': len(data)}
-    if len(data) >= 12:
-        info['level'], info['row'], info['col'] = struct.unpack_from('<III', data, 0)
-
-    # Children at offset 228
-    if len(data) >= 232:
-        child_count = struct.unpack_from('<I', data, 228)[0]
-        if 0 < child_count <= 10:
-            children = []
-            for i in range(child_count):
-                if 232 + i * 4 + 4 <= len(data):
-                    children.append(struct.unpack_from('<I', data, 232 + i * 4)[0])
-            info['children'] = children
-        else:
-            info['children'] = []
-    else:
-        info['children'] = []
+    return header_info(data)
+
+
+# Child quadrants (dr, dc) of a tile, probed for every tile with children
+ALL_QUADRANTS = ((0, 0), (0, 1), (1, 0), (1, 1))
+
+
+def save_tile(output_dir, level, row, col, data, layer=None, tile_cache=None,
+              validators=None):
+    """
+    Write a tile atomically so an interrupted run never leaves half a file.
+    With a tile_cache the tile is stored there once per layer instead (and
+    written to output_dir only if the cache writes .bin files), together
+    with the response's ETag / Last-Modified for later conditional requests.
+    """
+    filename = tile_path(output_dir, level, row, col)
+    if tile_cache is not None:
+        tile_cache.store(layer, level, row, col, data, filename, validators)
+        return
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = filename + '.part'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+
+
+def _tile_record(level, row, col, size, info):
+    return {
+        'level': level, 'row': row, 'col': col,
+        'size': size,
+        'has_build_id': info['has_build_id'],
+        'children': info.get('children', []),
+    }
+
+
+def replay_prefetch_steps(layer, manifest, output_dir, journal, tile_cache=None):
+    """
+    Fetch every tile listed in a previous manifest at once and compare each
+    tile's children with the stored list (a steps generator, see
+    oview/scheduler.py).
+
+    Nothing is stored or journaled here: a known tile the new tree no longer
+    reaches must not end up in the download, so the BFS saves each tile
+    (and journals each empty answer) when it gets to it.
+
+    Returns (prefetched, trusted, requests):
+      prefetched  key -> (size, header info, tile bytes), or None if the
+                  tile is now empty. Tiles whose request failed are left
+                  out, so the BFS requests them again.
+      trusted     key -> child keys recorded in the manifest, for tiles
+                  whose child list is unchanged. The BFS follows only these
+                  children instead of probing all four quadrants.
+      requests    tile requests made
+    """
+    stored = {(t['level'], t['row'], t['col']): t for t in manifest['tiles']}
+    known = list(stored)
+    prefetched = {}
+
+    def on_result(i, result):
+        level, row, col = known[i]
+        outcome, data = result
+        if outcome == FAILED:
+            return
+        if data is None or len(data) < 12:
+            prefetched[known[i]] = None
+            return
+        prefetched[known[i]] = (len(data), parse_tile_header(data), data)
+        sys.stdout.write(f'\r  Replay: {len(prefetched)}/{len(known)} known tiles  ')
+        sys.stdout.flush()
+
+    yield FetchBatch(
+        [tile_query(layer, *key) for key in known],
+        on_result=on_result,
+        with_outcome=True,
+    )
+
+    # Tiles at the old max_level were never expanded, so nothing below
+    # them is known
+    old_max_level = manifest.get('max_level', 15)
+    trusted = {}
+    changed = 0
+    for key, t in stored.items():
+        entry = prefetched.get(key)
+        if entry is None or entry[1].get('children', []) != t['children']:
+            changed += 1
+            continue
+        if key[0] >= old_max_level:
+            continue
+        level, row, col = key
+        trusted[key] = [
+            (level + 1, 2 * row + dr, 2 * col + dc)
+            for dr, dc in ALL_QUADRANTS
+            if (level + 1, 2 * row + dr, 2 * col + dc) in stored
+        ]
+
+    print(f'\n  Replay: {len(prefetched)} of {len(known)} known tiles fetched, '
+          f'{changed} changed, removed or failed (BFS below them)')
+    return prefetched, trusted, len(known)
+
+
+def _below_changed(key, prefetched, trusted):
+    """
+    True if key's parent was refetched by a replay and its children changed:
+    an empty answer cached for key before the change may be stale.
+    """
+    level, row, col = key
+    if level == 0:
+        return False
+    parent = (level - 1, row // 2, col // 2)
+    return prefetched.get(parent) is not None and parent not in trusted
+
+
+def _stored_children(stored, key, old_max_level):
+    """Child keys of `key` recorded in a manifest, or None if never expanded."""
+    level, row, col = key
+    if level >= old_max_level:
+        return None
+    return [(level + 1, 2 * row + dr, 2 * col + dc) for dr, dc in ALL_QUADRANTS
+            if (level + 1, 2 * row + dr, 2 * col + dc) in stored]
+
+
+def incremental_prefetch_steps(layer, manifest, output_dir, journal, tile_cache,
+                               layer_unchanged=False):
+    """
+    Walk a previous manifest top-down and re-fetch only where something
+    changed (a steps generator).
+
+    A tile is requested conditionally (its stored ETag / Last-Modified, see
+    oview/engine.py) only if its parent changed; the root is always checked
+    unless the LAYER document is unchanged. A tile that comes back 304, or
+    with the same SHA-256 as the stored copy, is unchanged, and so is its
+    whole stored subtree: those tiles are taken from the manifest and the
+    tile store without a request. Tiles missing from the store are
+    requested after all.
+
+    Returns (prefetched, trusted, requests) like replay_prefetch_steps(),
+    except that the tiles are stored and journaled already (their bytes
+    are None); empty answers are journaled by the BFS. The BFS then probes
+    new quadrants only below changed tiles.
+    """
+    stored = {(t['level'], t['row'], t['col']): t for t in manifest['tiles']}
+    old_max_level = manifest.get('max_level', 15)
+    prefetched, trusted = {}, {}
+    counts = {'unchanged': 0, 'not_modified': 0, 'changed': 0, 'reused': 0}
+    requests = 0
+
+    def keep(key, place=True):
+        """Record an unchanged tile from the manifest; returns its stored children."""
+        t = stored[key]
+        info = {'has_build_id': t['has_build_id'], 'children': t['children']}
+        prefetched[key] = (t['size'], info, None)
+        journal.record_tile(_tile_record(*key, t['size'], info))
+        if place:
+            tile_cache.place(layer, *key, tile_path(output_dir, *key))
+        children = _stored_children(stored, key, old_max_level)
+        if children is not None:
+            trusted[key] = children
+        return children or []
+
+    root = (0, 0, 0)
+    reuse, check = ([root], []) if layer_unchanged else ([], [root])
+    reuse = [k for k in reuse if k in stored]
+    check = [k for k in check if k in stored]
+    store = tile_cache.store_for(layer)
+    while reuse or check:
+        next_reuse, next_check = [], []
+
+        # Inside an unchanged subtree: no request unless the store lacks it
+        for key in reuse:
+            info = store.info(*key)
+            if info is None or info['size'] != stored[key]['size']:
+                check.append(key)
+                continue
+            counts['reused'] += 1
+            next_reuse += keep(key)
+
+        def on_result(i, result):
+            key = check[i]
+            outcome, data, validators = result
+            if outcome == FAILED:
+                return      # left to the BFS
+            if outcome == NOT_MODIFIED:
+                counts['not_modified'] += 1
+                store.touch(*key, validators)
+                next_reuse.extend(keep(key))
+                return
+            if data is None or len(data) < 12:
+                prefetched[key] = None
+                counts['changed'] += 1
+                return
+            if not tile_cache.store(layer, *key, data, tile_path(output_dir, *key),
+                                    validators):
+                counts['unchanged'] += 1
+                next_reuse.extend(keep(key, place=False))
+                return
+            counts['changed'] += 1
+            info = parse_tile_header(data)
+            journal.record_tile(_tile_record(*key, len(data), info))
+            prefetched[key] = (len(data), info, None)
+            next_check.extend(_stored_children(stored, key, old_max_level) or [])
+
+        requests += len(check)
+        yield FetchBatch(
+            [tile_query(layer, *key) for key in check],
+            on_result=on_result,
+            validators=[store.validators(*key) for key in check],
+        )
+        sys.stdout.write(f'\r  Incremental: {len(prefetched)}/{len(stored)} known tiles, '
+                         f'{requests} requests  ')
+        sys.stdout.flush()
+        reuse, check = next_reuse, next_check
+
+    print(f'\n  Incremental: {counts["reused"]} tiles reused without a request, '
+          f'{counts["not_modified"]} not modified (304), {counts["unchanged"]} '
+          f'unchanged by hash, {counts["changed"]} changed or removed')
+    return prefetched, trusted, requests
 
-    info['has_build_id'] = b'BUILD_ID' in data
-    return info
 
+def quadtree_download(*args, **kwargs):
+    """quadtree_download_steps() run on ENGINE; returns the tile records."""
+    return run_steps(quadtree_download_steps(*args, **kwargs), ENGINE)
 
-def quadtree_download(layer, target_bbox, output_dir, max_level=15, margin=0.02):
+
+def quadtree_download_steps(layer, target_bbox, output_dir, max_level=15, margin=0.02,
+                            resume=True, negative_cache=None,
+                            replay=None, covering=None, tile_cache=None, incremental=False,
+                            layer_unchanged=False, on_tile=None, wait_tiles=None):
     """
-    Download tiles by BFS quadtree traversal from root L0 R0 C0.
+    Download tiles by BFS quadtree traversal from root L0 R0 C0 (a steps
+    generator: each level is yielded as one FetchBatch, see
+    oview/scheduler.py).
 
     At each level, only follows branches that geographically overlap the
     target bbox (expanded by margin). This ensures complete coverage while
-    being efficient.
+    being efficient. A `covering` (campus boundary polygons, see
+    oview/covering.py) replaces the bbox test when given.
+
+    The traversal is level-synchronous: the tiles of one level do not depend
+    on each other, so the whole frontier is fetched concurrently and the
+    next frontier is built from their children lists once the level is
+    done. Tiles are recorded in the order a one-at-a-time BFS visits them,
+    so manifest.json does not change.
+
+    Every fetched tile (and every empty response) is appended to
+    fetch_journal.jsonl as it happens. With resume=True a restarted run
+    replays the journal, reuses tiles already on disk or in the tile store
+    and only requests the tiles that are still missing. Coordinates in
+    `negative_cache` (empty in an earlier run, possibly for another campus)
+    are not requested at all (except below a tile a refresh found changed),
+    and tiles already in `tile_cache` (the layer-keyed cache shared with the
+    other campuses and downloaders) are reused instead of fetched.
+
+    With `replay` (a previous manifest for the same layer and bbox) the
+    known tiles are prefetched in one batch (replay_prefetch_steps) and the BFS
+    only probes quadrants below tiles whose child list changed. Replay is a
+    refresh: the journal and stored tiles of earlier runs are not reused.
+    With `incremental` as well, incremental_prefetch_steps() replaces the batch:
+    only subtrees below changed tiles are requested (none at all when
+    `layer_unchanged`, i.e. the LAYER document has the fingerprint the
+    previous manifest was made with).
+
+    on_tile(level, row, col, data) is called for every tile of the result
+    as soon as its bytes are at hand (--parse feeds the parse pipeline).
+    When it returns True (its queue is full) the BFS yields
+    Wait(wait_tiles) before going on, at the latest after the level's batch.
     """
-    expanded_bbox = (
-        target_bbox[0] - margin,
-        target_bbox[1] + margin,
-        target_bbox[2] - margin,
-        target_bbox[3] + margin,
-    )
+    if covering is None:
+        covering = Covering.from_bbox(target_bbox, margin=margin)
 
-    queue = collections.deque([(0, 0, 0)])  # (level, row, col)
-    visited = set()
+    journal = FetchJournal.for_dir(output_dir)
+    if not resume or replay is not None:
+        journal.reset()
+    elif len(journal):
+        print(f'  Resuming from journal: {len(journal)} tiles already recorded')
+
+    frontier = [(0, 0, 0)]  # (level, row, col), in BFS order
     downloaded = []
     empty_count = 0
+    failed_count = 0
     requests_made = 0
+    reused_count = 0
     level_stats = {}
 
-    while queue:
-        level, row, col = queue.popleft()
-        key = (level, row, col)
-        if key in visited:
-            continue
-        visited.add(key)
+    prefetched, trusted = {}, {}
+    if replay is not None and incremental:
+        prefetched, trusted, requests_made = yield from incremental_prefetch_steps(
+            layer, replay, output_dir, journal, tile_cache, layer_unchanged)
+    elif replay is not None:
+        prefetched, trusted, requests_made = yield from replay_prefetch_steps(
+            layer, replay, output_dir, journal, tile_cache)
 
-        # Geographic filtering: skip tiles that don't overlap target area
-        # (skip filter at L0-L1 as tiles cover the entire world)
-        if level >= 2:
-            t_bbox = tile_geo_bbox(level, row, col)
-            if not bbox_overlap(t_bbox, expanded_bbox):
-                continue
-
-        # Download tile
-        requests_made += 1
-        data = fetch_tile(layer, level, row, col)
+    while frontier:
+        found = {}      # (level, row, col) -> (size, header info)
+        to_fetch = []
 
-        if data is None or len(data) < 12:
-            empty_count += 1
-            continue
+        for key in frontier:
+            level, row, col = key
 
-        # Parse header
-        info = parse_tile_header(data)
-
-        # Save tile
-        tile_dir = os.path.join(output_dir, f'L{level}')
-        os.makedirs(tile_dir, exist_ok=True)
-        filename = os.path.join(tile_dir, f'R{row}_C{col}.bin')
-        with open(filename, 'wb') as f:
-            f.write(data)
-
-        tile_record = {
-            'level': level, 'row': row, 'col': col,
-            'size': len(data),
-            'has_build_id': info['has_build_id'],
-            'children': info.get('children', []),
-        }
-        downloaded.append(tile_record)
-
-        # Update level stats
-        if level not in level_stats:
-            level_stats[level] = {'tiles': 0, 'bytes': 0, 'with_bldg': 0}
-        level_stats[level]['tiles'] += 1
-        level_stats[level]['bytes'] += len(data)
-        if info['has_build_id']:
-            level_stats[level]['with_bldg'] += 1
-
-        # Progress
-        sys.stdout.write(
-            f'\r  L{level} R{row}_C{col}: {len(data):,}B '
-            f'| Total: {len(downloaded)} tiles, {requests_made} reqs  '
-        )
-        sys.stdout.flush()
-
-        # Add children to queue
-        if level < max_level and info.get('children'):
-            for dr in range(2):
-                for dc in range(2):
-                    child = (level + 1, 2 * row + dr, 2 * col + dc)
-                    if child not in visited:
-                        queue.append(child)
+            # Geographic filtering: skip tiles that don't overlap target area
+            # (skip filter at L0-L1 as tiles cover the entire world)
+            if level >= 2 and not covering.overlaps_tile(level, row, col):
+                continue
 
-        time.sleep(0.03)  # Rate limiting
+            # Fetched by the replay prefetch?
+            if key in prefetched:
+                entry = prefetched[key]
+                if entry is None:
+                    journal.record_empty(level, row, col)
+                    empty_count += 1
+                    continue
+                size, info, data = entry
+                if data is not None:
+                    # Reached by the new tree: store it now
+                    save_tile(output_dir, level, row, col, data, layer, tile_cache)
+                    journal.record_tile(_tile_record(level, row, col, size, info))
+                    prefetched[key] = (size, info, None)
+                elif on_tile is not None:
+                    # Already stored by the incremental prefetch
+                    data = (tile_cache.read(layer, *key) if tile_cache is not None
+                            else read_valid_tile(output_dir, *key))
+                found[key] = (size, info)
+                if on_tile is not None and data is not None and on_tile(*key, data):
+                    yield Wait(wait_tiles)
+                continue
 
+            # Finished in an earlier run?
+            rec = journal.get(key)
+            if rec is not None and rec['status'] == EMPTY:
+                empty_count += 1
+                continue
+            data = None
+            if replay is None:
+                data = read_valid_tile(output_dir, level, row, col,
+                                       size=rec['size'] if rec else None)
+                if data is None and tile_cache is not None:
+                    if rec is not None:
+                        # Fetched by the interrupted run itself
+                        data = tile_cache.read(layer, level, row, col)
+                        if data is not None and len(data) != rec['size']:
+                            data = None
+                    else:
+                        # Fetched before for another campus or script
+                        data = tile_cache.get(layer, level, row, col)
+                    if data is not None:
+                        tile_cache.place(layer, level, row, col,
+                                         tile_path(output_dir, level, row, col))
+
+            if data is not None:
+                reused_count += 1
+                if rec is not None:
+                    info = {'has_build_id': rec['has_build_id'],
+                            'children': rec['children']}
+                else:
+                    info = parse_tile_header(data)
+                    journal.record_tile(_tile_record(level, row, col, len(data), info))
+                found[key] = (len(data), info)
+                if on_tile is not None and on_tile(level, row, col, data):
+                    yield Wait(wait_tiles)
+            elif (negative_cache is not None and not _below_changed(key, prefetched, trusted)
+                  and negative_cache.is_empty(level, row, col)):
+                empty_count += 1
+            else:
+                to_fetch.append(key)
+
+        backlog = False
+
+        def on_result(i, result):
+            nonlocal empty_count, failed_count, backlog
+            level, row, col = to_fetch[i]
+            outcome, data, validators = result
+            if outcome == FAILED:
+                # Not journaled: a resumed run retries it
+                failed_count += 1
+                return
+            if data is None or len(data) < 12:
+                journal.record_empty(level, row, col)
+                if negative_cache is not None:
+                    negative_cache.add(level, row, col)
+                empty_count += 1
+                return
+            if negative_cache is not None:
+                negative_cache.discard(level, row, col)
+
+            # Parse header, save tile, then journal it
+            info = parse_tile_header(data)
+            save_tile(output_dir, level, row, col, data, layer, tile_cache, validators)
+            journal.record_tile(_tile_record(level, row, col, len(data), info))
+            found[to_fetch[i]] = (len(data), info)
+            if on_tile is not None and on_tile(level, row, col, data):
+                backlog = True
+
+            # Progress
+            sys.stdout.write(
+                f'\r  L{level} R{row}_C{col}: {len(data):,}B '
+                f'| Total: {len(downloaded) + len(found)} tiles, {requests_made} reqs  '
+            )
+            sys.stdout.flush()
+
+        # Download the whole level concurrently (unconditionally, but keep
+        # the response validators for the next incremental refresh)
+        requests_made += len(to_fetch)
+        yield FetchBatch(
+            [tile_query(layer, *key) for key in to_fetch],
+            on_result=on_result,
+            validators=[None] * len(to_fetch),
+        )
+        if backlog:
+            # The parser fell behind: let it catch up before the next level
+            yield Wait(wait_tiles)
+
+        # Record tiles and build the next frontier in serial BFS order
+        next_frontier = []
+        for key in frontier:
+            if key not in found:
+                continue
+            level, row, col = key
+            size, info = found[key]
+            downloaded.append(_tile_record(level, row, col, size, info))
+
+            # Update level stats
+            if level not in level_stats:
+                level_stats[level] = {'tiles': 0, 'bytes': 0, 'with_bldg': 0}
+            level_stats[level]['tiles'] += 1
+            level_stats[level]['bytes'] += size
+            if info['has_build_id']:
+                level_stats[level]['with_bldg'] += 1
+
+            # Add children to the next frontier
+            if key in trusted:
+                if level < max_level:
+                    next_frontier.extend(trusted[key])
+            elif level < max_level and info.get('children'):
+                for dr, dc in ALL_QUADRANTS:
+                    next_frontier.append((level + 1, 2 * row + dr, 2 * col + dc))
+        frontier = next_frontier
+
+    journal.close()
     print(f'\n  Traversal complete: {len(downloaded)} tiles, '
           f'{requests_made} requests, {empty_count} empty')
+    if reused_count or failed_count:
+        print(f'  Reused from earlier run: {reused_count} tiles; '
+              f'failed (retry on next run): {failed_count}')
+    dropped = sum(1 for entry in prefetched.values() if entry is not None and entry[2] is not None)
+    if dropped:
+        print(f'  Replay: {dropped} known tiles no longer in the tree, not stored')
 
     # Print level breakdown
     if level_stats:
@@ -293,21 +609,127 @@ def quadtree_download(layer, target_bbox, output_dir, max_level=15, margin=0.02)
     return downloaded
 
 
-def find_working_layer(campus):
-    """Try each layer option and return the first that exists."""
+def find_replay_manifest(raw_dir, layer, campus_key, campus, margin, check_extent=True):
+    """
+    Latest manifest.json for this layer and campus (this script's output
+    dir first, then the organized NLSC_quadtree/ tree), or None. With
+    check_extent, a manifest made with a different bbox or margin is not used.
+    """
+    candidates = [os.path.join(raw_dir, f'NLSC_quadtree_{layer}_{campus_key}', 'manifest.json')]
+    candidates += sorted(glob.glob(os.path.join(
+        raw_dir, 'NLSC_quadtree', '*', f'{layer}_{campus_key}', 'manifest.json')))
+    bbox = dict(zip(('lon_min', 'lon_max', 'lat_min', 'lat_max'), campus['bbox']))
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('layer') != layer or not manifest.get('tiles'):
+            continue
+        if check_extent and (manifest.get('bbox') != bbox
+                             or manifest.get('margin') != margin):
+            print(f'  Replay: {path} has a different bbox/margin, not used')
+            continue
+        return path, manifest
+    return None, None
+
+
+def campus_priority(campus_key, raw_dir, margin, layers):
+    """
+    (priority, expected) for a scheduler job over `layers`: tiles that had
+    BUILD_ID in any previous manifest of the campus come first
+    (building_ranks), and the job is expected to find as many tiles as the
+    previous manifest of its first layer that has one (None if none has).
+    """
+    campus = CAMPUSES[campus_key]
+    records, expected = [], None
     for layer in campus['layers']:
-        print(f'  Checking layer {layer}...')
-        layer_data = fetch_layer_info(layer)
-        if layer_data and len(layer_data) > 10:
+        _, manifest = find_replay_manifest(raw_dir, layer, campus_key, campus, margin,
+                                           check_extent=False)
+        if manifest is None:
+            continue
+        records.extend(manifest['tiles'])
+        if expected is None and layer in layers:
+            expected = len(manifest['tiles'])
+    ranks = building_ranks(records, layers)
+    return (lambda query: ranks.get(query, RANK_OTHER)), expected
+
+
+def find_working_layer(campus, raw_dir):
+    """
+    The first of the campus's layers that exists, and its LAYER document
+    (a steps generator: the probe is waited for off the event loop).
+    All candidates are probed at once (layer_probe_for); this returns as
+    soon as the preferred available one is known.
+    """
+    probe = layer_probe_for(raw_dir)
+    probe.start(campus['layers'])
+    for layer in campus['layers']:
+        layer_data = yield Wait(probe.result, layer)
+        if layer_data is not None:
             print(f'  ✓ Layer {layer} exists ({len(layer_data):,} bytes)')
             return layer, layer_data
-        else:
-            print(f'  ✗ Layer {layer} not available')
+        print(f'  ✗ Layer {layer} not available')
     return None, None
 
 
-def download_campus(campus_key, raw_dir, max_level=15, margin=0.02, try_all_layers=False):
-    """Download tiles for a single campus."""
+def start_parse(campus_key, raw_dir, layer, output_dir, queue_size=DEFAULT_QUEUE_SIZE,
+                fields=None):
+    """
+    --parse: 07's tile parser on a background thread, fed while the layer
+    downloads and filtered with 07's bbox (or boundary) for the campus;
+    `fields` limits the buildings' attributes (07 --fields).
+    Returns (pipeline, collector, on_tile callback, boundary name or None).
+    """
+    bbox = PARSE_CAMPUSES.get(campus_key, CAMPUSES[campus_key])['bbox']
+    covering, is_polygon = campus_covering(
+        os.path.dirname(raw_dir), campus_key, bbox, margin=TILE_MARGIN)
+    processed_dir = os.path.join(os.path.dirname(raw_dir), 'processed')
+    os.makedirs(processed_dir, exist_ok=True)
+    collector = BuildingCollector(
+        bbox, covering if is_polygon else None,
+        stream_path=os.path.join(processed_dir, parsed_name(campus_key, layer) + '.jsonl'))
+    parse = functools.partial(parse_tile_columns, obb=False, fields=fields)
+    pipeline = ParsePipeline(parse, collector.add_parsed, maxsize=queue_size)
+
+    def on_tile(level, row, col, data):
+        # 07 skips tiles outside the boundary polygon
+        if is_polygon and level >= 2 and not covering.overlaps_tile(level, row, col):
+            return False
+        return pipeline.put(tile_path(output_dir, level, row, col), data)
+
+    return pipeline, collector, on_tile, covering.name if is_polygon else None
+
+
+def parsed_name(campus_key, layer):
+    """File name (without .json / .jsonl) of a --parse result in data/processed/."""
+    return f'NYCU_{campus_key}_{layer}_quadtree_buildings'
+
+
+def download_campus(*args, **kwargs):
+    """download_campus_steps() run on ENGINE; returns {layer: stats} or None."""
+    return run_steps(download_campus_steps(*args, **kwargs), ENGINE)
+
+
+def download_campus_steps(campus_key, raw_dir, max_level=15, margin=0.02,
+                          try_all_layers=False, resume=True,
+                          replay=False, incremental=False, layers=None, parse=False,
+                          parse_queue=DEFAULT_QUEUE_SIZE, parse_fields=None):
+    """
+    Download tiles for a single campus (a steps generator).
+
+    With `parse` the tiles are parsed while they download (start_parse):
+    new buildings stream into data/processed/<parsed_name>.jsonl and the
+    final list, identical to a 07 parse of the finished download (tiles
+    replayed in dataset_order), goes to
+    <parsed_name>.json.
+
+    With `incremental` the previous manifest is refreshed top-down
+    (incremental_prefetch_steps); if the LAYER document still has the
+    fingerprint that manifest was made with, no tile is requested at all.
+    `layers` restricts try_all_layers to some of the campus's layers (the
+    scheduler runs one job per layer).
+    """
     campus = CAMPUSES[campus_key]
 
     print(f'\n{"=" * 60}')
@@ -316,46 +738,89 @@ def download_campus(campus_key, raw_dir, max_level=15, margin=0.02, try_all_laye
     print(f'BBox: {campus["bbox"]}')
     print(f'{"=" * 60}')
 
-    layers_to_try = campus['layers'] if try_all_layers else campus['layers'][:1]
+    covering, is_polygon = campus_covering(
+        os.path.dirname(raw_dir), campus_key, campus['bbox'], margin=margin)
+    if is_polygon:
+        bbox_covering = Covering.from_bbox(campus['bbox'], margin=margin)
+        poly_tiles = sum(len(covering.tiles_at(l)) for l in range(2, max_level + 1))
+        bbox_tiles = sum(len(bbox_covering.tiles_at(l)) for l in range(2, max_level + 1))
+        print(f'Boundary: {covering.name} ({poly_tiles} tiles in L2-L{max_level} '
+              f'vs {bbox_tiles} for bbox + margin)')
+
+    # Every candidate layer is probed concurrently; the download starts as
+    # soon as the preferred available layer is known
+    probe = layer_probe_for(raw_dir)
+    if try_all_layers:
+        layers_to_try = layers or campus['layers']
+        probe.start(layers_to_try)
+    else:
+        print(f'\n  Checking layers {", ".join(campus["layers"])}...')
+        layer, _ = yield from find_working_layer(campus, raw_dir)
+        if layer is None:
+            print(f'  FAILED: No available layer found')
+            return None
+        layers_to_try = [layer]
     results = {}
 
     for layer in layers_to_try:
-        print(f'\n  Checking layer {layer}...')
-        layer_data = fetch_layer_info(layer)
-        if not layer_data or len(layer_data) < 10:
-            print(f'  ✗ Layer {layer} not available')
-            if not try_all_layers:
-                # Try next layer
-                remaining = campus['layers'][1:]
-                for alt in remaining:
-                    print(f'  Trying alternative: {alt}...')
-                    layer_data = fetch_layer_info(alt)
-                    if layer_data and len(layer_data) > 10:
-                        print(f'  ✓ Layer {alt} exists')
-                        layer = alt
-                        break
-                else:
-                    print(f'  FAILED: No available layer found')
-                    return None
-            else:
-                continue
+        layer_data = yield Wait(probe.result, layer)
+        if layer_data is None:
+            print(f'\n  ✗ Layer {layer} not available')
+            continue
 
-        print(f'  ✓ Layer {layer} ({len(layer_data):,} bytes)')
+        print(f'\n  ✓ Layer {layer} ({len(layer_data):,} bytes)')
+        layer_info = parse_layer_info(layer_data)
+        if layer_info['dates']:
+            print(f'  LAYER dates: {", ".join(layer_info["dates"])}')
 
         # Create output directory
         output_dir = os.path.join(raw_dir, f'NLSC_quadtree_{layer}_{campus_key}')
         os.makedirs(output_dir, exist_ok=True)
 
+        # Look up the previous manifest before LAYER.bin is overwritten
+        replay_manifest = None
+        layer_unchanged = False
+        if replay or incremental:
+            replay_path, replay_manifest = find_replay_manifest(
+                raw_dir, layer, campus_key, campus, margin)
+            if replay_manifest is None:
+                print(f'  No previous manifest for {layer}, falling back to full BFS')
+            elif incremental:
+                previous = previous_fingerprint(
+                    replay_manifest, os.path.join(os.path.dirname(replay_path), 'LAYER.bin'))
+                layer_unchanged = previous == layer_info['sha256']
+                print(f'  Incremental refresh of {len(replay_manifest["tiles"])} tiles '
+                      f'from {replay_path}')
+                print(f'  LAYER {layer_info["sha256"][:12]}: '
+                      + ('unchanged, no tile requests needed' if layer_unchanged
+                         else 'changed or unknown, checking tiles top-down'))
+            else:
+                print(f'  Replaying {len(replay_manifest["tiles"])} tiles from {replay_path}')
+
         # Save layer metadata
         with open(os.path.join(output_dir, 'LAYER.bin'), 'wb') as f:
             f.write(layer_data)
 
         # Download via quadtree traversal
         print(f'\n  Starting quadtree traversal (max level: {max_level}, margin: {margin})...')
-        tiles = quadtree_download(
+        negative_cache = negative_cache_for(raw_dir, layer)
+        pipeline = on_tile = None
+        if parse:
+            pipeline, collector, on_tile, boundary = start_parse(
+                campus_key, raw_dir, layer, output_dir, queue_size=parse_queue,
+                fields=parse_fields)
+        tiles = yield from quadtree_download_steps(
             layer, campus['bbox'], output_dir,
-            max_level=max_level, margin=margin,
+            max_level=max_level, margin=margin, resume=resume,
+            negative_cache=negative_cache,
+            replay=replay_manifest, covering=covering,
+            tile_cache=tile_cache_for(raw_dir),
+            incremental=incremental, layer_unchanged=layer_unchanged,
+            on_tile=on_tile, wait_tiles=pipeline.flush if pipeline else None,
         )
+        negative_cache.save()
+        # The manifest lists tiles by coordinate; make them visible in the store
+        tile_cache_for(raw_dir).commit()
 
         total_bytes = sum(t['size'] for t in tiles)
         bldg_tiles = sum(1 for t in tiles if t['has_build_id'])
@@ -366,6 +831,7 @@ def download_campus(campus_key, raw_dir, max_level=15, margin=0.02, try_all_laye
             'name': campus['name'],
             'name_en': campus['name_en'],
             'layer': layer,
+            'layer_sha256': layer_info['sha256'],
             'method': 'quadtree_bfs_from_root',
             'max_level': max_level,
             'margin': margin,
@@ -378,6 +844,10 @@ def download_campus(campus_key, raw_dir, max_level=15, margin=0.02, try_all_laye
             'total_bytes': total_bytes,
             'tiles_with_build_id': bldg_tiles,
         }
+        if incremental and replay_manifest is not None:
+            manifest['refresh'] = 'incremental'
+        if is_polygon:
+            manifest['boundary'] = covering.name
         manifest_file = os.path.join(output_dir, 'manifest.json')
         with open(manifest_file, 'w', encoding='utf-8') as f:
             json.dump(manifest, f, ensure_ascii=False, indent=2)
@@ -386,6 +856,16 @@ def download_campus(campus_key, raw_dir, max_level=15, margin=0.02, try_all_laye
               f'{total_bytes / 1024 / 1024:.2f} MB')
         print(f'  Output: {output_dir}')
 
+        if pipeline is not None:
+            yield Wait(pipeline.close)
+            print(f'  {pipeline.summary()}')
+            save_campus_buildings(
+                campus_key, campus, layer,
+                collector.finish(key=dataset_order(output_dir)), collector,
+                os.path.join(os.path.dirname(collector.stream_path),
+                             parsed_name(campus_key, layer) + '.json'),
+                boundary=boundary)
+
         results[layer] = {
             'tiles': len(tiles),
             'bytes': total_bytes,
@@ -398,6 +878,40 @@ def download_campus(campus_key, raw_dir, max_level=15, margin=0.02, try_all_laye
     return results
 
 
+def print_covering_report(raw_dir, margin):
+    """
+    For every campus with a boundary file, compare the polygon covering with
+    bbox + margin on the tiles of its stored manifests.
+    """
+    data_dir = os.path.dirname(raw_dir)
+    print('Polygon covering vs bbox + margin on stored manifests')
+    found = False
+    for key, campus in CAMPUSES.items():
+        if not os.path.exists(boundary_path(data_dir, key)):
+            continue
+        covering, _ = campus_covering(data_dir, key, campus['bbox'], margin=margin)
+        bbox_covering = Covering.from_bbox(campus['bbox'], margin=margin)
+        for layer in campus['layers']:
+            path, manifest = find_replay_manifest(raw_dir, layer, key, campus, margin,
+                                                  check_extent=False)
+            if manifest is None:
+                continue
+            found = True
+            levels, total = covering_savings(covering, bbox_covering, manifest['tiles'])
+            print(f'  {layer:9s} {key:9s}: {total["tiles"]} -> '
+                  f'{total["tiles"] - total["saved_tiles"]} tiles, '
+                  f'{total["saved_bytes"] / 1024 / 1024:.2f} of '
+                  f'{total["bytes"] / 1024 / 1024:.2f} MB saved')
+            for lvl in sorted(levels):
+                s = levels[lvl]
+                if s['saved_tiles']:
+                    print(f'    L{lvl}: {s["saved_tiles"]}/{s["tiles"]} tiles, '
+                          f'{s["saved_bytes"] / 1024:.1f} KB')
+    if not found:
+        print(f'  No campus has both {os.path.join(data_dir, "boundaries", "<campus>.geojson")} '
+              f'and a stored manifest')
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(
@@ -410,11 +924,87 @@ def main():
                         help='Geographic margin in degrees (default: 0.02)')
     parser.add_argument('--all-layers', action='store_true',
                         help='Try all layer versions for each campus')
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignore fetch_journal.jsonl and download from scratch')
+    parser.add_argument('--per-mirror', type=int, default=4,
+                        help='Requests in flight per NLSC mirror (default: 4)')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help='Max requests per second per NLSC mirror; backs off '
+                             f'on 429 / 5xx / timeouts (default: {DEFAULT_RATE:g})')
+    parser.add_argument('--hedge-ratio', type=float, default=0.05,
+                        help='Max share of requests hedged to a second mirror '
+                             'after the p95 latency (default: 0.05, 0 = off)')
+    parser.add_argument('--refresh-tiles', action='store_true',
+                        help='Re-download tiles already in the shared tile cache')
+    parser.add_argument('--write-bin', action='store_true',
+                        help='Also write loose L*/R*_C*.bin files into each campus folder')
+    parser.add_argument('--refresh-empty', action='store_true',
+                        help='Re-request tiles cached as empty by earlier runs')
+    parser.add_argument('--empty-ttl-days', type=float, default=DEFAULT_TTL_DAYS,
+                        help='Days an empty tile stays cached '
+                             f'(default: {DEFAULT_TTL_DAYS:g})')
+    parser.add_argument('--refresh-layers', action='store_true',
+                        help='Probe layers cached as missing by earlier runs again')
+    parser.add_argument('--layer-ttl-hours', type=float, default=DEFAULT_TTL_HOURS,
+                        help='Hours a missing layer stays cached '
+                             f'(default: {DEFAULT_TTL_HOURS:g})')
+    parser.add_argument('--covering-report', action='store_true',
+                        help='Compare data/boundaries/<campus>.geojson coverings '
+                             'with bbox + margin on stored manifests, then exit')
+    refresh = parser.add_mutually_exclusive_group()
+    refresh.add_argument('--replay', action='store_true',
+                         help='Refresh from the previous manifest: fetch all known '
+                              'tiles at once, BFS only where children changed')
+    refresh.add_argument('--incremental', action='store_true',
+                         help='Refresh from the previous manifest: skip if LAYER is '
+                              'unchanged, else re-fetch (conditionally) only below '
+                              'changed tiles')
+    parser.add_argument('--parse', action='store_true',
+                        help='Parse tiles while downloading (07 parser, bounded queue); '
+                             'buildings go to data/processed/NYCU_<campus>_<layer>_'
+                             'quadtree_buildings.json(l)')
+    parser.add_argument('--parse-queue', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help='Tiles buffered between download and parser '
+                             f'(default: {DEFAULT_QUEUE_SIZE})')
+    parser.add_argument('--fields', nargs='+', metavar='FIELD',
+                        help='With --parse: keep only these attribute fields (plus '
+                             'BUILD_ID); "downstream" = the fields 04 and 05 use '
+                             '(default: all)')
+    parser.add_argument('--sequential', action='store_true',
+                        help='Download one campus after another instead of all '
+                             '(campus, layer) jobs from one priority queue')
+    parser.add_argument('--progress-interval', type=float, default=5.0,
+                        help='Seconds between per-campus progress / ETA lines '
+                             '(default: 5, 0 = off)')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record-cassette', metavar='PATH',
+                          help='Record every oview answer into a cassette file; only a '
+                               'cold run (--refresh-tiles --refresh-empty --restart, '
+                               'no --replay / --incremental) records a complete one')
+    cassette.add_argument('--replay-cassette', metavar='PATH',
+                          help='Answer from a recorded cassette, without network')
     args = parser.parse_args()
 
+    ENGINE.per_mirror = max(1, args.per_mirror)
+    ENGINE.limiter.set_rate(args.rate)
+    if args.record_cassette:
+        ENGINE.use_cassette(args.record_cassette, 'record')
+    elif args.replay_cassette:
+        ENGINE.use_cassette(args.replay_cassette, 'replay')
+    ENGINE.hedging.max_ratio = args.hedge_ratio
+    ENGINE.hedging.enabled = args.hedge_ratio > 0
+    EMPTY_CACHE_SETTINGS.update(ttl_days=args.empty_ttl_days,
+                                refresh=args.refresh_empty)
+    TILE_CACHE_SETTINGS.update(refresh=args.refresh_tiles, write_files=args.write_bin)
+    LAYER_PROBE_SETTINGS.update(ttl_hours=args.layer_ttl_hours, refresh=args.refresh_layers)
+
     project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     raw_dir = os.path.join(project_dir, 'data', 'raw')
 
+    if args.covering_report:
+        print_covering_report(raw_dir, args.margin)
+        return
+
     print('=' * 60)
     print('NLSC 3D Building Tile Downloader - Quadtree BFS')
     print('=' * 60)
@@ -422,19 +1012,52 @@ def main():
     print(f'Max level: {args.max_level}')
     print(f'Margin: {args.margin}°')
 
+    # Probe the candidate layers of all campuses at once, in the background
+    layer_probe_for(raw_dir).start(
+        [layer for key in args.campuses if key in CAMPUSES
+         for layer in CAMPUSES[key]['layers']])
+
+    options = dict(
+        max_level=args.max_level,
+        margin=args.margin,
+        try_all_layers=args.all_layers,
+        resume=not args.restart,
+        replay=args.replay,
+        incremental=args.incremental,
+        parse=args.parse,
+        parse_queue=args.parse_queue,
+        parse_fields=field_projection(args.fields),
+    )
     all_results = {}
-    for key in args.campuses:
-        if key not in CAMPUSES:
-            print(f'\nUnknown campus: {key}')
-            continue
-        result = download_campus(
-            key, raw_dir,
-            max_level=args.max_level,
-            margin=args.margin,
-            try_all_layers=args.all_layers,
-        )
-        if result:
-            all_results[key] = result
+    scheduler = None
+    if args.sequential:
+        for key in args.campuses:
+            if key not in CAMPUSES:
+                print(f'\nUnknown campus: {key}')
+                continue
+            result = download_campus(key, raw_dir, **options)
+            if result:
+                all_results[key] = result
+    else:
+        # All (campus, layer) jobs at once, sharing ENGINE's slots and rate
+        scheduler = DownloadScheduler(ENGINE, progress_interval=args.progress_interval)
+        for key in args.campuses:
+            if key not in CAMPUSES:
+                print(f'\nUnknown campus: {key}')
+                continue
+            layer_sets = ([[layer] for layer in CAMPUSES[key]['layers']]
+                          if args.all_layers else [CAMPUSES[key]['layers']])
+            for layers in layer_sets:
+                priority, expected = campus_priority(key, raw_dir, args.margin, layers)
+                name = f'{key}/{layers[0]}' if args.all_layers else key
+                scheduler.add(name, download_campus_steps(key, raw_dir, layers=layers, **options),
+                              group=key, priority=priority, expected=expected)
+        print(f'\nScheduling {len(scheduler.jobs)} jobs from one priority queue '
+              f'(BUILD_ID tiles of earlier manifests first)')
+        scheduler.run()
+        for job in scheduler.jobs:
+            if job.result:
+                all_results.setdefault(job.group, {}).update(job.result)
 
     # Summary
     print(f'\n{"=" * 60}')
@@ -446,6 +1069,23 @@ def main():
             print(f'  {campus["name"]:8s} [{layer:6s}]: '
                   f'{stats["tiles"]:4d} tiles ({stats["bldg_tiles"]} w/BUILD_ID), '
                   f'{stats["bytes"] / 1024 / 1024:.2f} MB')
+    print(f'  Requests: {ENGINE.summary()}')
+    if scheduler is not None:
+        print(f'    {scheduler.summary()}')
+        for line in scheduler.progress_lines():
+            print(f'    {line}')
+    for line in ENGINE.report():
+        print(f'    {line}')
+    for layer in sorted(NEGATIVE_CACHES):
+        print(f'    {NEGATIVE_CACHES[layer].summary()}')
+    for cache in TILE_CACHES.values():
+        print(f'    {cache.summary()}')
+        cache.close()
+    for probe in LAYER_PROBES.values():
+        probe.save()
+        print(f'    {probe.summary()}')
+        probe.engine.close()
+    ENGINE.close()
     print(f'{"=" * 60}')
 
 
@@ -0,0 +1,198 @@
+"""
+Manage the packed tile stores in data/raw/NLSC_tile_store/ (one hash index
+per layer, {layer}.sqlite, and the shared content-addressed blobs.sqlite).
+
+The downloaders (01, 06, 08) keep tiles in one SQLite file per layer and
+write only manifest.json into each dataset folder. This script converts
+between the store and the legacy L*/R*_C*.bin layout:
+
+  python 09_tile_store.py stats
+  python 09_tile_store.py diff OLD_LAYER NEW_LAYER [--list]
+      Which tiles are the same, changed, added or removed (hash comparison)
+  python 09_tile_store.py prune
+      Delete blobs no layer refers to any more
+  python 09_tile_store.py export DATASET_DIR [--out DIR]
+      Write the tiles listed in DATASET_DIR/manifest.json as .bin files
+      (into DATASET_DIR itself unless --out is given)
+  python 09_tile_store.py export-layer LAYER OUT_DIR
+      Write every stored tile of a layer
+  python 09_tile_store.py import [DATASET_DIR ...] [--remove]
+      Pack legacy .bin files into the stores (default: every dataset folder
+      under data/raw plus the old NLSC_tile_cache). With --remove the .bin
+      files are deleted once their bytes are verified in the store.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import sys
+
+from oview.tilecache import LEGACY_CACHE_DIR_NAME
+from oview.tilestore import (STORE_DIR_NAME, TileStore, bin_files, blob_stats,
+                             compare_layers, export_tiles, import_tiles,
+                             layer_store_paths, manifest_tiles, prune_blobs,
+                             read_manifest, tile_key)
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_DIR = os.path.join(PROJECT_DIR, 'data', 'raw')
+
+
+def dataset_dirs(raw_dir):
+    """Download folders (with a manifest.json) under raw_dir, old and organized layout."""
+    patterns = ['NLSC_3D_tiles_*', 'NLSC_quadtree_*',
+                os.path.join('NLSC_3D_tiles', '*', '*'),
+                os.path.join('NLSC_quadtree', '*', '*')]
+    found = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(raw_dir, pattern))):
+            if os.path.isfile(os.path.join(path, 'manifest.json')):
+                found.append(path)
+    return found
+
+
+def cmd_stats(args):
+    paths = layer_store_paths(RAW_DIR)
+    if not paths:
+        print(f'No tile stores in {os.path.join(RAW_DIR, STORE_DIR_NAME)}')
+        return
+    indexed = 0
+    for path in paths:
+        layer = os.path.splitext(os.path.basename(path))[0]
+        with TileStore(path, layer) as store:
+            s = store.stats()
+        indexed += s['bytes']
+        levels = ','.join(str(l) for l in s['levels'])
+        print(f'  {layer:9s}: {s["tiles"]:5d} tiles ({s["distinct"]} distinct), '
+              f'{s["bytes"] / 1024 / 1024:7.2f} MB, levels [{levels}]')
+    blobs = blob_stats(RAW_DIR)
+    saved = indexed - blobs['bytes']
+    print(f'  Blobs: {blobs["blobs"]} stored, {blobs["bytes"] / 1024 / 1024:.2f} MB '
+          f'for {indexed / 1024 / 1024:.2f} MB of tiles '
+          f'({max(saved, 0) / 1024 / 1024:.2f} MB saved by deduplication)')
+
+
+def cmd_diff(args):
+    for layer in (args.old_layer, args.new_layer):
+        if not TileStore.exists(RAW_DIR, layer):
+            print(f'No tile store for layer {layer}')
+            sys.exit(1)
+    with TileStore.for_layer(RAW_DIR, args.old_layer) as old, \
+            TileStore.for_layer(RAW_DIR, args.new_layer) as new:
+        result = compare_layers(old, new)
+    print(f'{args.old_layer} -> {args.new_layer}')
+    for kind in ('same', 'changed', 'added', 'removed'):
+        keys = result[kind]
+        print(f'  {kind:8s}: {len(keys)} tiles')
+        if args.list and kind != 'same':
+            for level, row, col in keys:
+                print(f'    L{level}/R{row}_C{col}')
+
+
+def cmd_prune(args):
+    count, total = prune_blobs(RAW_DIR)
+    print(f'Removed {count} unreferenced blobs ({total / 1024 / 1024:.2f} MB)')
+
+
+def cmd_export(args):
+    manifest = read_manifest(args.dataset_dir)
+    if not manifest or not manifest.get('layer'):
+        print(f'No manifest.json with a layer in {args.dataset_dir}')
+        sys.exit(1)
+    out_dir = args.out or args.dataset_dir
+    keys = [(t['level'], t['row'], t['col']) for t in manifest_tiles(manifest)]
+    with TileStore.for_layer(RAW_DIR, manifest['layer']) as store:
+        count = export_tiles(store, out_dir, keys)
+    print(f'Exported {count}/{len(keys)} tiles of {manifest["layer"]} to {out_dir}')
+    if count < len(keys):
+        print(f'  {len(keys) - count} tiles are not in the store (re-download them)')
+
+
+def cmd_export_layer(args):
+    if not TileStore.exists(RAW_DIR, args.layer):
+        print(f'No tile store for layer {args.layer}')
+        sys.exit(1)
+    with TileStore.for_layer(RAW_DIR, args.layer) as store:
+        count = export_tiles(store, args.out_dir)
+    print(f'Exported {count} tiles of {args.layer} to {args.out_dir}')
+
+
+def _remove_verified(store, tiles_dir):
+    """Delete .bin files whose bytes match the store; returns count."""
+    removed = 0
+    for parts, path in bin_files(tiles_dir).items():
+        key = tile_key(parts)
+        if key is None:
+            continue    # terrain/ and other subtrees stay as files
+        info = store.info(*key)
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if info is not None and info['sha256'] == digest:
+            os.remove(path)
+            removed += 1
+    for root, dirs, files in os.walk(tiles_dir, topdown=False):
+        if root != tiles_dir and not os.listdir(root):
+            os.rmdir(root)
+    return removed
+
+
+def cmd_import(args):
+    sources = []    # (layer, tiles_dir)
+    for path in args.dataset_dirs or dataset_dirs(RAW_DIR):
+        manifest = read_manifest(path)
+        if manifest and manifest.get('layer'):
+            sources.append((manifest['layer'], path))
+        else:
+            print(f'  Skipping {path}: no manifest.json with a layer')
+    if not args.dataset_dirs:
+        legacy_cache = os.path.join(RAW_DIR, LEGACY_CACHE_DIR_NAME)
+        for path in sorted(glob.glob(os.path.join(legacy_cache, '*'))):
+            if os.path.isdir(path):
+                sources.append((os.path.basename(path), path))
+
+    total = removed = 0
+    for layer, tiles_dir in sources:
+        with TileStore.for_layer(RAW_DIR, layer) as store:
+            count = import_tiles(store, tiles_dir)
+            if args.remove:
+                removed += _remove_verified(store, tiles_dir)
+        total += count
+        print(f'  {layer:9s} <- {os.path.relpath(tiles_dir, RAW_DIR)}: {count} tiles')
+    print(f'Imported {total} tiles from {len(sources)} folders')
+    if args.remove:
+        print(f'Removed {removed} verified .bin files')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the packed NLSC tile stores')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('stats', help='Tiles and bytes per layer store, and blob deduplication')
+
+    p = sub.add_parser('diff', help='Compare two layers by tile hash')
+    p.add_argument('old_layer')
+    p.add_argument('new_layer')
+    p.add_argument('--list', action='store_true', help='List changed, added and removed tiles')
+
+    sub.add_parser('prune', help='Delete blobs no layer refers to')
+
+    p = sub.add_parser('export', help='Write a dataset folder\'s tiles as .bin files')
+    p.add_argument('dataset_dir')
+    p.add_argument('--out', help='Output folder (default: the dataset folder)')
+
+    p = sub.add_parser('export-layer', help='Write every stored tile of a layer')
+    p.add_argument('layer')
+    p.add_argument('out_dir')
+
+    p = sub.add_parser('import', help='Pack legacy .bin files into the stores')
+    p.add_argument('dataset_dirs', nargs='*',
+                   help='Dataset folders (default: all under data/raw, plus NLSC_tile_cache)')
+    p.add_argument('--remove', action='store_true',
+                   help='Delete .bin files once verified in the store')
+
+    args = parser.parse_args()
+    {'stats': cmd_stats, 'diff': cmd_diff, 'prune': cmd_prune, 'export': cmd_export,
+     'export-layer': cmd_export_layer, 'import': cmd_import}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
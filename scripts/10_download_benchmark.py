@@ -0,0 +1,356 @@
+"""
+Benchmark the downloaders against a local stand-in oview server
+(oview/standin.py) instead of mapserver*.nlsc.gov.tw.
+
+  python 10_download_benchmark.py serve --manifest PATH [--port 8765] [faults]
+      Run the stand-in server in the foreground; point a downloader's
+      SERVERS at the printed URL
+  python 10_download_benchmark.py run --manifest PATH [--strategies ...] [faults]
+      Run each downloader strategy against fresh stand-in servers and print
+      tiles/s, p50/p99 request latency and request counts
+
+The tile source is one of --manifest (synthetic tiles from a committed
+manifest.json), --tiles DATASET_DIR (.bin files) or --store LAYER (packed
+store in data/raw/NLSC_tile_store, or under --raw-dir). Faults: --latency, --error-rate,
+--throttle, --truncate-rate (see oview/standin.py).
+
+Strategies:
+  grid-01         01 download_level_range over the --grid-levels ranges
+  grid-06         06 download_tile_grid over the same ranges
+  bfs-08          08 quadtree_download, all four quadrants probed
+  replay-08       08 --replay from a warm-up BFS manifest
+  incremental-08  08 --incremental from the same warm-up (conditional requests)
+  scheduled-08    08's default mode: BFS jobs for two layers (the source's,
+                  and the same tiles as SECOND_LAYER) run together by
+                  DownloadScheduler into one tile cache; a regression run
+                  for stores of several layers writing at once
+
+Every strategy downloads into its own temporary data/raw; nothing under the
+repository is written.
+"""
+import argparse
+import collections
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from oview import DownloadEngine
+from oview.covering import Covering, tile_geo_bbox
+from oview.ratelimit import DEFAULT_RATE
+from oview.scheduler import DownloadScheduler
+from oview.standin import FaultProfile, StandinServer, open_source
+from oview.tilecache import TileCache
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(SCRIPT_DIR)
+RAW_DIR = os.path.join(PROJECT_DIR, 'data', 'raw')
+
+STRATEGIES = ['grid-01', 'grid-06', 'bfs-08', 'replay-08', 'incremental-08',
+              'scheduled-08']
+
+# Second layer name the stand-ins answer for scheduled-08 (same tiles)
+SECOND_LAYER = 'standin_B'
+
+# Numbered scripts cannot be imported by name; loaded once on first use
+_SCRIPTS = {}
+
+
+def load_script(filename):
+    module = _SCRIPTS.get(filename)
+    if module is None:
+        name = 'bench_' + os.path.splitext(filename)[0]
+        spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _SCRIPTS[filename] = module
+    return module
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+# --- Benchmark target ---
+
+class Target:
+    """Layer, bbox, max level and grid ranges the strategies download."""
+
+    def __init__(self, source, bbox=None, max_level=None, margin=None, grid_levels=(5, 6, 7)):
+        manifest = getattr(source, 'manifest', None) or {}
+        keys = source.keys()
+        self.layer = source.layer
+        self.max_level = max_level or manifest.get('max_level') or max(k[0] for k in keys)
+        self.margin = manifest.get('margin', 0.02) if margin is None else margin
+        if bbox is None and 'bbox' in manifest:
+            b = manifest['bbox']
+            bbox = (b['lon_min'], b['lon_max'], b['lat_min'], b['lat_max'])
+        self.bbox = bbox or deepest_extent(keys)
+        covering = Covering.from_bbox(self.bbox, margin=self.margin)
+        self.grid = {level: covering.tile_range(level)
+                     for level in grid_levels if level <= self.max_level}
+
+
+def deepest_extent(keys):
+    """(lon_min, lon_max, lat_min, lat_max) of the deepest tiles of a source."""
+    deepest = max(k[0] for k in keys)
+    boxes = [tile_geo_bbox(*k) for k in keys if k[0] == deepest]
+    return (min(b[0] for b in boxes), max(b[1] for b in boxes),
+            min(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+# --- Strategies ---
+
+def run_grid_01(target, raw_dir, state):
+    m = load_script('01_download_nlsc_tiles.py')
+    cache = TileCache.for_raw_dir(raw_dir)
+    tiles = []
+    for level, (rmin, rmax, cmin, cmax) in sorted(target.grid.items()):
+        tiles += m.download_level_range(target.layer, level, rmin, rmax, cmin, cmax,
+                                        raw_dir, tile_cache=cache)
+    cache.close()
+    return len(tiles)
+
+
+def run_grid_06(target, raw_dir, state):
+    m = load_script('06_download_multi_campus.py')
+    cache = TileCache.for_raw_dir(raw_dir)
+    tiles = []
+    for level, (rmin, rmax, cmin, cmax) in sorted(target.grid.items()):
+        tiles += m.download_tile_grid('benchmark', target.layer, level, rmin, rmax,
+                                      cmin, cmax, os.path.join(raw_dir, f'L{level}'),
+                                      progress=False, tile_cache=cache)
+    cache.close()
+    return len(tiles)
+
+
+def _quadtree(target, raw_dir, **kwargs):
+    m = load_script('08_download_quadtree.py')
+    cache = TileCache.for_raw_dir(raw_dir)
+    tiles = m.quadtree_download(target.layer, target.bbox, os.path.join(raw_dir, 'bench'),
+                                max_level=target.max_level, margin=target.margin,
+                                resume=False, tile_cache=cache, **kwargs)
+    cache.close()
+    return tiles
+
+
+def run_bfs_08(target, raw_dir, state):
+    return len(_quadtree(target, raw_dir))
+
+
+def run_replay_08(target, raw_dir, state):
+    return len(_quadtree(target, state['warm_dir'], replay=state['previous']))
+
+
+def run_incremental_08(target, raw_dir, state):
+    return len(_quadtree(target, state['warm_dir'], replay=state['previous'],
+                         incremental=True))
+
+
+def run_scheduled_08(target, raw_dir, state):
+    m = load_script('08_download_quadtree.py')
+    cache = TileCache.for_raw_dir(raw_dir)
+    scheduler = DownloadScheduler(m.ENGINE, progress_interval=0, out=io.StringIO())
+    for layer in (target.layer, SECOND_LAYER):
+        scheduler.add(layer, m.quadtree_download_steps(
+            layer, target.bbox, os.path.join(raw_dir, layer), max_level=target.max_level,
+            margin=target.margin, resume=False, tile_cache=cache))
+    try:
+        scheduler.run()
+    finally:
+        cache.close()
+    return sum(len(job.result) for job in scheduler.jobs)
+
+
+RUNNERS = {
+    'grid-01': run_grid_01,
+    'grid-06': run_grid_06,
+    'bfs-08': run_bfs_08,
+    'replay-08': run_replay_08,
+    'incremental-08': run_incremental_08,
+    'scheduled-08': run_scheduled_08,
+}
+
+
+def install_engine(servers, args):
+    """A fresh engine for every strategy, installed in all three scripts."""
+    engine = DownloadEngine([s.url for s in servers], {}, per_mirror=args.per_mirror,
+                            timeout=args.timeout, rate=args.rate,
+                            hedge_ratio=args.hedge_ratio)
+    engine.latencies = []
+    for filename in ('01_download_nlsc_tiles.py', '06_download_multi_campus.py',
+                     '08_download_quadtree.py'):
+        load_script(filename).ENGINE = engine
+    return engine
+
+
+def benchmark(strategy, target, servers, args, state, tmp):
+    raw_dir = os.path.join(tmp, strategy)
+    os.makedirs(raw_dir)
+    engine = install_engine(servers, args)
+    for server in servers:
+        server.reset_stats()
+    output = io.StringIO()
+    redirect = (contextlib.nullcontext() if args.verbose
+                else contextlib.redirect_stdout(output))
+    t0 = time.perf_counter()
+    with redirect:
+        tiles = RUNNERS[strategy](target, raw_dir, state)
+    elapsed = time.perf_counter() - t0
+    engine.close()
+    served = sum((s.stats for s in servers), collections.Counter())
+    return {
+        'strategy': strategy,
+        'tiles': tiles,
+        'seconds': round(elapsed, 3),
+        'tiles_per_s': round(tiles / elapsed, 1) if elapsed > 0 else None,
+        'p50_ms': _ms(percentile(engine.latencies, 0.50)),
+        'p99_ms': _ms(percentile(engine.latencies, 0.99)),
+        'requests': engine.stats['requests'],
+        'errors': engine.stats['errors'],
+        'server': dict(served),
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def warm_up(target, servers, args, tmp):
+    """Unmeasured BFS whose manifest and tile store replay / incremental start from."""
+    warm_dir = os.path.join(tmp, 'warm')
+    os.makedirs(warm_dir)
+    engine = install_engine(servers, args)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tiles = _quadtree(target, warm_dir)
+    engine.close()
+    return {'warm_dir': warm_dir,
+            'previous': {'layer': target.layer, 'tiles': tiles,
+                         'max_level': target.max_level}}
+
+
+# --- Commands ---
+
+def faults_from(args, seed_offset=0):
+    seed = None if args.seed is None else args.seed + seed_offset
+    return FaultProfile(latency=args.latency, error_rate=args.error_rate,
+                        throttle_rps=args.throttle, truncate_rate=args.truncate_rate,
+                        seed=seed)
+
+
+def source_from(args):
+    return open_source(manifest=args.manifest, tiles_dir=args.tiles,
+                       store_layer=args.store, raw_dir=args.raw_dir)
+
+
+def cmd_serve(args):
+    source = source_from(args)
+    server = StandinServer(source, faults_from(args), port=args.port)
+    print(f'Serving layer {source.layer} ({len(source.keys())} tiles) at {server.url}')
+    print(f'  {server.faults.describe()}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f'\n  {dict(server.stats)}')
+
+
+def cmd_run(args):
+    source = source_from(args)
+    grid_levels = [int(x) for x in args.grid_levels.split(',') if x]
+    bbox = tuple(float(x) for x in args.bbox.split(',')) if args.bbox else None
+    target = Target(source, bbox=bbox, max_level=args.max_level, grid_levels=grid_levels)
+    strategies = args.strategies or STRATEGIES
+    for strategy in strategies:
+        if strategy not in RUNNERS:
+            print(f'Unknown strategy {strategy}; choose from {STRATEGIES}')
+            sys.exit(1)
+
+    servers = [StandinServer(source, faults_from(args, i), aliases=[SECOND_LAYER]).start()
+               for i in range(max(1, args.mirrors))]
+    print(f'Layer {target.layer}: {len(source.keys())} tiles, max level '
+          f'{target.max_level}, bbox {target.bbox}')
+    print(f'  {len(servers)} stand-in mirror(s): {servers[0].faults.describe()}')
+    print(f'  Client: {args.per_mirror} in flight, {args.rate:g} req/s per mirror\n')
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='oview_bench_') as tmp:
+        state = {}
+        if {'replay-08', 'incremental-08'} & set(strategies):
+            state = warm_up(target, servers, args, tmp)
+        for strategy in strategies:
+            results.append(benchmark(strategy, target, servers, args, state, tmp))
+            print_row(results[-1])
+    for server in servers:
+        server.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'layer': target.layer, 'faults': servers[0].faults.describe(),
+                       'results': results}, f, indent=2)
+        print(f'\nSaved: {args.json}')
+
+
+def print_row(r):
+    s = r['server']
+    extra = ', '.join(f'{s[k]} {k}' for k in ('throttled', 'errors', 'truncated',
+                                              'not_modified') if s.get(k))
+    print(f'  {r["strategy"]:15s} {r["tiles"]:6d} tiles {r["seconds"]:8.2f} s '
+          f'{r["tiles_per_s"] or 0:8.1f} tiles/s  p50 {r["p50_ms"]} ms  '
+          f'p99 {r["p99_ms"]} ms  {r["requests"]} requests ({r["errors"]} failed)'
+          + (f'  [server: {extra}]' if extra else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the downloaders against a '
+                                                 'local stand-in oview server')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    source = common.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help='manifest.json to synthesize tiles from')
+    source.add_argument('--tiles', help='Dataset folder with L*/R*_C*.bin files')
+    source.add_argument('--store', metavar='LAYER', help='Layer in data/raw/NLSC_tile_store')
+    common.add_argument('--raw-dir', default=RAW_DIR, help='data/raw holding the --store')
+    common.add_argument('--latency', default='fixed:0.02',
+                        help='fixed:S, uniform:LO,HI or lognormal:MEDIAN,SIGMA '
+                             '(seconds, default: fixed:0.02)')
+    common.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests answered 503')
+    common.add_argument('--throttle', type=float, default=0.0,
+                        help='Answer 429 above this many requests/s (0 = off)')
+    common.add_argument('--truncate-rate', type=float, default=0.0,
+                        help='Share of tile bodies cut off halfway')
+    common.add_argument('--seed', type=int, help='Random seed for the faults')
+
+    p = sub.add_parser('serve', parents=[common], help='Run the stand-in server')
+    p.add_argument('--port', type=int, default=8765)
+
+    p = sub.add_parser('run', parents=[common], help='Benchmark downloader strategies')
+    p.add_argument('--strategies', nargs='+', metavar='NAME',
+                   help=f'Subset of {STRATEGIES} (default: all)')
+    p.add_argument('--mirrors', type=int, default=1, help='Stand-in mirrors (default: 1)')
+    p.add_argument('--per-mirror', type=int, default=4)
+    p.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                   help=f'Client requests/s per mirror (default: {DEFAULT_RATE:g})')
+    p.add_argument('--hedge-ratio', type=float, default=0.05)
+    p.add_argument('--timeout', type=float, default=10)
+    p.add_argument('--max-level', type=int, help='Default: the manifest\'s, or the deepest tile')
+    p.add_argument('--bbox', help='LON_MIN,LON_MAX,LAT_MIN,LAT_MAX (default: the manifest\'s)')
+    p.add_argument('--grid-levels', default='5,6,7', help='Levels of the grid strategies')
+    p.add_argument('--json', help='Also write the results to this file')
+    p.add_argument('--verbose', action='store_true', help='Show the downloaders\' output')
+
+    args = parser.parse_args()
+    {'serve': cmd_serve, 'run': cmd_run}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
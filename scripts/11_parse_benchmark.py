@@ -0,0 +1,528 @@
+"""
+Benchmark the tile parser: the nlsc_tile package against the per-script
+parsers it replaced (kept below, verbatim, as the baseline).
+
+  python 11_parse_benchmark.py [--synthetic N | --tiles DATASET_DIR | --store LAYER]
+
+Every tile is read into memory first, so only parsing is timed. Each parser
+runs --repeat times over all tiles, alternating with its reference, and the
+best run is reported as tiles/s and MB/s of stored (gzipped) tile data
+(decompressed data for `locate`). Results are compared with the reference
+parser's; any difference is reported and the exit status is 1.
+
+Parsers, as the scripts call them:
+  03      parse_tile_bytes() with the OBB (03_parse_nlsc_tiles.py)
+  07      parse_tile_bytes() without the OBB (07, 08 --parse)
+  08      tile header, children and BUILD_ID flag (08 tile records)
+  fields  07 with --fields downstream (the reference's results are projected
+          after parsing all fields)
+  locate  finding the attribute section in a decompressed tile; try
+          --mesh-bytes 2000000 for tiles the size of real textured ones
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import struct
+import sys
+import time
+
+import nlsc_tile
+from nlsc_tile import synth
+from oview.standin import open_source
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(SCRIPT_DIR)
+RAW_DIR = os.path.join(PROJECT_DIR, 'data', 'raw')
+
+
+# The former parsers, verbatim: 03_parse_nlsc_tiles.py's, 07's copy of them
+# (parse_tile_bytes_07, without the OBB) and 08's header parser
+# (parse_tile_header_08). They are the baseline for speed and results; do
+# not optimize them.
+
+def ecef_to_lonlat(x, y, z):
+    """Convert ECEF coordinates to WGS84 lon/lat/alt."""
+    a = 6378137.0
+    f = 1 / 298.257223563
+    e2 = 2 * f - f * f
+    lon = math.atan2(y, x)
+    p = math.sqrt(x * x + y * y)
+    lat = math.atan2(z, p * (1 - e2))
+    for _ in range(10):
+        N = a / math.sqrt(1 - e2 * math.sin(lat) ** 2)
+        lat = math.atan2(z + e2 * N * math.sin(lat), p)
+    alt = p / math.cos(lat) - N
+    return math.degrees(lon), math.degrees(lat), alt
+
+
+def twd97_to_wgs84(e, n):
+    """Approximate conversion from TWD97 (EPSG:3826) to WGS84."""
+    # TWD97 uses TM2 projection with central meridian 121°E
+    # This is a simplified conversion
+    a = 6378137.0
+    f = 1 / 298.257222101
+    lon0 = math.radians(121.0)
+    k0 = 0.9999
+    dx = 250000.0
+    dy = 0.0
+
+    x = e - dx
+    y = n - dy
+
+    M = y / k0
+    mu = M / (a * (1 - f / 4 * (2 + f) - 3 / 64 * f * f * (1 + f)))
+    e1 = (1 - math.sqrt(1 - (2 * f - f * f))) / (1 + math.sqrt(1 - (2 * f - f * f)))
+
+    phi1 = mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * math.sin(2 * mu)
+    phi1 += (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * math.sin(4 * mu)
+    phi1 += (151 * e1 ** 3 / 96) * math.sin(6 * mu)
+
+    e2 = 2 * f - f * f
+    ep2 = e2 / (1 - e2)
+    C1 = ep2 * math.cos(phi1) ** 2
+    T1 = math.tan(phi1) ** 2
+    N1 = a / math.sqrt(1 - e2 * math.sin(phi1) ** 2)
+    R1 = a * (1 - e2) / ((1 - e2 * math.sin(phi1) ** 2) ** 1.5)
+    D = x / (N1 * k0)
+
+    lat = phi1 - (N1 * math.tan(phi1) / R1) * (
+        D ** 2 / 2 - (5 + 3 * T1 + 10 * C1 - 4 * C1 ** 2 - 9 * ep2) * D ** 4 / 24
+    )
+    lon = lon0 + (
+        D - (1 + 2 * T1 + C1) * D ** 3 / 6
+        + (5 - 2 * C1 + 28 * T1 - 3 * C1 ** 2 + 8 * ep2 + 24 * T1 ** 2) * D ** 5 / 120
+    ) / math.cos(phi1)
+
+    return math.degrees(lon), math.degrees(lat)
+
+
+def parse_tile_header(data):
+    """Parse tile header: level, row, col, OBB."""
+    if len(data) < 12:
+        return None
+
+    level, row, col = struct.unpack_from('<III', data, 0)
+
+    # OBB: 8 corners in ECEF
+    obb_corners = []
+    for i in range(8):
+        offset = 12 + i * 24
+        if offset + 24 <= len(data):
+            x, y, z = struct.unpack_from('<ddd', data, offset)
+            obb_corners.append((x, y, z))
+
+    return {
+        'level': level,
+        'row': row,
+        'col': col,
+        'obb_corners': obb_corners,
+    }
+
+
+def find_attribute_section(data):
+    """Find the attribute metadata section by searching for the field name pattern."""
+    # Search for "BUILD_ID" string which marks the field definitions
+    build_id_pos = data.find(b'BUILD_ID')
+    if build_id_pos < 0:
+        return None
+
+    # The field name "BUILD_ID" is preceded by uint32(8) = its length
+    # Walk backwards to find the start of field definitions
+    # Pattern: [type_codes: 20 × uint32(8)] [field_names] [data]
+    # Before type_codes: [field_count][building_count][field_lengths...]
+
+    # Find where the field name length prefix is
+    name_len_pos = build_id_pos - 4
+    if name_len_pos < 0:
+        return None
+
+    # Verify: uint32 at name_len_pos should be 8 (length of "BUILD_ID")
+    name_len = struct.unpack_from('<I', data, name_len_pos)[0]
+    if name_len != 8:
+        return None
+
+    # Find the type codes: 20 × uint32(8) before the first field name
+    # The type codes should be right before name_len_pos
+    # But we need to find the count first
+
+    # Strategy: search backwards for a sequence of uint32(8) values
+    # The type code section has exactly field_count values, all = 8
+    # Try to find where this sequence starts
+
+    # First, try common field counts (20 is typical)
+    for field_count_guess in [20, 15, 25, 10, 30]:
+        type_codes_start = name_len_pos - field_count_guess * 4
+        if type_codes_start < 0:
+            continue
+
+        # Check if all values at this position are 8
+        all_eight = True
+        for j in range(field_count_guess):
+            v = struct.unpack_from('<I', data, type_codes_start + j * 4)[0]
+            if v != 8:
+                all_eight = False
+                break
+
+        if all_eight:
+            # Found the type codes section
+            # Before it: field_lengths (field_count × uint32)
+            # Before that: building_count (uint32)
+            # Before that: field_count (uint32)
+            field_lengths_start = type_codes_start - field_count_guess * 4
+            meta_start = field_lengths_start - 8  # field_count + building_count
+
+            if meta_start < 0:
+                continue
+
+            fc = struct.unpack_from('<I', data, meta_start)[0]
+            bc = struct.unpack_from('<I', data, meta_start + 4)[0]
+
+            if fc == field_count_guess and 0 < bc < 10000:
+                return {
+                    'meta_offset': meta_start,
+                    'field_count': fc,
+                    'building_count': bc,
+                    'field_lengths_offset': field_lengths_start,
+                    'type_codes_offset': type_codes_start,
+                    'field_names_offset': name_len_pos,
+                }
+
+    return None
+
+
+def parse_tile_attributes(data):
+    """Parse building attributes from a tile's binary data."""
+    attr_info = find_attribute_section(data)
+    if attr_info is None:
+        return None
+
+    fc = attr_info['field_count']
+    bc = attr_info['building_count']
+
+    if bc == 0:
+        return {'field_count': fc, 'building_count': 0, 'fields': [], 'buildings': []}
+
+    # Read field lengths
+    field_lengths = []
+    pos = attr_info['field_lengths_offset']
+    for i in range(fc):
+        fl = struct.unpack_from('<I', data, pos)[0]
+        field_lengths.append(fl)
+        pos += 4
+
+    # Read field names
+    pos = attr_info['field_names_offset']
+    fields = []
+    for i in range(fc):
+        nlen = struct.unpack_from('<I', data, pos)[0]
+        pos += 4
+        name = data[pos:pos + nlen].decode('utf-8', errors='replace')
+        pos += nlen
+        fields.append(name)
+
+    # Data starts after field names + 5-byte separator
+    data_start = pos + 5
+
+    # Parse column-oriented attribute data
+    all_values = {}
+    field_offset = data_start
+
+    for f_idx in range(fc):
+        field_name = fields[f_idx]
+        values = []
+        read_pos = field_offset
+        field_end = field_offset + field_lengths[f_idx]
+
+        for b_idx in range(bc):
+            if read_pos + 4 > field_end:
+                values.append('')
+                continue
+            vlen = struct.unpack_from('<I', data, read_pos)[0]
+            read_pos += 4
+            if vlen > 0 and read_pos + vlen <= field_end + 50:
+                val = data[read_pos:read_pos + vlen].decode('utf-8', errors='replace')
+                read_pos += vlen
+            else:
+                val = ''
+            values.append(val)
+
+        all_values[field_name] = values
+        field_offset += field_lengths[f_idx]
+
+    # Build per-building records
+    buildings = []
+    for b_idx in range(bc):
+        bldg = {}
+        for fname in fields:
+            val = all_values[fname][b_idx]
+            if val and val != 'NA':
+                bldg[fname] = val
+        buildings.append(bldg)
+
+    return {
+        'field_count': fc,
+        'building_count': bc,
+        'fields': fields,
+        'buildings': buildings,
+    }
+
+
+def parse_tile_bytes(raw_data, filepath):
+    """Parse raw tile bytes (from a file or the tile store)."""
+    # Decompress if gzipped
+    if raw_data[:2] == b'\x1f\x8b':
+        try:
+            data = gzip.decompress(raw_data)
+        except Exception:
+            data = raw_data
+    else:
+        data = raw_data
+
+    result = {
+        'file': filepath,
+        'raw_size': len(raw_data),
+        'decompressed_size': len(data),
+    }
+
+    # Parse header
+    header = parse_tile_header(data)
+    if header:
+        result.update(header)
+
+        # Convert OBB corners to WGS84
+        if header['obb_corners']:
+            wgs84_corners = []
+            for x, y, z in header['obb_corners']:
+                if x != 0 or y != 0 or z != 0:
+                    lon, lat, alt = ecef_to_lonlat(x, y, z)
+                    wgs84_corners.append({'lon': lon, 'lat': lat, 'alt': alt})
+            if wgs84_corners:
+                result['obb_wgs84'] = wgs84_corners
+                # Compute bounding box
+                lons = [c['lon'] for c in wgs84_corners]
+                lats = [c['lat'] for c in wgs84_corners]
+                result['bbox'] = {
+                    'lon_min': min(lons), 'lon_max': max(lons),
+                    'lat_min': min(lats), 'lat_max': max(lats),
+                }
+
+    # Parse attributes
+    attrs = parse_tile_attributes(data)
+    if attrs and attrs['building_count'] > 0:
+        result['building_count'] = attrs['building_count']
+        result['fields'] = attrs['fields']
+        result['buildings'] = attrs['buildings']
+
+        # Add WGS84 coordinates from TWD97
+        for bldg in result['buildings']:
+            e97 = bldg.get('CENT_E_97', '')
+            n97 = bldg.get('CENT_N_97', '')
+            if e97 and n97:
+                try:
+                    lon, lat = twd97_to_wgs84(float(e97), float(n97))
+                    bldg['lon'] = round(lon, 7)
+                    bldg['lat'] = round(lat, 7)
+                except (ValueError, ZeroDivisionError):
+                    pass
+
+    return result
+
+
+def parse_tile_bytes_07(raw_data, filepath):
+    import gzip
+    if raw_data[:2] == b'\x1f\x8b':
+        try:
+            data = gzip.decompress(raw_data)
+        except Exception:
+            data = raw_data
+    else:
+        data = raw_data
+    result = {'file': filepath, 'raw_size': len(raw_data), 'decompressed_size': len(data)}
+    if len(data) >= 12:
+        level, row, col = struct.unpack_from('<III', data, 0)
+        result['level'] = level
+        result['row'] = row
+        result['col'] = col
+    attrs = parse_tile_attributes(data)
+    if attrs and attrs['building_count'] > 0:
+        result['building_count'] = attrs['building_count']
+        result['fields'] = attrs['fields']
+        result['buildings'] = attrs['buildings']
+        for bldg in result['buildings']:
+            e97 = bldg.get('CENT_E_97', '')
+            n97 = bldg.get('CENT_N_97', '')
+            if e97 and n97:
+                try:
+                    lon, lat = twd97_to_wgs84(float(e97), float(n97))
+                    bldg['lon'] = round(lon, 7)
+                    bldg['lat'] = round(lat, 7)
+                except (ValueError, ZeroDivisionError):
+                    pass
+    return result
+
+
+def parse_tile_header_08(data):
+    """Parse tile header to get level, row, col, and children."""
+    if data[:2] == b'\x1f\x8b':
+        try:
+            data = gzip.decompress(data)
+        except Exception:
+            pass
+
+    info = {'size': len(data)}
+    if len(data) >= 12:
+        info['level'], info['row'], info['col'] = struct.unpack_from('<III', data, 0)
+
+    # Children at offset 228
+    if len(data) >= 232:
+        child_count = struct.unpack_from('<I', data, 228)[0]
+        if 0 < child_count <= 10:
+            children = []
+            for i in range(child_count):
+                if 232 + i * 4 + 4 <= len(data):
+                    children.append(struct.unpack_from('<I', data, 232 + i * 4)[0])
+            info['children'] = children
+        else:
+            info['children'] = []
+    else:
+        info['children'] = []
+
+    info['has_build_id'] = b'BUILD_ID' in data
+    return info
+
+
+def project_07(data, path, fields=nlsc_tile.DOWNSTREAM_FIELDS):
+    """The reference 07 parse, cut down to `fields` (and lon/lat) afterwards."""
+    result = parse_tile_bytes_07(data, path)
+    if 'fields' in result:
+        keep = set(fields) | {'lon', 'lat'}
+        result['fields'] = [name for name in result['fields'] if name in fields]
+        result['buildings'] = [{k: v for k, v in bldg.items() if k in keep}
+                               for bldg in result['buildings']]
+    return result
+
+
+# name -> (reference parser, nlsc_tile parser), both called as f(data, path)
+# on the stored tiles, or on decompressed ones for the names in DECOMPRESSED
+PARSERS = {
+    '03': (parse_tile_bytes, nlsc_tile.parse_tile_bytes),
+    '07': (parse_tile_bytes_07,
+           lambda data, path: nlsc_tile.parse_tile_bytes(data, path, obb=False)),
+    'fields': (project_07,
+               lambda data, path: nlsc_tile.parse_tile_bytes(
+                   data, path, obb=False, fields=nlsc_tile.DOWNSTREAM_FIELDS)),
+    '08': (lambda data, path: parse_tile_header_08(data),
+           lambda data, path: nlsc_tile.header_info(data)),
+    'locate': (lambda data, path: find_attribute_section(data),
+               lambda data, path: nlsc_tile.Tile(data).attribute_section()),
+}
+DECOMPRESSED = {'locate'}
+
+
+def load_tiles(args):
+    """(path, stored bytes) for every tile of the chosen source."""
+    if args.tiles or args.store:
+        source = open_source(tiles_dir=args.tiles, store_layer=args.store,
+                             raw_dir=args.raw_dir)
+        tiles = []
+        for level, row, col in source.keys():
+            data = source.get(level, row, col)
+            if data:
+                tiles.append((f'L{level}/R{row}_C{col}.bin', data))
+        return source.layer, tiles
+    return 'synthetic', synth.synthetic_tiles(
+        args.synthetic, buildings_per_tile=args.buildings, mesh_size=args.mesh_bytes)
+
+
+def run_once(parse, tiles):
+    t0 = time.perf_counter()
+    results = [parse(data, path) for path, data in tiles]
+    return time.perf_counter() - t0, results
+
+
+def benchmark(name, tiles, repeat):
+    """
+    Time the reference and nlsc_tile parsers in alternating runs (so CPU
+    frequency changes hit both alike) and keep each one's best run.
+    """
+    parsers = dict(zip(('reference', 'nlsc_tile'), PARSERS[name]))
+    if name in DECOMPRESSED:
+        tiles = [(path, nlsc_tile.Tile.from_bytes(data).data) for path, data in tiles]
+    best = {}
+    results = {}
+    for _ in range(max(1, repeat)):
+        for label, parse in parsers.items():
+            seconds, results[label] = run_once(parse, tiles)
+            best[label] = min(best.get(label, seconds), seconds)
+
+    total_mb = sum(len(data) for _, data in tiles) / 1e6
+    row = {'parser': name, 'tiles': len(tiles)}
+    for label, seconds in best.items():
+        row[label] = {
+            'seconds': round(seconds, 4),
+            'tiles_per_s': round(len(tiles) / seconds, 1) if seconds else None,
+            'mb_per_s': round(total_mb / seconds, 2) if seconds else None,
+        }
+    row['mismatches'] = [path for (path, _), a, b in zip(
+        tiles, results['reference'], results['nlsc_tile']) if a != b]
+    row['speedup'] = round(best['reference'] / best['nlsc_tile'], 2) if best['nlsc_tile'] else None
+    return row
+
+
+def print_row(r):
+    ref, new = r['reference'], r['nlsc_tile']
+    status = 'identical' if not r['mismatches'] else f'{len(r["mismatches"])} DIFFER'
+    print(f'  {r["parser"]:6s} reference {ref["tiles_per_s"]:9.1f} tiles/s '
+          f'{ref["mb_per_s"]:7.2f} MB/s | nlsc_tile {new["tiles_per_s"]:9.1f} tiles/s '
+          f'{new["mb_per_s"]:7.2f} MB/s | x{r["speedup"]}  {status}')
+    for path in r['mismatches'][:5]:
+        print(f'         differs: {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the nlsc_tile parser against '
+                                                 'the scripts\' former parsers')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--synthetic', type=int, default=500, metavar='N',
+                        help='N synthetic tiles, half with buildings (default: 500)')
+    source.add_argument('--tiles', help='Dataset folder with L*/R*_C*.bin files')
+    source.add_argument('--store', metavar='LAYER', help='Layer in data/raw/NLSC_tile_store')
+    parser.add_argument('--raw-dir', default=RAW_DIR, help='data/raw holding the --store')
+    parser.add_argument('--buildings', type=int, default=40,
+                        help='Buildings per synthetic tile with buildings (default: 40)')
+    parser.add_argument('--mesh-bytes', type=int, default=20000,
+                        help='Mesh/texture bytes per synthetic tile (default: 20000)')
+    parser.add_argument('--parsers', nargs='+', choices=list(PARSERS), default=list(PARSERS))
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per parser (best is kept)')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    layer, tiles = load_tiles(args)
+    if not tiles:
+        print('No tiles to parse')
+        sys.exit(1)
+    total = sum(len(data) for _, data in tiles)
+    with_attrs = sum(1 for _, data in tiles if nlsc_tile.Tile.from_bytes(data).has_build_id)
+    print(f'Layer {layer}: {len(tiles)} tiles, {total / 1e6:.1f} MB stored, '
+          f'{with_attrs} with BUILD_ID; best of {args.repeat} runs\n')
+
+    results = []
+    for name in args.parsers:
+        results.append(benchmark(name, tiles, args.repeat))
+        print_row(results[-1])
+
+    print(f'\n  nlsc_tile {nlsc_tile.locator_summary()} (all runs)')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'layer': layer, 'tiles': len(tiles), 'results': results,
+                       'locator': dict(nlsc_tile.LOCATOR_STATS)}, f, indent=2)
+        print(f'\nSaved: {args.json}')
+    if any(r['mismatches'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Parser for NLSC PilotGaea oview 3D building tiles, shared by 03, 07 and 08.
+
+The format was discovered by reverse-engineering 3dmaps.nlsc.gov.tw. Tiles
+are usually gzipped; decompressed they hold:
+
+  Header (12 bytes):
+    uint32 level, uint32 row, uint32 col
+  OBB (192 bytes):
+    8 corners × 3 doubles (ECEF coordinates)
+  Additional ECEF point (24 bytes)
+  Child info (variable):
+    uint32 child_count
+    child_count × uint32 child_ids
+  Mesh/texture data (variable):
+    Building geometry and JPEG textures
+  Attribute metadata:
+    uint32 field_count
+    uint32 building_count
+    field_count × uint32 field_lengths
+    field_count × uint32 type_codes
+    field_count × (uint32 name_len + name_bytes) field_names
+    5-byte separator (00 00 00 00 37)
+    field_count × field_data blocks (column-oriented, uint32+string per value)
+
+The attribute section is the last one; nothing is known about the layout of
+the mesh/texture data, so locate.py finds the section from the end of the
+tile. layout.py has the offsets and precompiled structs, tile.py the Tile
+object and the parse functions the scripts call, and synth.py synthetic
+tiles.
+"""
+from .columns import (DOWNSTREAM_FIELDS, NUMERIC_FIELDS, AttributeColumns, decode_columns,
+                      field_projection)
+from .geo import ecef_to_lonlat, twd97_to_wgs84
+from .locate import (LOCATOR_STATS, find_attribute_section, locate_attribute_section,
+                     locator_summary)
+from .parallel import parse_tiles, worker_count
+from .tile import (ParsedTile, Tile, header_info, parse_tile_attributes, parse_tile_bytes,
+                   parse_tile_columns, parse_tile_file)
+
+__all__ = [
+    'AttributeColumns',
+    'DOWNSTREAM_FIELDS',
+    'LOCATOR_STATS',
+    'NUMERIC_FIELDS',
+    'ParsedTile',
+    'Tile',
+    'decode_columns',
+    'ecef_to_lonlat',
+    'field_projection',
+    'find_attribute_section',
+    'header_info',
+    'locate_attribute_section',
+    'locator_summary',
+    'parse_tile_attributes',
+    'parse_tile_bytes',
+    'parse_tile_columns',
+    'parse_tile_file',
+    'parse_tiles',
+    'twd97_to_wgs84',
+    'worker_count',
+]
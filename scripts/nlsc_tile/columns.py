@@ -0,0 +1,219 @@
+"""
+Columnar decoding of a tile's attribute data.
+
+Each field's block holds building_count values of uint32 length + UTF-8
+bytes. decode_columns() decodes a block at a time instead of value by
+value:
+
+  - with NumPy, a block whose values all have the same length (dates, IDs,
+    fixed-format coordinates, the 'NA' placeholders) is one strided array:
+    all length prefixes are checked at once and the values cut out without
+    walking the block;
+  - otherwise the length prefixes are walked once, and an ASCII block is
+    decoded once and sliced, so only non-ASCII values (building names) are
+    decoded one by one.
+
+Numeric fields (NUMERIC_FIELDS) also come out as float64 arrays, NaN where
+the value is empty, 'NA' or not a number: numpy.ndarray with NumPy,
+array.array('d') without. They are parsed with float(), the same as the
+per-building conversions before, which is also faster than NumPy's own
+string parsing. The string values follow the former per-value
+rules exactly, including a length that overruns its block by more than 50
+bytes reading as ''.
+
+A projection (`fields`, e.g. DOWNSTREAM_FIELDS) skips the blocks of all
+other fields by their field_lengths entry: they are neither walked nor
+decoded.
+
+`data` is a memoryview of the tile (Tile.view): values are decoded from
+memoryview slices with str(), without copying them out first.
+"""
+import math
+from array import array
+
+from .layout import SEPARATOR_SIZE, U32, u32_array
+
+try:
+    import numpy as np
+except ImportError:     # the stdlib decoder below is used instead
+    np = None
+
+# Fields decode_columns() converts to float64 by default
+NUMERIC_FIELDS = ('BUILD_H', 'CENT_E_97', 'CENT_N_97')
+
+# The fields 04_merge_datasets.py and 05_export_building_table.py use
+# (--fields downstream)
+DOWNSTREAM_FIELDS = ('BUILD_ID', 'BUILD_H', 'BUILD_STR', 'MODEL_LOD', 'MODEL_NAME', 'MDATE',
+                     'M_MDATE', 'CENT_E_97', 'CENT_N_97')
+
+# How far a value may run past its block (the former parser's tolerance)
+OVERRUN = 50
+
+MISSING = ('', 'NA')
+
+
+class AttributeColumns:
+    """
+    One tile's attributes by column: `fields` (names in tile order),
+    `strings` (name -> list of str, '' when missing) and `numbers` (name ->
+    float64 array) for the numeric fields that were requested.
+    `field_count` is the tile's, also with a projection.
+    """
+
+    __slots__ = ('fields', 'building_count', 'strings', 'numbers', 'field_count')
+
+    def __init__(self, fields, building_count, strings, numbers, field_count=None):
+        self.fields = fields
+        self.building_count = building_count
+        self.strings = strings
+        self.numbers = numbers
+        self.field_count = len(fields) if field_count is None else field_count
+
+    def floats(self, name):
+        """float64 array of a field (converted now if it was not requested)."""
+        values = self.numbers.get(name)
+        if values is None and name in self.strings:
+            values = self.numbers[name] = to_float64(self.strings[name])
+        return values
+
+    def records(self):
+        """Per-building dicts without the empty and 'NA' values."""
+        fields = self.fields
+        columns = [self.strings[name] for name in fields]
+        return [{name: val for name, val in zip(fields, row) if val and val != 'NA'}
+                for row in zip(*columns)]
+
+
+def to_float64(values):
+    """float64 array of str values; NaN for '', 'NA' and non-numbers."""
+    if '' not in values and 'NA' not in values:
+        try:
+            if np is not None:
+                return np.fromiter(map(float, values), np.float64, len(values))
+            return array('d', map(float, values))
+        except ValueError:
+            pass    # some value is not a number; convert one by one below
+    out = array('d', bytes(8 * len(values)))
+    for i, value in enumerate(values):
+        try:
+            out[i] = float(value) if value not in MISSING else math.nan
+        except ValueError:
+            out[i] = math.nan
+    return np.asarray(out) if np is not None else out
+
+
+def _fixed_width(data, start, end, bc):
+    """The block's values if all have the same ASCII length (NumPy only)."""
+    size = end - start
+    if size < 4 or end > len(data):
+        return None
+    width = U32.unpack_from(data, start)[0]
+    if width == 0 or (4 + width) * bc != size:
+        return None
+    rows = np.frombuffer(data, np.uint8, size, start).reshape(bc, 4 + width)
+    if not (rows[:, :4] == rows[0, :4]).all():
+        return None
+    chars = rows[:, 4:]
+    # NUL would be dropped by the bytes dtype; non-ASCII needs UTF-8
+    if not ((chars > 0) & (chars < 0x80)).all():
+        return None
+    cells = np.ascontiguousarray(chars).view(f'S{width}').ravel().tolist()
+    return [cell.decode('ascii') for cell in cells]
+
+
+def _walk(data, start, end, bc):
+    """The block's values by walking the length prefixes."""
+    unpack = U32.unpack_from
+    limit = end + OVERRUN
+    # An ASCII block is decoded once; str offsets then equal byte offsets
+    try:
+        text = str(data[start:limit], 'ascii')
+        base = start
+    except UnicodeDecodeError:
+        text = None
+    values = []
+    append = values.append
+    pos = start
+    for _ in range(bc):
+        if pos + 4 > end:
+            values.extend([''] * (bc - len(values)))
+            break
+        vlen = unpack(data, pos)[0]
+        first = pos + 4
+        pos = first + vlen
+        if vlen > 0 and pos <= limit:
+            if text is not None:
+                append(text[first - base:pos - base])
+            else:
+                append(str(data[first:pos], 'utf-8', 'replace'))
+        else:
+            append('')
+            pos = first
+    return values
+
+
+def field_projection(names):
+    """
+    The `fields` for decode_columns() from command line names (separated
+    by spaces or commas): None (all fields) for no names or 'all',
+    DOWNSTREAM_FIELDS for 'downstream', and always BUILD_ID, which the
+    scripts deduplicate buildings by.
+    """
+    names = [name for arg in names or () for name in arg.split(',') if name]
+    if not names or 'all' in names:
+        return None
+    projection = []
+    for name in names:
+        for field in (DOWNSTREAM_FIELDS if name == 'downstream' else (name,)):
+            if field not in projection:
+                projection.append(field)
+    if 'BUILD_ID' not in projection:
+        projection.insert(0, 'BUILD_ID')
+    return tuple(projection)
+
+
+def decode_columns(data, section, numeric=NUMERIC_FIELDS, fields=None):
+    """
+    AttributeColumns of the section found by find_attribute_section().
+
+    With `fields` (names), only those fields and the `numeric` ones are
+    decoded; the other blocks are skipped by their field_lengths entry, and
+    the columns' `fields` and records() hold the requested ones in tile order.
+    """
+    fc = section['field_count']
+    bc = section['building_count']
+    unpack = U32.unpack_from
+    field_lengths = u32_array(fc).unpack_from(data, section['field_lengths_offset'])
+
+    pos = section['field_names_offset']
+    names = []
+    for _ in range(fc):
+        nlen = unpack(data, pos)[0]
+        pos += 4
+        names.append(str(data[pos:pos + nlen], 'utf-8', 'replace'))
+        pos += nlen
+
+    wanted = None
+    if fields is not None:
+        wanted = set(fields).union(numeric)
+        fields = [name for name in names if name in fields]
+    else:
+        fields = names
+
+    strings = {}
+    start = pos + SEPARATOR_SIZE
+    for name, length in zip(names, field_lengths):
+        end = start + length
+        if wanted is not None and name not in wanted:
+            start = end     # not requested: skip the block unread
+            continue
+        values = None
+        if np is not None and bc:
+            values = _fixed_width(data, start, end, bc)
+        if values is None:
+            values = _walk(data, start, end, bc)
+        strings[name] = values      # a repeated name keeps its last column
+        start = end
+
+    numbers = {name: to_float64(strings[name]) for name in numeric if name in strings}
+    return AttributeColumns(fields, bc, strings, numbers, fc)
@@ -0,0 +1,80 @@
+"""
+Coordinate conversions for tile data: ECEF (OBB corners) and TWD97
+(building centroids) to WGS84.
+"""
+import math
+
+
+# WGS84 ellipsoid (ECEF)
+_A = 6378137.0
+_F = 1 / 298.257223563
+_E2 = 2 * _F - _F * _F
+
+
+def ecef_to_lonlat(x, y, z):
+    """Convert ECEF coordinates to WGS84 lon/lat/alt."""
+    sin, sqrt, atan2 = math.sin, math.sqrt, math.atan2
+    lon = atan2(y, x)
+    p = sqrt(x * x + y * y)
+    lat = atan2(z, p * (1 - _E2))
+    for _ in range(10):
+        sin_lat = sin(lat)
+        N = _A / sqrt(1 - _E2 * sin_lat ** 2)
+        lat = atan2(z + _E2 * N * sin_lat, p)
+    alt = p / math.cos(lat) - N
+    return math.degrees(lon), math.degrees(lat), alt
+
+
+# TWD97 uses TM2 projection with central meridian 121°E (GRS80 ellipsoid).
+# Everything that does not depend on the point is computed once, with the
+# same expressions as before, so results are bit-for-bit unchanged.
+_TM_A = 6378137.0
+_TM_F = 1 / 298.257222101
+_TM_LON0 = math.radians(121.0)
+_TM_K0 = 0.9999
+_TM_DX = 250000.0
+_TM_DY = 0.0
+_TM_MU_DIV = _TM_A * (1 - _TM_F / 4 * (2 + _TM_F) - 3 / 64 * _TM_F * _TM_F * (1 + _TM_F))
+_TM_E1 = (1 - math.sqrt(1 - (2 * _TM_F - _TM_F * _TM_F))) / (
+    1 + math.sqrt(1 - (2 * _TM_F - _TM_F * _TM_F)))
+_TM_P2 = 3 * _TM_E1 / 2 - 27 * _TM_E1 ** 3 / 32
+_TM_P4 = 21 * _TM_E1 ** 2 / 16 - 55 * _TM_E1 ** 4 / 32
+_TM_P6 = 151 * _TM_E1 ** 3 / 96
+_TM_E2 = 2 * _TM_F - _TM_F * _TM_F
+_TM_EP2 = _TM_E2 / (1 - _TM_E2)
+_TM_EP2_9 = 9 * _TM_EP2
+_TM_EP2_8 = 8 * _TM_EP2
+_TM_R1 = _TM_A * (1 - _TM_E2)
+
+
+def twd97_to_wgs84(e, n):
+    """Approximate conversion from TWD97 (EPSG:3826) to WGS84."""
+    sin = math.sin
+    x = e - _TM_DX
+    y = n - _TM_DY
+
+    M = y / _TM_K0
+    mu = M / _TM_MU_DIV
+
+    phi1 = mu + _TM_P2 * sin(2 * mu)
+    phi1 += _TM_P4 * sin(4 * mu)
+    phi1 += _TM_P6 * sin(6 * mu)
+
+    cos_phi1 = math.cos(phi1)
+    tan_phi1 = math.tan(phi1)
+    w = 1 - _TM_E2 * sin(phi1) ** 2
+    C1 = _TM_EP2 * cos_phi1 ** 2
+    T1 = tan_phi1 ** 2
+    N1 = _TM_A / math.sqrt(w)
+    R1 = _TM_R1 / (w ** 1.5)
+    D = x / (N1 * _TM_K0)
+
+    lat = phi1 - (N1 * tan_phi1 / R1) * (
+        D ** 2 / 2 - (5 + 3 * T1 + 10 * C1 - 4 * C1 ** 2 - _TM_EP2_9) * D ** 4 / 24
+    )
+    lon = _TM_LON0 + (
+        D - (1 + 2 * T1 + C1) * D ** 3 / 6
+        + (5 - 2 * C1 + 28 * T1 - 3 * C1 ** 2 + _TM_EP2_8 + 24 * T1 ** 2) * D ** 5 / 120
+    ) / cos_phi1
+
+    return math.degrees(lon), math.degrees(lat)
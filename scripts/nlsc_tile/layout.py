@@ -0,0 +1,51 @@
+"""
+Byte layout of a decompressed oview tile, as precompiled struct.Struct
+objects and offsets (see the package docstring for the format).
+"""
+import functools
+import struct
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Header: uint32 level, row, col
+HEADER = struct.Struct('<III')
+
+# OBB: 8 ECEF corners of 3 doubles each, right after the header
+OBB_OFFSET = HEADER.size
+OBB_CORNERS = 8
+CORNER = struct.Struct('<ddd')
+
+# One more ECEF point after the OBB
+CENTER_OFFSET = OBB_OFFSET + OBB_CORNERS * CORNER.size
+
+# Child info: uint32 child_count, then child_count uint32 ids
+CHILD_COUNT_OFFSET = CENTER_OFFSET + CORNER.size
+CHILD_IDS_OFFSET = CHILD_COUNT_OFFSET + 4
+MAX_CHILDREN = 10
+
+U32 = struct.Struct('<I')
+
+# Attribute metadata: uint32 field_count, building_count
+ATTR_COUNTS = struct.Struct('<II')
+
+# Between the field names and the column data
+SEPARATOR = b'\x00\x00\x00\x00\x37'
+SEPARATOR_SIZE = len(SEPARATOR)
+
+# Every field definition section starts with the BUILD_ID field name;
+# fields are strings, type code 8
+BUILD_ID = b'BUILD_ID'
+STRING_TYPE = 8
+
+# Sanity limits of a section's counts
+MAX_FIELDS = 255
+MAX_BUILDINGS = 10000
+
+# Field counts the fallback locator tries, most common first
+FIELD_COUNT_GUESSES = (20, 15, 25, 10, 30)
+
+
+@functools.lru_cache(maxsize=None)
+def u32_array(count):
+    """Struct for `count` consecutive uint32 values."""
+    return struct.Struct(f'<{count}I')
@@ -0,0 +1,196 @@
+"""
+Finding the attribute metadata in a decompressed tile.
+
+The mesh/texture data between the child info and the attributes has no
+length table we know of, but the attribute section is the last one in the
+tile. locate_attribute_section() therefore searches backwards from the end
+of the tile for the first field name record (uint32 8 + "BUILD_ID"), which
+only crosses the attribute data itself and never the mesh and JPEG bytes
+in front of it. From there the layout is walked instead of guessed:
+
+  - the field names are read up to the separator, which gives field_count;
+  - field_count, building_count, the field lengths and the type codes sit
+    right in front of the names, so their offsets follow from field_count;
+  - the section must start after the child info, repeat field_count, have
+    string type codes, and its column data must end inside the tile.
+
+Any field count is accepted. When the walk finds nothing that checks out,
+scan_attribute_section() (the former heuristic: first BUILD_ID, field
+counts 20, 15, 25, 10 and 30) gets a try, and LOCATOR_STATS counts it.
+
+`data` may be any buffer. bytes (and bytearray, mmap) are searched with
+their own find()/rfind(); memoryview has neither, so a memoryview is
+searched with a compiled pattern, which takes it as it is, backwards
+SEARCH_CHUNK bytes at a time.
+"""
+import collections
+import functools
+import re
+
+from .layout import (ATTR_COUNTS, BUILD_ID, FIELD_COUNT_GUESSES, MAX_BUILDINGS, MAX_FIELDS,
+                     SEPARATOR_SIZE, STRING_TYPE, U32, u32_array)
+
+# The BUILD_ID field name record: its uint32 length, then the name
+BUILD_ID_RECORD = U32.pack(len(BUILD_ID)) + BUILD_ID
+
+# Bytes rfind() searches a memoryview at a time, from the end backwards
+SEARCH_CHUNK = 16384
+
+# How find_attribute_section() found each section: 'layout' (walked),
+# 'fallback' (the heuristic) or 'none' (a BUILD_ID field name, but no section)
+LOCATOR_STATS = collections.Counter()
+
+
+@functools.lru_cache(maxsize=None)
+def _pattern(sub):
+    return re.compile(re.escape(sub))
+
+
+def find(data, sub, start=0, end=None):
+    """data.find(sub, start, end), also for a memoryview."""
+    if end is None:
+        end = len(data)
+    if not isinstance(data, memoryview):
+        return data.find(sub, start, end)
+    match = _pattern(sub).search(data, start, end)
+    return match.start() if match else -1
+
+
+def rfind(data, sub, start, end):
+    """data.rfind(sub, start, end), also for a memoryview."""
+    if not isinstance(data, memoryview):
+        return data.rfind(sub, start, end)
+    pattern = _pattern(sub)
+    overlap = len(sub) - 1
+    while end > start:
+        low = max(start, end - SEARCH_CHUNK)
+        last = None
+        for last in pattern.finditer(data, low, end):
+            pass
+        if last is not None:
+            return last.start()
+        if low == start:
+            break
+        end = low + overlap     # a match across the chunk boundary
+    return -1
+
+
+def _section(meta_start, fc, bc, name_len_pos):
+    field_lengths_start = meta_start + ATTR_COUNTS.size
+    return {
+        'meta_offset': meta_start,
+        'field_count': fc,
+        'building_count': bc,
+        'field_lengths_offset': field_lengths_start,
+        'type_codes_offset': field_lengths_start + fc * 4,
+        'field_names_offset': name_len_pos,
+    }
+
+
+def _section_at(data, name_len_pos, start):
+    """The section whose field names start at name_len_pos, if it checks out."""
+    size = len(data)
+    unpack = U32.unpack_from
+    pos = name_len_pos
+    fc = 0
+    while True:
+        if pos + 4 > size or fc > MAX_FIELDS:
+            return None
+        nlen = unpack(data, pos)[0]
+        if nlen == 0:
+            break       # the separator starts with uint32 0
+        pos += 4 + nlen
+        fc += 1
+    data_start = pos + SEPARATOR_SIZE
+
+    type_codes_start = name_len_pos - fc * 4
+    meta_start = type_codes_start - fc * 4 - ATTR_COUNTS.size
+    if meta_start < start:
+        return None
+    count, bc = ATTR_COUNTS.unpack_from(data, meta_start)
+    if count != fc or not 0 < bc < MAX_BUILDINGS:
+        return None
+    words = u32_array(fc)
+    if words.unpack_from(data, type_codes_start).count(STRING_TYPE) != fc:
+        return None
+    if data_start + sum(words.unpack_from(data, meta_start + ATTR_COUNTS.size)) > size:
+        return None
+    return _section(meta_start, fc, bc, name_len_pos)
+
+
+def _walk(data, start):
+    """(section or None, whether any BUILD_ID name record was seen)."""
+    end = len(data)
+    seen = False
+    while True:
+        pos = rfind(data, BUILD_ID_RECORD, start, end)
+        if pos < 0:
+            return None, seen
+        seen = True
+        section = _section_at(data, pos, start)
+        if section is not None:
+            return section, seen
+        end = pos   # a BUILD_ID value, or mesh bytes; look further back
+
+
+def locate_attribute_section(data, start=0):
+    """
+    Walk to the attribute section from the end of the tile; `start` is the
+    end of the child info (Tile.body_offset). None if nothing checks out.
+    """
+    return _walk(data, start)[0]
+
+
+def scan_attribute_section(data):
+    """
+    The former heuristic: the first BUILD_ID in the tile, preceded by a run
+    of field_count type codes (all 8) for a field_count of 20, 15, 25, 10 or
+    30, with field_count repeated where the metadata would start.
+    """
+    build_id_pos = find(data, BUILD_ID)
+    name_len_pos = build_id_pos - 4
+    if build_id_pos < 0 or name_len_pos < 0:
+        return None
+    if U32.unpack_from(data, name_len_pos)[0] != len(BUILD_ID):
+        return None
+
+    for field_count in FIELD_COUNT_GUESSES:
+        type_codes_start = name_len_pos - field_count * 4
+        if type_codes_start < 0:
+            continue
+        type_codes = u32_array(field_count).unpack_from(data, type_codes_start)
+        if type_codes.count(STRING_TYPE) != field_count:
+            continue
+        meta_start = type_codes_start - field_count * 4 - ATTR_COUNTS.size
+        if meta_start < 0:
+            continue
+        fc, bc = ATTR_COUNTS.unpack_from(data, meta_start)
+        if fc == field_count and 0 < bc < MAX_BUILDINGS:
+            return _section(meta_start, fc, bc, name_len_pos)
+    return None
+
+
+def find_attribute_section(data, start=0):
+    """
+    Offsets and counts of the attribute metadata, or None: walked by
+    locate_attribute_section(), else found by scan_attribute_section().
+    """
+    section, seen = _walk(data, start)
+    if section is not None:
+        LOCATOR_STATS['layout'] += 1
+        return section
+    if not seen and find(data, BUILD_ID_RECORD, 0, start + len(BUILD_ID_RECORD) - 1) < 0:
+        return None     # no BUILD_ID field name anywhere: a tile without attributes
+    section = scan_attribute_section(data)
+    LOCATOR_STATS['fallback' if section is not None else 'none'] += 1
+    return section
+
+
+def locator_summary():
+    """One line on how the attribute sections parsed so far were found."""
+    stats = LOCATOR_STATS
+    text = (f'attribute sections: {stats["layout"]} located by layout, '
+            f'{stats["fallback"]} by the BUILD_ID fallback')
+    if stats['none']:
+        text += f', {stats["none"]} tiles with a BUILD_ID field name but no section'
+    return text
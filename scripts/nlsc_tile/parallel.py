@@ -0,0 +1,87 @@
+"""
+Parsing tiles on a process pool (03 and 07 --workers).
+
+Gzip and attribute decoding are CPU-bound, so parse_tiles() spreads the
+tiles over worker processes. The caller still reads the tiles (tile stores
+are SQLite files); each worker gets (path, stored bytes) and sends back a
+ParsedTile: the buildings by column and lon/lat as arrays, which pickle
+far smaller than lists of dicts, so the caller builds dicts only for the
+buildings it keeps.
+
+Results come back in the order the tiles were given, whatever order the
+workers finish in, so BUILD_ID "first seen wins" deduplication sees the
+same sequence as a serial run. At most a few chunks per worker are in
+flight, which bounds the tiles held in memory. The workers' LOCATOR_STATS
+are added to this process's.
+"""
+import collections
+import concurrent.futures
+import os
+
+from .locate import LOCATOR_STATS
+from .tile import parse_tile_columns
+
+# Tiles per task sent to a worker, and tasks in flight per worker
+CHUNK_SIZE = 8
+TASKS_PER_WORKER = 4
+
+
+def worker_count(workers):
+    """--workers value to a process count: 0 means one per CPU."""
+    if workers is None:
+        return 1
+    return max(1, workers) if workers else os.cpu_count() or 1
+
+
+def _parse_chunk(chunk, obb, fields):
+    """Worker: [(path, ParsedTile or exception)] and its LOCATOR_STATS counts."""
+    LOCATOR_STATS.clear()
+    parsed = []
+    for path, raw_data in chunk:
+        try:
+            parsed.append((path, parse_tile_columns(raw_data, path, obb, fields)))
+        except Exception as e:
+            parsed.append((path, e))
+    return parsed, dict(LOCATOR_STATS)
+
+
+def _chunks(tiles, size):
+    chunk = []
+    for tile in tiles:
+        chunk.append(tile)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_tiles(tiles, workers=1, obb=True, fields=None, chunk_size=CHUNK_SIZE):
+    """
+    Parse (path, stored bytes) pairs; yields (path, ParsedTile or the
+    exception that parsing raised) in the order of `tiles`. With one worker
+    the tiles are parsed in this process.
+    """
+    workers = worker_count(workers)
+    if workers == 1:
+        for path, raw_data in tiles:
+            try:
+                yield path, parse_tile_columns(raw_data, path, obb, fields)
+            except Exception as e:
+                yield path, e
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for chunk in _chunks(tiles, chunk_size):
+            pending.append(pool.submit(_parse_chunk, chunk, obb, fields))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                yield from _collect(pending.popleft())
+        while pending:
+            yield from _collect(pending.popleft())
+
+
+def _collect(future):
+    parsed, stats = future.result()
+    LOCATOR_STATS.update(stats)
+    return parsed
@@ -0,0 +1,101 @@
+"""
+Synthetic tiles in the oview layout, for benchmarks and parser checks
+without downloaded data (11_parse_benchmark.py).
+"""
+import gzip
+import math
+import random
+import struct
+
+from .layout import CORNER, HEADER, OBB_CORNERS, SEPARATOR, STRING_TYPE
+
+# The fields named in the docs, padded to the usual 20 with placeholders
+FIELDS = ('BUILD_ID', 'BUILD_H', 'BUILD_STR', 'MODEL_LOD', 'MODEL_NAME', 'MDATE',
+          'M_MDATE', 'CENT_E_97', 'CENT_N_97', 'BUILDNAME') + tuple(
+              f'ATTR_{i:02d}' for i in range(11, 21))
+
+# Around Guangfu campus (TWD97 metres)
+CENTER_E97 = 249200.0
+CENTER_N97 = 2743000.0
+
+
+def lonlat_to_ecef(lon, lat, alt=0.0):
+    a = 6378137.0
+    f = 1 / 298.257223563
+    e2 = 2 * f - f * f
+    lon, lat = math.radians(lon), math.radians(lat)
+    n = a / math.sqrt(1 - e2 * math.sin(lat) ** 2)
+    return ((n + alt) * math.cos(lat) * math.cos(lon),
+            (n + alt) * math.cos(lat) * math.sin(lon),
+            (n * (1 - e2) + alt) * math.sin(lat))
+
+
+def encode_attributes(buildings, fields=FIELDS):
+    """The attribute metadata and column data for `buildings` (dicts of str)."""
+    blocks = []
+    for name in fields:
+        block = bytearray()
+        for bldg in buildings:
+            value = str(bldg.get(name, 'NA')).encode('utf-8')
+            block += struct.pack('<I', len(value)) + value
+        blocks.append(bytes(block))
+    out = bytearray(struct.pack('<II', len(fields), len(buildings)))
+    out += struct.pack(f'<{len(fields)}I', *(len(b) for b in blocks))
+    out += struct.pack(f'<{len(fields)}I', *([STRING_TYPE] * len(fields)))
+    for name in fields:
+        encoded = name.encode('utf-8')
+        out += struct.pack('<I', len(encoded)) + encoded
+    out += SEPARATOR
+    for block in blocks:
+        out += block
+    return bytes(out)
+
+
+def encode_tile(level, row, col, buildings=(), fields=FIELDS, children=(), corners=(),
+                mesh=b'', compress=True):
+    """
+    One tile: header, OBB `corners` (ECEF, zero-filled to 8), the extra
+    point, child ids, `mesh` bytes, then attributes when there are buildings.
+    """
+    data = bytearray(HEADER.pack(level, row, col))
+    for i in range(OBB_CORNERS + 1):
+        data += CORNER.pack(*(corners[i] if i < len(corners) else (0.0, 0.0, 0.0)))
+    data += struct.pack(f'<I{len(children)}I', len(children), *children)
+    data += mesh
+    if buildings:
+        data += encode_attributes(buildings, fields)
+    data = bytes(data)
+    return gzip.compress(data, compresslevel=6) if compress else data
+
+
+def synthetic_tiles(count, buildings_per_tile=40, mesh_size=20000, level=16, seed=1):
+    """
+    `count` gzipped tiles as (path, bytes): every other tile has buildings,
+    each has `mesh_size` bytes of incompressible mesh/texture data.
+    """
+    rng = random.Random(seed)
+    tiles = []
+    for i in range(count):
+        row, col = 30000 + i // 64, 60000 + i % 64
+        lon, lat = 120.99 + (i % 64) * 0.0005, 24.78 + (i // 64) * 0.0005
+        corners = [lonlat_to_ecef(lon + dx * 0.0005, lat + dy * 0.0005, dz * 50.0)
+                   for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)]
+        buildings = []
+        if i % 2 == 0:
+            for b in range(buildings_per_tile):
+                buildings.append({
+                    'BUILD_ID': f'B{rng.randrange(10 ** 8):08d}',
+                    'BUILD_H': f'{rng.uniform(3, 80):.2f}',
+                    'BUILD_STR': rng.choice(('RC', 'SRC', 'S', 'NA')),
+                    'MODEL_LOD': '2',
+                    'MODEL_NAME': f'M{level}_{row}_{col}_{b}',
+                    'MDATE': '20230101',
+                    'M_MDATE': '20230601',
+                    'CENT_E_97': f'{CENTER_E97 + rng.uniform(-2000, 2000):.3f}',
+                    'CENT_N_97': f'{CENTER_N97 + rng.uniform(-2000, 2000):.3f}',
+                    'BUILDNAME': rng.choice(('NA', '工程三館', 'Library')),
+                })
+        tile = encode_tile(level, row, col, buildings, children=(1, 2, 3, 4),
+                           corners=corners, mesh=rng.randbytes(mesh_size))
+        tiles.append((f'L{level}/R{row}_C{col}.bin', tile))
+    return tiles
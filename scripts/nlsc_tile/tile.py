@@ -0,0 +1,304 @@
+"""
+Tile: one decompressed oview tile, decoded in place.
+
+The tile is parsed over a memoryview of its data (`view`), so nothing is
+copied out of it: the header, OBB, child info and attribute offsets are
+unpacked in place with the precompiled structs of layout.py, and field
+names and values are decoded straight from memoryview slices. The BUILD_ID
+searches run on `data` itself (see locate.py).
+"""
+import gzip
+import math
+from array import array
+
+from .geo import ecef_to_lonlat, twd97_to_wgs84
+from .columns import NUMERIC_FIELDS, decode_columns
+from .layout import (BUILD_ID, CHILD_COUNT_OFFSET, CHILD_IDS_OFFSET, CORNER, GZIP_MAGIC, HEADER,
+                     MAX_CHILDREN, OBB_CORNERS, OBB_OFFSET, U32, u32_array)
+from .locate import find, find_attribute_section
+
+
+class Tile:
+    """
+    A decompressed tile (`data`, any buffer: bytes, a memoryview, mmap) and
+    the size it was stored with.
+    """
+
+    __slots__ = ('data', 'view', 'raw_size', '_section')
+
+    def __init__(self, data, raw_size=None):
+        view = memoryview(data)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        self.data = data
+        self.view = view
+        self.raw_size = len(view) if raw_size is None else raw_size
+        self._section = False
+
+    @classmethod
+    def from_bytes(cls, raw_data):
+        """Tile from stored bytes, gunzipped when they are gzip data."""
+        data = raw_data
+        if raw_data[:2] == GZIP_MAGIC:
+            try:
+                data = gzip.decompress(raw_data)
+            except Exception:
+                pass    # parsed as is, like the scripts always did
+        return cls(data, len(raw_data))
+
+    def __len__(self):
+        return len(self.view)
+
+    # --- Header ---
+
+    @property
+    def header(self):
+        """(level, row, col), or None for a tile shorter than the header."""
+        if len(self.view) < HEADER.size:
+            return None
+        return HEADER.unpack_from(self.view, 0)
+
+    @property
+    def obb_corners(self):
+        """The OBB's ECEF corners (x, y, z) that fit in the tile."""
+        count = min(OBB_CORNERS, max(0, (len(self.view) - OBB_OFFSET) // CORNER.size))
+        unpack = CORNER.unpack_from
+        data = self.view
+        return [unpack(data, OBB_OFFSET + i * CORNER.size) for i in range(count)]
+
+    @property
+    def children(self):
+        """Child ids after the OBB; [] when the count is not 1-10."""
+        data = self.view
+        if len(data) < CHILD_IDS_OFFSET:
+            return []
+        count = U32.unpack_from(data, CHILD_COUNT_OFFSET)[0]
+        if not 0 < count <= MAX_CHILDREN:
+            return []
+        count = min(count, (len(data) - CHILD_IDS_OFFSET) // 4)
+        return list(u32_array(count).unpack_from(data, CHILD_IDS_OFFSET))
+
+    @property
+    def body_offset(self):
+        """Where the mesh/texture data starts: the end of the child info."""
+        data = self.view
+        if len(data) < CHILD_IDS_OFFSET:
+            return len(data)
+        count = U32.unpack_from(data, CHILD_COUNT_OFFSET)[0]
+        if count > MAX_CHILDREN:
+            return CHILD_IDS_OFFSET
+        return min(len(data), CHILD_IDS_OFFSET + count * 4)
+
+    @property
+    def has_build_id(self):
+        return find(self.data, BUILD_ID) >= 0
+
+    def header_info(self):
+        """Size, level/row/col, children and has_build_id (08's tile records)."""
+        info = {'size': len(self.view)}
+        header = self.header
+        if header is not None:
+            info['level'], info['row'], info['col'] = header
+        info['children'] = self.children
+        info['has_build_id'] = self.has_build_id
+        return info
+
+    # --- Attributes ---
+
+    def attribute_section(self):
+        """Offsets of the attribute metadata (see locate.py), or None."""
+        if self._section is False:
+            self._section = find_attribute_section(self.data, self.body_offset)
+        return self._section
+
+    def columns(self, numeric=NUMERIC_FIELDS, fields=None):
+        """
+        AttributeColumns (see columns.py), or None without attributes;
+        `fields` limits them to those fields (None: all).
+        """
+        section = self.attribute_section()
+        if section is None:
+            return None
+        return decode_columns(self.view, section, numeric, fields)
+
+    def attributes(self, fields=None):
+        """Field names and per-building records, or None without attributes."""
+        columns = self.columns(numeric=(), fields=fields)
+        if columns is None:
+            return None
+        return {
+            'field_count': columns.field_count,
+            'building_count': columns.building_count,
+            'fields': columns.fields,
+            'buildings': columns.records(),
+        }
+
+
+def parse_tile_attributes(data, fields=None):
+    """Parse building attributes (only `fields`, if given) from a decompressed tile."""
+    return Tile(data).attributes(fields)
+
+
+class ParsedTile:
+    """
+    A parsed tile by column, compact to pickle (the process pool sends
+    these): `info` is the parse_tile_bytes() result without 'buildings',
+    `columns` holds one list of str per name in `fields`, and `lon` / `lat`
+    are array('d') with NaN for buildings without coordinates.
+    building(i) and to_result() rebuild exactly the dicts parse_tile_bytes()
+    returns, so callers can build only the buildings they keep.
+    """
+
+    __slots__ = ('info', 'fields', 'columns', 'lon', 'lat')
+
+    def __init__(self, info, fields=(), columns=(), lon=None, lat=None):
+        self.info = info
+        self.fields = fields
+        self.columns = columns
+        self.lon = array('d') if lon is None else lon
+        self.lat = array('d') if lat is None else lat
+
+    def __getstate__(self):
+        # Columns that repeat values ('NA', dates, LODs) are pickled
+        # dictionary-encoded: the distinct values once, then one small
+        # integer per building; mostly distinct columns are sent as they are
+        columns = []
+        for values in self.columns:
+            distinct = list(dict.fromkeys(values))
+            if len(distinct) * 2 > len(values):
+                columns.append(values)
+                continue
+            index = {value: i for i, value in enumerate(distinct)}
+            typecode = 'B' if len(distinct) <= 0x100 else 'H'
+            columns.append((distinct, array(typecode, map(index.__getitem__, values))))
+        return self.info, self.fields, columns, self.lon, self.lat
+
+    def __setstate__(self, state):
+        self.info, self.fields, columns, self.lon, self.lat = state
+        self.columns = [list(map(column[0].__getitem__, column[1]))
+                        if isinstance(column, tuple) else column for column in columns]
+
+    def __len__(self):
+        """Number of buildings (0 for a tile without attributes)."""
+        return len(self.lon)
+
+    def column(self, name):
+        """The values of field `name` ('' when missing), or None."""
+        for field, values in zip(self.fields, self.columns):
+            if field == name:
+                return values
+        return None
+
+    def building_ids(self):
+        """Each building's BUILD_ID, '' when it has none (empty or 'NA')."""
+        ids = self.column('BUILD_ID')
+        if ids is None:
+            return [''] * len(self)
+        return [bid if bid != 'NA' else '' for bid in ids]
+
+    def building(self, i):
+        """Building i as parse_tile_bytes() returns it."""
+        bldg = {}
+        for name, values in zip(self.fields, self.columns):
+            value = values[i]
+            if value and value != 'NA':
+                bldg[name] = value
+        lon = self.lon[i]
+        if lon == lon:
+            bldg['lon'] = lon
+            bldg['lat'] = self.lat[i]
+        return bldg
+
+    def buildings(self):
+        fields = self.fields
+        buildings = [{name: val for name, val in zip(fields, row) if val and val != 'NA'}
+                     for row in zip(*self.columns)]
+        for bldg, lon, lat in zip(buildings, self.lon, self.lat):
+            if lon == lon:
+                bldg['lon'] = lon
+                bldg['lat'] = lat
+        return buildings
+
+    def to_result(self):
+        """The parse_tile_bytes() dict."""
+        result = dict(self.info)
+        if 'building_count' in result:
+            result['buildings'] = self.buildings()
+        return result
+
+
+def parse_tile_bytes(raw_data, filepath, obb=True, fields=None):
+    """
+    Parse stored tile bytes: sizes, level/row/col, the OBB in WGS84 and its
+    bbox (unless obb=False), and the buildings with lon/lat from their
+    TWD97 centroid. With `fields` the buildings hold only those fields
+    (lon/lat are still computed); the other field blocks are skipped.
+    """
+    return parse_tile_columns(raw_data, filepath, obb, fields).to_result()
+
+
+def parse_tile_columns(raw_data, filepath, obb=True, fields=None):
+    """parse_tile_bytes() as a ParsedTile."""
+    tile = Tile.from_bytes(raw_data)
+    result = {
+        'file': filepath,
+        'raw_size': tile.raw_size,
+        'decompressed_size': len(tile),
+    }
+
+    header = tile.header
+    if header is not None:
+        result['level'], result['row'], result['col'] = header
+        if obb:
+            corners = tile.obb_corners
+            result['obb_corners'] = corners
+            wgs84_corners = []
+            for x, y, z in corners:
+                if x != 0 or y != 0 or z != 0:
+                    lon, lat, alt = ecef_to_lonlat(x, y, z)
+                    wgs84_corners.append({'lon': lon, 'lat': lat, 'alt': alt})
+            if wgs84_corners:
+                result['obb_wgs84'] = wgs84_corners
+                lons = [c['lon'] for c in wgs84_corners]
+                lats = [c['lat'] for c in wgs84_corners]
+                result['bbox'] = {
+                    'lon_min': min(lons), 'lon_max': max(lons),
+                    'lat_min': min(lats), 'lat_max': max(lats),
+                }
+
+    columns = tile.columns(numeric=('CENT_E_97', 'CENT_N_97'), fields=fields)
+    if columns is None or columns.building_count == 0:
+        return ParsedTile(result)
+    result['building_count'] = columns.building_count
+    result['fields'] = columns.fields
+    values = [columns.strings[name] for name in columns.fields]
+    count = columns.building_count if values else 0
+    lons = array('d', [math.nan]) * count
+    lats = array('d', [math.nan]) * count
+
+    # WGS84 coordinates from TWD97 (NaN: missing or not a number)
+    east = columns.floats('CENT_E_97')
+    north = columns.floats('CENT_N_97')
+    if count and east is not None and north is not None:
+        for i, e97, n97 in zip(range(count), east.tolist(), north.tolist()):
+            if e97 == e97 and n97 == n97:
+                try:
+                    lon, lat = twd97_to_wgs84(e97, n97)
+                except (ValueError, ZeroDivisionError):
+                    continue
+                lons[i] = round(lon, 7)
+                lats[i] = round(lat, 7)
+
+    return ParsedTile(result, columns.fields, values, lons, lats)
+
+
+def parse_tile_file(filepath, obb=True, fields=None):
+    """Parse a single tile file."""
+    with open(filepath, 'rb') as f:
+        raw_data = f.read()
+    return parse_tile_bytes(raw_data, filepath, obb=obb, fields=fields)
+
+
+def header_info(raw_data):
+    """08's tile record fields for stored tile bytes (see Tile.header_info())."""
+    return Tile.from_bytes(raw_data).header_info()
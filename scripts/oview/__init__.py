@@ -0,0 +1,23 @@
+"""
+Shared download infrastructure for the NLSC oview downloader scripts.
+
+The numbered scripts in scripts/ cannot import each other, so code that
+01, 06 and 08 have in common lives here. Run the scripts from the repository
+root or from scripts/; either way scripts/ is on sys.path.
+"""
+from .engine import DownloadEngine, MirrorError, layer_query, tile_query
+from .hedging import HedgePolicy
+from .mirrors import MirrorScheduler
+from .pool import ConnectionPool
+from .ratelimit import RateLimiter
+
+__all__ = [
+    'ConnectionPool',
+    'DownloadEngine',
+    'HedgePolicy',
+    'MirrorError',
+    'MirrorScheduler',
+    'RateLimiter',
+    'layer_query',
+    'tile_query',
+]
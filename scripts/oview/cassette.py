@@ -0,0 +1,183 @@
+"""
+Record / replay cassettes of oview traffic, for offline re-runs.
+
+Reproducing a dataset used to mean downloading it from the NLSC mirrors
+again. With a cassette in record mode (--record-cassette PATH) the engine
+writes every answered query into one file; in replay mode
+(--replay-cassette PATH) the same queries are answered from that file with
+no network, no rate limit and no mirror slots, so a full re-run of the
+download stage takes seconds.
+
+File layout (little-endian):
+
+  MAGIC
+  record*     struct RECORD: query, ETag and Last-Modified lengths, HTTP
+              status, body length; then those bytes
+  index       JSON {query: record offset}, written on close()
+  footer      struct FOOTER: index offset, then END_MAGIC
+
+Records are self-describing, so a cassette whose recording was interrupted
+(no footer) is still read by scanning the records. Queries are stored
+without the mirror URL, as every mirror serves the same tiles; when a
+query was answered twice the last answer wins. Replay reads the file
+through mmap and copies out only the bodies that are asked for.
+
+A cassette holds what the server was asked, not the dataset: tiles taken
+from the tile store, the empty-tile cache or 08's fetch journal are never
+requested, and a 304 answer is recorded without a body. A recording made
+next to a warm store therefore cannot rebuild the dataset offline; only a
+cold run (--refresh-tiles --refresh-empty, and --restart for 08) records
+a complete cassette.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b'OVCASS1\n'
+END_MAGIC = b'OVCASSIX'
+RECORD = struct.Struct('<HHHHI')    # query, etag, last_modified lengths, status, body length
+FOOTER = struct.Struct('<Q8s')      # index offset, END_MAGIC
+
+RECORD_MODE = 'record'
+REPLAY_MODE = 'replay'
+
+
+class CassetteError(OSError):
+    """The file is not a cassette, or is damaged."""
+
+
+class Cassette:
+    """
+    One cassette file, open for recording or for replay.
+
+    record(query, status, body, validators) appends an answer;
+    lookup(query) returns (status, body, validators) or None.
+    """
+
+    def __init__(self, path, mode):
+        if mode not in (RECORD_MODE, REPLAY_MODE):
+            raise ValueError(f'cassette mode must be {RECORD_MODE!r} or {REPLAY_MODE!r}')
+        self.path = path
+        self.mode = mode
+        self._index = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self._file = self._map = None
+        if mode == RECORD_MODE:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, 'wb')
+            self._file.write(MAGIC)
+        else:
+            self._open_replay()
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY_MODE
+
+    def __len__(self):
+        return len(self._index)
+
+    # --- Recording ---
+
+    def record(self, query, status, body, validators=None):
+        q = query.encode('utf-8')
+        etag = ((validators or {}).get('etag') or '').encode('latin-1')
+        modified = ((validators or {}).get('last_modified') or '').encode('latin-1')
+        body = body or b''
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(RECORD.pack(len(q), len(etag), len(modified), status, len(body)))
+            self._file.write(q + etag + modified)
+            self._file.write(body)
+            self._index[query] = offset
+            self.recorded += 1
+
+    # --- Replay ---
+
+    def _open_replay(self):
+        self._file = open(self.path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(MAGIC):
+            raise CassetteError(f'{self.path}: not a cassette')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise CassetteError(f'{self.path}: not a cassette')
+        if self._read_footer(size) is None:
+            self._scan(size)    # recording was interrupted before close()
+
+    def _read_footer(self, size):
+        if size < len(MAGIC) + FOOTER.size:
+            return None
+        index_offset, magic = FOOTER.unpack_from(self._map, size - FOOTER.size)
+        if magic != END_MAGIC or not len(MAGIC) <= index_offset <= size - FOOTER.size:
+            return None
+        try:
+            self._index = json.loads(self._map[index_offset:size - FOOTER.size])
+        except ValueError:
+            return None
+        return index_offset
+
+    def _scan(self, size):
+        offset = len(MAGIC)
+        while offset + RECORD.size <= size:
+            q_len, e_len, m_len, _, b_len = RECORD.unpack_from(self._map, offset)
+            end = offset + RECORD.size + q_len + e_len + m_len + b_len
+            if end > size:
+                break       # truncated last record
+            start = offset + RECORD.size
+            self._index[self._map[start:start + q_len].decode('utf-8')] = offset
+            offset = end
+
+    def lookup(self, query):
+        """(status, body, validators) recorded for query, or None."""
+        offset = self._index.get(query)
+        if offset is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        q_len, e_len, m_len, status, b_len = RECORD.unpack_from(self._map, offset)
+        pos = offset + RECORD.size + q_len
+        etag = self._map[pos:pos + e_len].decode('latin-1')
+        pos += e_len
+        modified = self._map[pos:pos + m_len].decode('latin-1')
+        pos += m_len
+        body = self._map[pos:pos + b_len]
+        validators = None
+        if etag or modified:
+            validators = {'etag': etag or None, 'last_modified': modified or None}
+        with self._lock:
+            self.replayed += 1
+        return status, body, validators
+
+    # --- Lifecycle ---
+
+    def close(self):
+        """Write the index (record mode) and release the file."""
+        with self._lock:
+            if self._file is None:
+                return
+            if self.mode == RECORD_MODE:
+                index_offset = self._file.tell()
+                self._file.write(json.dumps(self._index, separators=(',', ':')).encode('utf-8'))
+                self._file.write(FOOTER.pack(index_offset, END_MAGIC))
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+            self._file = None
+
+    def summary(self):
+        if self.mode == RECORD_MODE:
+            return f'cassette: {self.recorded} answers recorded to {self.path}'
+        return (f'cassette: {self.replayed} answers replayed from {self.path} '
+                f'({len(self._index)} recorded, {self.misses} not in cassette)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
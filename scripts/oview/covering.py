@@ -0,0 +1,265 @@
+"""
+Tile covering planner: which (level, row, col) tiles overlap a campus.
+
+The downloaders used to grow each campus bbox by a margin and keep every
+tile whose bbox overlapped it. At deep levels most of that rectangle is
+outside the campus. A Covering is built from one or more boundary polygons
+(GeoJSON Polygon / MultiPolygon, holes allowed) and keeps a tile only if
+the tile, grown by `margin` degrees, shares a positive area with the union
+of the polygons. The test clips each polygon ring to the tile rectangle
+(Sutherland-Hodgman) and measures the clipped area. That makes it exact
+for concave shapes and holes, and it treats tiles that only touch an edge
+as outside, like bbox_overlap.
+
+Covering.from_bbox() wraps the old rectangle. Its tile sets are identical
+to the bbox + margin filter, so callers without a boundary file keep their
+current output.
+
+Boundaries are looked up in data/boundaries/{campus_key}.geojson.
+"""
+import json
+import os
+
+BOUNDARY_DIR_NAME = 'boundaries'
+
+# Overlap below this share of the tile area counts as touching only
+TOUCH_EPSILON = 1e-12
+
+
+def tile_geo_bbox(level, row, col):
+    """
+    Calculate geographic bounding box of a tile.
+    PilotGaea formula: Col = floor(lon * 2^L / 160), Row = floor(lat * 2^L / 60)
+    Inverse: lon = [C * 160/2^L, (C+1) * 160/2^L], lat = [R * 60/2^L, (R+1) * 60/2^L]
+    """
+    lon_size = 160.0 / (2 ** level)
+    lat_size = 60.0 / (2 ** level)
+    return (
+        col * lon_size,           # lon_min
+        (col + 1) * lon_size,     # lon_max
+        row * lat_size,           # lat_min
+        (row + 1) * lat_size,     # lat_max
+    )
+
+
+# --- Geometry ---
+
+def _ring_area(ring):
+    """Unsigned shoelace area of a closed or open ring of (x, y)."""
+    area = 0.0
+    n = len(ring)
+    for i in range(n):
+        x1, y1 = ring[i]
+        x2, y2 = ring[(i + 1) % n]
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2.0
+
+
+def _clip(ring, inside, intersect):
+    out = []
+    n = len(ring)
+    for i in range(n):
+        cur, prev = ring[i], ring[i - 1]
+        if inside(cur):
+            if not inside(prev):
+                out.append(intersect(prev, cur))
+            out.append(cur)
+        elif inside(prev):
+            out.append(intersect(prev, cur))
+    return out
+
+
+def _clip_to_rect(ring, rect):
+    """Sutherland-Hodgman clip of a ring to (x_min, x_max, y_min, y_max)."""
+    x_min, x_max, y_min, y_max = rect
+
+    def at_x(x):
+        def f(p, q):
+            t = (x - p[0]) / (q[0] - p[0])
+            return (x, p[1] + t * (q[1] - p[1]))
+        return f
+
+    def at_y(y):
+        def f(p, q):
+            t = (y - p[1]) / (q[1] - p[1])
+            return (p[0] + t * (q[0] - p[0]), y)
+        return f
+
+    for inside, intersect in (
+        (lambda p: p[0] >= x_min, at_x(x_min)),
+        (lambda p: p[0] <= x_max, at_x(x_max)),
+        (lambda p: p[1] >= y_min, at_y(y_min)),
+        (lambda p: p[1] <= y_max, at_y(y_max)),
+    ):
+        if not ring:
+            break
+        ring = _clip(ring, inside, intersect)
+    return ring
+
+
+def _overlap_area(polygon, rect):
+    """Area of polygon (outer ring + holes) inside rect."""
+    outer, holes = polygon[0], polygon[1:]
+    area = _ring_area(_clip_to_rect(outer, rect))
+    if area <= 0.0:
+        return 0.0
+    for hole in holes:
+        area -= _ring_area(_clip_to_rect(hole, rect))
+    return area
+
+
+def point_in_polygon(lon, lat, polygon):
+    """Even-odd test over all rings, so points in holes are outside."""
+    inside = False
+    for ring in polygon:
+        n = len(ring)
+        for i in range(n):
+            x1, y1 = ring[i - 1]
+            x2, y2 = ring[i]
+            if (y1 > lat) != (y2 > lat):
+                if lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+    return inside
+
+
+# --- Covering ---
+
+class Covering:
+    """
+    Union of boundary polygons plus a margin in degrees.
+
+    Each polygon is a list of rings ([outer, hole, ...]), each ring a list
+    of (lon, lat) pairs.
+    """
+
+    def __init__(self, polygons, margin=0.0, name=''):
+        self.polygons = [[[(float(x), float(y)) for x, y in ring] for ring in poly]
+                         for poly in polygons]
+        self.margin = margin
+        self.name = name
+        xs = [x for poly in self.polygons for x, _ in poly[0]]
+        ys = [y for poly in self.polygons for _, y in poly[0]]
+        self.bbox = (min(xs), max(xs), min(ys), max(ys))
+
+    @classmethod
+    def from_bbox(cls, bbox, margin=0.0, name=''):
+        lon_min, lon_max, lat_min, lat_max = bbox
+        ring = [(lon_min, lat_min), (lon_max, lat_min),
+                (lon_max, lat_max), (lon_min, lat_max)]
+        return cls([[ring]], margin=margin, name=name)
+
+    @classmethod
+    def from_geojson(cls, path, margin=0.0):
+        with open(path, 'r', encoding='utf-8') as f:
+            doc = json.load(f)
+        polygons = []
+        for geom in _geometries(doc):
+            if geom['type'] == 'Polygon':
+                polygons.append(geom['coordinates'])
+            elif geom['type'] == 'MultiPolygon':
+                polygons.extend(geom['coordinates'])
+        if not polygons:
+            raise ValueError(f'No Polygon or MultiPolygon in {path}')
+        polygons = [[_ring(ring) for ring in poly] for poly in polygons]
+        return cls(polygons, margin=margin, name=os.path.basename(path))
+
+    def _grown(self, rect):
+        m = self.margin
+        return (rect[0] - m, rect[1] + m, rect[2] - m, rect[3] + m)
+
+    def overlaps_rect(self, rect):
+        """True if rect, grown by the margin, overlaps any polygon."""
+        r = self._grown(rect)
+        b = self.bbox
+        if not (r[0] < b[1] and r[1] > b[0] and r[2] < b[3] and r[3] > b[2]):
+            return False
+        # A shared edge clips to a sliver of float-noise area, not zero
+        min_area = TOUCH_EPSILON * (r[1] - r[0]) * (r[3] - r[2])
+        for poly in self.polygons:
+            if _overlap_area(poly, r) > min_area:
+                return True
+        return False
+
+    def overlaps_tile(self, level, row, col):
+        return self.overlaps_rect(tile_geo_bbox(level, row, col))
+
+    def contains_point(self, lon, lat):
+        """Point test against the polygons themselves (no margin)."""
+        return any(point_in_polygon(lon, lat, poly) for poly in self.polygons)
+
+    def tile_range(self, level):
+        """Row/col range of the covering's grown bbox at `level`."""
+        lon_size = 160.0 / (2 ** level)
+        lat_size = 60.0 / (2 ** level)
+        b = self._grown(self.bbox)
+        return (int(b[2] // lat_size), int(b[3] // lat_size),
+                int(b[0] // lon_size), int(b[1] // lon_size))
+
+    def tiles_at(self, level):
+        """Overlapping (row, col) at `level`, row-major."""
+        r_min, r_max, c_min, c_max = self.tile_range(level)
+        return [(row, col)
+                for row in range(r_min, r_max + 1)
+                for col in range(c_min, c_max + 1)
+                if self.overlaps_tile(level, row, col)]
+
+
+def _ring(coords):
+    # GeoJSON positions may carry altitude, and rings repeat the first point
+    ring = [(p[0], p[1]) for p in coords]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    return ring
+
+
+def _geometries(doc):
+    kind = doc.get('type')
+    if kind == 'FeatureCollection':
+        for feature in doc['features']:
+            yield from _geometries(feature)
+    elif kind == 'Feature':
+        if doc.get('geometry'):
+            yield from _geometries(doc['geometry'])
+    elif kind == 'GeometryCollection':
+        for geom in doc['geometries']:
+            yield from _geometries(geom)
+    else:
+        yield doc
+
+
+def boundary_path(data_dir, campus_key):
+    return os.path.join(data_dir, BOUNDARY_DIR_NAME, f'{campus_key}.geojson')
+
+
+def campus_covering(data_dir, campus_key, bbox, margin=0.0):
+    """
+    Covering from data/boundaries/{campus_key}.geojson if it exists, else
+    the campus bbox. Returns (covering, is_polygon).
+    """
+    path = boundary_path(data_dir, campus_key)
+    if os.path.exists(path):
+        return Covering.from_geojson(path, margin=margin), True
+    return Covering.from_bbox(bbox, margin=margin, name='bbox'), False
+
+
+def covering_savings(covering, bbox_covering, tiles):
+    """
+    Compare a polygon covering with the bbox one over known tile records
+    (manifest entries with level/row/col/size). Returns per-level and total
+    counts of tiles and bytes the bbox keeps but the polygon drops.
+    """
+    levels = {}
+    for t in tiles:
+        key = (t['level'], t['row'], t['col'])
+        if t['level'] < 2 or not bbox_covering.overlaps_tile(*key):
+            continue
+        s = levels.setdefault(t['level'], {'tiles': 0, 'bytes': 0,
+                                           'saved_tiles': 0, 'saved_bytes': 0})
+        s['tiles'] += 1
+        s['bytes'] += t['size']
+        if not covering.overlaps_tile(*key):
+            s['saved_tiles'] += 1
+            s['saved_bytes'] += t['size']
+    total = {k: sum(s[k] for s in levels.values())
+             for k in ('tiles', 'bytes', 'saved_tiles', 'saved_bytes')}
+    return levels, total
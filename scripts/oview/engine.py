@@ -0,0 +1,453 @@
+"""
+Asyncio download engine for the NLSC PilotGaea oview servers.
+
+The downloader scripts (01, 06, 08) used to call urllib.request.urlopen in a
+serial loop and sleep after every tile, so a refresh spent almost all of its
+time waiting on the network. The engine keeps up to `per_mirror` requests in
+flight against each entry in SERVERS and hands results back as they arrive.
+
+Blocking HTTP calls run on a worker thread pool sized to the total number of
+in-flight slots; the event loop only schedules them, so throughput grows
+roughly linearly with `per_mirror` until the server's polite limit. The
+workers share one keep-alive ConnectionPool (see pool.py), and each request
+goes to the mirror picked by a latency-aware MirrorScheduler (mirrors.py).
+Requests still pending after the observed p95 latency are hedged to a second
+mirror (hedging.py).
+
+Politeness comes from a per-mirror AIMD token bucket (ratelimit.py) rather
+than fixed sleeps: requests wait only when a mirror is at its --rate
+ceiling, and the rate backs off on 429 / 5xx / timeouts.
+
+Cassettes (cassette.py): use_cassette(path, 'record') writes every answer
+to a file; use_cassette(path, 'replay') answers from it without network.
+A recorded 304 has no body, so only a cold run records a complete dataset.
+
+Conditional requests: with `validators` (the ETag / Last-Modified of the
+stored copy) a tile is requested with If-None-Match / If-Modified-Since,
+and a 304 answer comes back as NOT_MODIFIED without a body.
+
+Usage:
+  engine = DownloadEngine(SERVERS, HEADERS, per_mirror=4)
+  results = engine.fetch_many([tile_query('112_O', 5, 12, 22), ...])
+"""
+import asyncio
+import concurrent.futures
+import time
+
+from .hedging import HedgePolicy
+from .mirrors import MirrorScheduler
+from .cassette import Cassette
+from .pool import ConnectionPool
+from .ratelimit import DEFAULT_RATE, RateLimiter, retry_after_seconds
+
+# Extra per-mirror slots that only hedged duplicates may use
+HEDGE_SLOTS = 1
+
+# fetch_result() outcomes
+OK = 'ok'
+EMPTY = 'empty'
+FAILED = 'failed'
+NOT_MODIFIED = 'not_modified'
+
+
+def tile_query(layer, level, row, col, docname='NODE', kind='modelset'):
+    """Query string for a single NODE (or DEMNODE) tile."""
+    return (
+        f"type={kind}&format=integrate"
+        f"&name={layer}&level={level}&Row={row}&Col={col}"
+        f"&docname={docname}&epsg=4326"
+    )
+
+
+def layer_query(layer):
+    """Query string for the LAYER metadata document."""
+    return f"type=modelset&format=integrate&name={layer}&docname=LAYER"
+
+
+def conditional_headers(validators):
+    """If-None-Match / If-Modified-Since headers for stored validators."""
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def response_validators(headers):
+    """ETag / Last-Modified of a response, or None if it sent neither."""
+    etag = headers.get('etag')
+    last_modified = headers.get('last-modified')
+    if not etag and not last_modified:
+        return None
+    return {'etag': etag, 'last_modified': last_modified}
+
+
+class MirrorError(OSError):
+    """A request to one mirror failed; `server` says which."""
+
+    def __init__(self, server, cause):
+        super().__init__(f'{server}: {cause}')
+        self.server = server
+
+
+class DownloadEngine:
+    """
+    Concurrent oview fetcher with a fixed number of slots per mirror.
+
+    fetch() is a coroutine for callers that already run an event loop;
+    fetch_many() / fetch_one() are synchronous wrappers for the scripts.
+    """
+
+    def __init__(self, servers, headers, per_mirror=4, timeout=30,
+                 retries=2, rate=DEFAULT_RATE, hedge_ratio=0.05):
+        self.servers = list(servers)
+        self.per_mirror = max(1, int(per_mirror))
+        self.pool = ConnectionPool(headers, max_idle_per_host=self.per_mirror)
+        self.timeout = timeout
+        self.retries = retries
+        # Politeness: requests per second per mirror, shared by all workers
+        self.limiter = RateLimiter(self.servers, rate=rate)
+        self.mirrors = MirrorScheduler(self.servers)
+        # hedge_ratio=0 disables hedging
+        self.hedging = HedgePolicy(max_ratio=hedge_ratio)
+        self._slots = None
+        self._executor = None
+        self.stats = {'requests': 0, 'errors': 0, 'empty': 0, 'bytes': 0,
+                      'not_modified': 0}
+        # Set to a list to record the latency of every answered request
+        # (10_download_benchmark.py)
+        self.latencies = None
+        self.cassette = None
+        self._shared = False    # companion(): pool and cassette belong to another engine
+
+    # --- Mirror slots ---
+
+    def _ensure_slots(self):
+        # asyncio primitives bind to the loop that first uses them, so the
+        # slots are rebuilt for every asyncio.run() in fetch_many(). This also
+        # picks up a per_mirror changed from the command line.
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots[0] is not loop:
+            self._slots = (loop, asyncio.Condition(),
+                           {s: 0 for s in self.servers})
+            workers = (self.per_mirror + HEDGE_SLOTS) * len(self.servers)
+            if self._executor is None or self._executor._max_workers != workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix='oview')
+            self.pool.max_idle_per_host = self.per_mirror
+        return self._slots[1], self._slots[2]
+
+    async def _acquire_mirror(self, exclude=()):
+        """
+        Wait for a free slot, then let the scheduler pick among the mirrors
+        that have one. Choosing only once a slot is free means a mirror whose
+        breaker trips meanwhile does not keep a queue of waiting requests.
+        The slot is then held until the mirror's rate limiter has a token.
+        """
+        server = await self._acquire_slot(exclude)
+        wait = self.limiter.reserve(server)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return server
+
+    async def _acquire_slot(self, exclude):
+        freed, in_flight = self._ensure_slots()
+        candidates = [s for s in self.servers if s not in exclude] or self.servers
+        async with freed:
+            while True:
+                # Never wait on a tripped breaker while a healthy mirror exists
+                available = [s for s in candidates if self.mirrors.is_available(s)]
+                available = available or candidates
+                free = [s for s in available if in_flight[s] < self.per_mirror]
+                if free:
+                    server = self.mirrors.choose(free)
+                    in_flight[server] += 1
+                    return server
+                await freed.wait()
+
+    def _try_acquire_hedge_slot(self, exclude):
+        """
+        Take a slot for a hedge on a healthy mirror not in `exclude`, or None.
+        Hedges may use HEDGE_SLOTS extra slots per mirror; every regular slot
+        is usually busy while a pass is running. A hedge never waits for the
+        rate limiter: mirrors without a token right now are skipped.
+        """
+        _, in_flight = self._ensure_slots()
+        limit = self.per_mirror + HEDGE_SLOTS
+        free = [s for s in self.servers
+                if s not in exclude and in_flight[s] < limit
+                and self.mirrors.is_available(s) and self.limiter.available(s)]
+        if not free:
+            return None
+        server = self.mirrors.choose(free)
+        in_flight[server] += 1
+        self.limiter.reserve(server)
+        return server
+
+    async def _release_mirror(self, server):
+        freed, in_flight = self._ensure_slots()
+        async with freed:
+            in_flight[server] -= 1
+            freed.notify_all()
+
+    # --- Fetching ---
+
+    async def fetch(self, query, timeout=None, retries=None):
+        """
+        Fetch `{server}?{query}` with retry and mirror rotation.
+
+        Returns the response body, or None for empty / failed responses
+        (same contract as the scripts' fetch_tile).
+        """
+        _, data = await self.fetch_result(query, timeout=timeout, retries=retries)
+        return data
+
+    async def fetch_result(self, query, timeout=None, retries=None):
+        """
+        Like fetch(), but returns (outcome, data) so callers can tell an
+        empty tile (EMPTY) from one that failed after every retry (FAILED).
+        """
+        outcome, data, _ = await self.fetch_conditional(
+            query, None, timeout=timeout, retries=retries)
+        return outcome, data
+
+    async def fetch_conditional(self, query, validators, timeout=None, retries=None):
+        """
+        fetch_result() with conditional headers built from `validators`.
+
+        Returns (outcome, data, response validators); outcome is
+        NOT_MODIFIED (data None) when the server answers 304.
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            return self._replay(query, validators)
+        headers = conditional_headers(validators)
+        timeout = timeout or self.timeout
+        retries = self.retries if retries is None else retries
+        self._ensure_slots()
+        failed = set()
+        for attempt in range(retries + 1):
+            try:
+                # Retries go to a different mirror when there is one
+                status, data, resp_headers = await self._hedged_request(
+                    query, failed, timeout, headers)
+            except MirrorError as e:
+                # No fixed pause: the retry waits for a token, and a
+                # throttling mirror has already cut its rate
+                failed.add(e.server)
+                continue
+            if self.cassette is not None:
+                self.cassette.record(query, status, data, response_validators(resp_headers))
+            if status == 304:
+                self.stats['not_modified'] += 1
+                return NOT_MODIFIED, None, response_validators(resp_headers) or validators
+            if status == 200 and len(data) > 0:
+                self.stats['bytes'] += len(data)
+                return OK, data, response_validators(resp_headers)
+            self.stats['empty'] += 1
+            return EMPTY, None, None
+        return FAILED, None, None
+
+    def _replay(self, query, validators):
+        """fetch_conditional() answered from the replay cassette."""
+        entry = self.cassette.lookup(query)
+        if entry is None:
+            # Offline: a query the recording never made fails like a dead mirror
+            return FAILED, None, None
+        status, data, recorded = entry
+        etag = (validators or {}).get('etag')
+        if status == 304 or (etag and recorded and recorded.get('etag') == etag):
+            self.stats['not_modified'] += 1
+            return NOT_MODIFIED, None, recorded or validators
+        if status == 200 and len(data) > 0:
+            self.stats['bytes'] += len(data)
+            return OK, data, recorded
+        self.stats['empty'] += 1
+        return EMPTY, None, None
+
+    def use_cassette(self, path, mode):
+        """Record answers to, or replay them from, the cassette at path."""
+        if self.cassette is not None:
+            self.cassette.close()
+        self.cassette = Cassette(path, mode)
+        return self.cassette
+
+    async def _request(self, server, query, timeout, headers=None):
+        """One request on an already-acquired slot; releases it when done."""
+        loop = asyncio.get_running_loop()
+        url = f"{server}?{query}"
+        t0 = time.monotonic()
+        try:
+            self.stats['requests'] += 1
+            status, data, resp_headers = await loop.run_in_executor(
+                self._executor, self.pool.get, url, headers or None, timeout)
+            if status >= 300 and status != 304:
+                if status == 429 or status >= 500:
+                    self.limiter.backoff(server, retry_after_seconds(resp_headers))
+                # urllib raised HTTPError here; keep retrying the same way
+                raise OSError(f'HTTP {status}')
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                self.limiter.backoff(server)
+            self.stats['errors'] += 1
+            self.mirrors.record(server, time.monotonic() - t0, ok=False)
+            raise MirrorError(server, e) from e
+        finally:
+            await self._release_mirror(server)
+        elapsed = time.monotonic() - t0
+        self.limiter.success(server)
+        self.mirrors.record(server, elapsed, ok=True)
+        if self.latencies is not None:
+            self.latencies.append(elapsed)
+        self.hedging.observe(elapsed)
+        return status, data, resp_headers
+
+    async def _hedged_request(self, query, exclude, timeout, headers=None):
+        """
+        Send the request; if it is still pending after the hedge delay, send
+        a duplicate to another mirror and return whichever succeeds first.
+        The slower request is left to finish in the background so its slot
+        and connection are released normally. When both fail, the mirror
+        that failed first is added to `exclude` too; the raised MirrorError
+        names the other.
+        """
+        server = await self._acquire_mirror(exclude=exclude)
+        self.hedging.count_primary()
+        primary = asyncio.ensure_future(self._request(server, query, timeout, headers))
+        hedge_after = self.hedging.delay()
+        if hedge_after is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+        hedge_server = self._try_acquire_hedge_slot(set(exclude) | {server})
+        if hedge_server is None or not self.hedging.try_fire():
+            if hedge_server is not None:
+                await self._release_mirror(hedge_server)
+            return await primary
+
+        hedge = asyncio.ensure_future(
+            self._request(hedge_server, query, timeout, headers))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        self.hedging.count_win()
+                    for loser in pending:
+                        loser.add_done_callback(_consume_exception)
+                    return task.result()
+                if error is not None:
+                    exclude.add(error.server)
+                error = task.exception()
+        raise error
+
+    async def gather(self, queries, on_result=None, with_outcome=False, validators=None):
+        """
+        Fetch all queries concurrently; results are in input order.
+
+        With `with_outcome`, each result is the (outcome, data) pair from
+        fetch_result() instead of the bare data. With `validators` (one dict
+        or None per query) the requests are conditional and each result is
+        the (outcome, data, validators) triple from fetch_conditional().
+        """
+        results = [None] * len(queries)
+        pending = iter(enumerate(queries))
+
+        # One worker per slot pulls from the shared iterator, so only a
+        # handful of coroutines ever wait on the slot condition.
+        async def _worker():
+            for i, query in pending:
+                if validators is not None:
+                    data = await self.fetch_conditional(query, validators[i])
+                elif with_outcome:
+                    data = await self.fetch_result(query)
+                else:
+                    data = await self.fetch(query)
+                results[i] = data
+                if on_result is not None:
+                    on_result(i, data)
+
+        workers = min(len(queries), self.per_mirror * len(self.servers))
+        await asyncio.gather(*(_worker() for _ in range(workers)))
+        return results
+
+    def fetch_many(self, queries, on_result=None, with_outcome=False, validators=None):
+        """
+        Synchronous wrapper around gather().
+
+        on_result(index, data) is called in completion order, from the
+        calling thread, so it can write files and progress output directly.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        return asyncio.run(self.gather(queries, on_result, with_outcome, validators))
+
+    def fetch_one(self, query, timeout=None, retries=None):
+        """Fetch a single query synchronously."""
+        return asyncio.run(self.fetch(query, timeout=timeout, retries=retries))
+
+    def fetch_one_result(self, query, timeout=None, retries=None):
+        """Synchronous fetch_result()."""
+        return asyncio.run(
+            self.fetch_result(query, timeout=timeout, retries=retries))
+
+    def summary(self):
+        """One-line request summary for the end-of-run report."""
+        s = self.stats
+        text = (f"{s['requests']} requests, {s['errors']} errors, "
+                f"{s['empty']} empty, {s['bytes'] / 1024 / 1024:.2f} MB "
+                f"({self.per_mirror} in flight x {len(self.servers)} mirrors)")
+        if s['not_modified']:
+            text += f", {s['not_modified']} not modified"
+        return text
+
+    def report(self):
+        """Per-mirror lines (health, connection reuse, rate) for the summary."""
+        lines = (self.mirrors.report() + self.pool.report() + self.limiter.report()
+                 + [self.hedging.summary()])
+        if self.cassette is not None:
+            lines.append(self.cassette.summary())
+        return lines
+
+    def companion(self):
+        """
+        A second engine for another thread (asyncio slots belong to one event
+        loop), sharing this engine's connection pool, mirror health, rate
+        limiter, hedging budget and cassette. Its slots come on top of this
+        engine's; the shared rate limiter still caps the request rate.
+        """
+        other = DownloadEngine(self.servers, {}, per_mirror=self.per_mirror,
+                               timeout=self.timeout, retries=self.retries)
+        other.pool.close()
+        other.pool = self.pool
+        other.mirrors = self.mirrors
+        other.limiter = self.limiter
+        other.hedging = self.hedging
+        other.cassette = self.cassette
+        other._shared = True
+        return other
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._shared:
+            return
+        if self.cassette is not None:
+            self.cassette.close()
+        self.pool.close()
+
+
+def _consume_exception(task):
+    # Retrieve the loser's exception so asyncio does not log it as unhandled
+    if not task.cancelled():
+        task.exception()
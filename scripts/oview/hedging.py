@@ -0,0 +1,96 @@
+"""
+Hedged requests for oview tile fetches.
+
+Under load a small share of requests hang until the 20-30 s socket timeout,
+and those stragglers set the wall time of every download pass. When a tile
+has had no response after the observed p95 latency, the engine sends a
+duplicate request to a different mirror and takes whichever answers first.
+
+HedgePolicy decides when to hedge and enforces the extra-load cap: hedges
+may never exceed `max_ratio` of primary requests (plus a small burst
+allowance so the first stragglers of a run can be hedged too).
+"""
+import collections
+import threading
+
+
+class LatencyTracker:
+    """Sliding window of recent successful request latencies."""
+
+    def __init__(self, window=256):
+        self._window = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._window.append(seconds)
+
+    def __len__(self):
+        return len(self._window)
+
+    def quantile(self, q):
+        """q-quantile of the window, or None if it is empty."""
+        with self._lock:
+            if not self._window:
+                return None
+            ordered = sorted(self._window)
+        idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[idx]
+
+
+class HedgePolicy:
+    """
+    When to hedge, plus the fired / won / suppressed counters.
+
+    delay() is the time to wait on a primary request before hedging: the
+    p95 of recent latencies, never below `min_delay`. No hedging happens
+    until `min_samples` latencies have been observed.
+    """
+
+    def __init__(self, quantile=0.95, max_ratio=0.05, burst=5,
+                 min_samples=20, min_delay=0.05, window=256):
+        self.quantile = quantile
+        self.max_ratio = max_ratio
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.enabled = max_ratio > 0
+        self.latency = LatencyTracker(window)
+        self.primaries = 0
+        self.fired = 0
+        self.won = 0          # hedge answered before the primary
+        self.suppressed = 0   # straggler seen but over the load cap
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        self.latency.add(seconds)
+
+    def delay(self):
+        """Seconds to wait before hedging, or None if hedging is off."""
+        if not self.enabled or len(self.latency) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.quantile(self.quantile))
+
+    def count_primary(self):
+        with self._lock:
+            self.primaries += 1
+
+    def try_fire(self):
+        """Reserve one hedge if the load cap allows it."""
+        with self._lock:
+            if self.fired < self.burst + self.max_ratio * self.primaries:
+                self.fired += 1
+                return True
+            self.suppressed += 1
+            return False
+
+    def count_win(self):
+        with self._lock:
+            self.won += 1
+
+    def summary(self):
+        p = self.latency.quantile(self.quantile)
+        p_text = f'{p * 1000:.0f} ms' if p is not None else 'n/a'
+        return (f'hedges: {self.fired} fired, {self.won} won, '
+                f'{self.suppressed} suppressed (p{self.quantile * 100:.0f} '
+                f'{p_text}, cap {self.max_ratio * 100:.0f}%)')
@@ -0,0 +1,114 @@
+"""
+Append-only fetch journal for resumable tile downloads.
+
+quadtree_download used to keep `visited` and `downloaded` only in memory and
+wrote manifest.json at the very end, so an interrupted BFS restarted at
+L0 R0 C0. The journal is a JSON-lines file next to the tiles. It gets one
+line per tile as soon as the tile is fetched: `ok` records carry the
+manifest fields, and `empty` records mark coordinates the server returned
+nothing for. A restarted run replays the journal to rebuild its frontier
+and only requests the tiles that are still missing.
+
+Requests that failed after every retry are not journaled, so a resumed run
+tries them again. A torn last line (crash mid-write) is ignored on load.
+"""
+import gzip
+import json
+import os
+import struct
+
+JOURNAL_NAME = 'fetch_journal.jsonl'
+
+OK = 'ok'
+EMPTY = 'empty'
+
+
+class FetchJournal:
+    """Journal of finished (level, row, col) fetches for one output dir."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}       # (level, row, col) -> record dict
+        self._fh = None
+        self.load()
+
+    @classmethod
+    def for_dir(cls, output_dir):
+        return cls(os.path.join(output_dir, JOURNAL_NAME))
+
+    def load(self):
+        self.records = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue    # torn write at the end of a crashed run
+                self.records[(rec['level'], rec['row'], rec['col'])] = rec
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def _append(self, rec):
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._fh = open(self.path, 'a', encoding='utf-8')
+        self._fh.write(json.dumps(rec, ensure_ascii=False) + '\n')
+        self._fh.flush()
+        self.records[(rec['level'], rec['row'], rec['col'])] = rec
+
+    def record_tile(self, tile_record):
+        """Journal a saved tile; `tile_record` is the manifest entry."""
+        self._append(dict(tile_record, status=OK))
+
+    def record_empty(self, level, row, col):
+        self._append({'level': level, 'row': row, 'col': col, 'status': EMPTY})
+
+    def reset(self):
+        """Forget everything (fresh download)."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.records = {}
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def tile_path(output_dir, level, row, col):
+    return os.path.join(output_dir, f'L{level}', f'R{row}_C{col}.bin')
+
+
+def read_valid_tile(output_dir, level, row, col, size=None):
+    """
+    Return the bytes of an on-disk tile if it is complete, else None.
+
+    A tile is valid when it decompresses (if gzipped), its header carries
+    the expected level/row/col and, when `size` is known, its length matches.
+    """
+    path = tile_path(output_dir, level, row, col)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if size is not None and len(data) != size:
+        return None
+    body = data
+    if body[:2] == b'\x1f\x8b':
+        try:
+            body = gzip.decompress(body)
+        except Exception:
+            return None
+    if len(body) < 12:
+        return None
+    if struct.unpack_from('<III', body, 0) != (level, row, col):
+        return None
+    return data
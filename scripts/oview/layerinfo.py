@@ -0,0 +1,63 @@
+"""
+LAYER metadata documents: fingerprint and readable fields.
+
+Every download saves its LAYER.bin, but nothing read it,
+so a refresh could not tell whether NLSC had republished a layer. The
+document's format is not published. parse_layer_info() therefore relies on
+what can be checked without knowing it:
+
+  sha256    fingerprint of the (gunzipped) document; a republished layer
+            gets a new one
+  strings   printable ASCII runs, which carry the layer's names and paths
+  dates     date-like strings among them (YYYY-MM-DD, YYYY/MM/DD, YYYYMMDD)
+
+A download stores the fingerprint in its manifest.json as `layer_sha256`;
+08 --incremental compares the live document with it before touching any
+tile.
+"""
+import gzip
+import hashlib
+import re
+
+_STRING_RE = re.compile(rb'[\x20-\x7e]{4,}')
+_DATE_RE = re.compile(r'(?<!\d)(19|20)\d{2}([-/]?)(0[1-9]|1[0-2])\2(0[1-9]|[12]\d|3[01])(?!\d)')
+
+# Strings kept in the parsed summary
+MAX_STRINGS = 32
+
+
+def parse_layer_info(data):
+    """Fingerprint, size, readable strings and date hints of a LAYER document."""
+    if data[:2] == b'\x1f\x8b':
+        try:
+            data = gzip.decompress(data)
+        except Exception:
+            pass
+    strings = [m.group().decode('ascii') for m in _STRING_RE.finditer(data)]
+    dates = sorted({m.group() for s in strings for m in _DATE_RE.finditer(s)})
+    return {
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'size': len(data),
+        'strings': strings[:MAX_STRINGS],
+        'dates': dates,
+    }
+
+
+def read_layer_file(path):
+    """parse_layer_info() of a saved LAYER.bin, or None if it is missing."""
+    try:
+        with open(path, 'rb') as f:
+            return parse_layer_info(f.read())
+    except OSError:
+        return None
+
+
+def previous_fingerprint(manifest, layer_file=None):
+    """
+    The LAYER fingerprint a dataset was downloaded with: `layer_sha256` from
+    its manifest, else the LAYER.bin saved next to it (older downloads).
+    """
+    if manifest and manifest.get('layer_sha256'):
+        return manifest['layer_sha256']
+    info = read_layer_file(layer_file) if layer_file else None
+    return info['sha256'] if info else None
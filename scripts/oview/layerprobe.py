@@ -0,0 +1,186 @@
+"""
+Concurrent layer availability probing with a TTL cache of missing layers.
+
+06 and 08 used to check candidate layers one at a time: 08 walks
+campus['layers'] (113_A, 112_A, 111_A, 109_A, ...) and 06 falls back
+through the years 112..109, each a LAYER request with a 20-30 s timeout,
+before the first tile of a campus is requested. LayerProbe sends the
+LAYER requests for every candidate of every requested campus at once, on
+a background thread, and download_campus() waits only for its own
+candidates: as soon as the preferred available layer is known, that
+campus starts, while the remaining probes finish. result() and
+first_available() block, so the downloaders' steps generators wait for
+them with scheduler.Wait, off the scheduler's event loop.
+
+Layers that answered empty are remembered for `ttl_hours` in
+data/raw/NLSC_layer_probe.json and are not asked again meanwhile
+(--refresh-layers ignores the file). Available layers are always
+re-fetched: their LAYER document is needed anyway, and a fresh copy is
+what 08 --incremental compares with. Failed requests are not cached.
+
+The probe runs on DownloadEngine.companion(), which shares the caller's
+connection pool, mirror health, rate limiter and cassette.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+
+from .engine import FAILED, layer_query
+
+CACHE_FILE_NAME = 'NLSC_layer_probe.json'
+DEFAULT_TTL_HOURS = 24.0
+
+# Shorter LAYER answers mean the layer does not exist
+MIN_LAYER_SIZE = 10
+
+
+def decode_layer(data):
+    """LAYER documents are usually gzipped."""
+    if data is not None:
+        try:
+            data = gzip.decompress(data)
+        except Exception:
+            pass
+    return data
+
+
+class LayerProbe:
+    """
+    LAYER documents of candidate layers, probed concurrently.
+
+    start(layers) queues probes (once per layer); result(layer) blocks until
+    that layer is resolved and returns its document or None.
+    """
+
+    def __init__(self, engine, path, ttl_hours=DEFAULT_TTL_HOURS, refresh=False,
+                 clock=time.time):
+        self.engine = engine
+        self.path = path
+        self.ttl = ttl_hours * 3600.0
+        self.refresh = refresh
+        self._clock = clock
+        self._missing = {}          # layer -> time it answered empty
+        self._results = {}          # layer -> document, or None if unavailable
+        self._queued = set()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._dirty = False
+        self.probed = 0
+        self.cached = 0             # probes skipped thanks to the cache
+        self.load()
+
+    @classmethod
+    def for_raw_dir(cls, raw_dir, engine, **kwargs):
+        return cls(engine, os.path.join(raw_dir, CACHE_FILE_NAME), **kwargs)
+
+    def load(self):
+        self._missing = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._missing = json.load(f).get('missing', {})
+        except (OSError, ValueError):
+            self._missing = {}
+
+    def _known_missing(self, layer):
+        if self.refresh:
+            return False
+        ts = self._missing.get(layer)
+        return ts is not None and self._clock() - ts <= self.ttl
+
+    # --- Probing ---
+
+    def start(self, layers):
+        """Probe every layer not queued yet, in the background."""
+        to_probe = []
+        with self._cond:
+            for layer in layers:
+                if layer in self._queued:
+                    continue
+                self._queued.add(layer)
+                if self._known_missing(layer):
+                    self._results[layer] = None
+                    self.cached += 1
+                else:
+                    to_probe.append(layer)
+            self._cond.notify_all()
+        if to_probe:
+            thread = threading.Thread(target=self._run, args=(to_probe,),
+                                      name='layer-probe', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self, layers):
+        def on_result(i, result):
+            self._resolve(layers[i], *result)
+
+        try:
+            self.engine.fetch_many([layer_query(layer) for layer in layers],
+                                   on_result=on_result, with_outcome=True)
+        finally:
+            # Never leave a waiter hanging, whatever happened to the batch
+            with self._cond:
+                for layer in layers:
+                    self._results.setdefault(layer, None)
+                self._cond.notify_all()
+
+    def _resolve(self, layer, outcome, data):
+        data = decode_layer(data)
+        available = data is not None and len(data) >= MIN_LAYER_SIZE
+        with self._cond:
+            self.probed += 1
+            self._results[layer] = data if available else None
+            if available:
+                self._dirty |= self._missing.pop(layer, None) is not None
+            elif outcome != FAILED:
+                self._missing[layer] = self._clock()
+                self._dirty = True
+            self._cond.notify_all()
+
+    def result(self, layer):
+        """The layer's LAYER document, or None if it is not available."""
+        self.start([layer])
+        with self._cond:
+            self._cond.wait_for(lambda: layer in self._results)
+            return self._results[layer]
+
+    def first_available(self, layers):
+        """
+        (layer, document) of the first available layer in preference order,
+        or (None, None). Returns as soon as that layer and every layer
+        before it are resolved; later probes keep running.
+        """
+        self.start(layers)
+        for layer in layers:
+            data = self.result(layer)
+            if data is not None:
+                return layer, data
+        return None, None
+
+    # --- Persistence ---
+
+    def save(self):
+        """Wait for running probes, then write the cache (atomically) if it changed."""
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if not self._dirty:
+            return
+        now = self._clock()
+        missing = {k: ts for k, ts in self._missing.items() if now - ts <= self.ttl}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.part'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'missing': missing}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+        self._missing = missing
+        self._dirty = False
+
+    def summary(self):
+        available = sum(1 for d in self._results.values() if d is not None)
+        return (f'layer probe: {self.probed} layers probed concurrently, '
+                f'{self.cached} skipped as known missing, {available} available'
+                f'{" (refresh)" if self.refresh else ""}')
@@ -0,0 +1,191 @@
+"""
+Latency-aware mirror selection for the NLSC oview servers.
+
+The old get_server() walked SERVERS round-robin regardless of how each
+mirror was doing, so one slow or failing mirror (every retry sleeps 0.5 s)
+set the pace of the whole run. MirrorScheduler keeps an EWMA of latency and
+error rate per mirror and spreads traffic with smooth weighted round-robin
+(the nginx algorithm), weight ~ 1 / (latency * (1 + penalty * error_rate)).
+
+Each mirror also has a circuit breaker:
+  closed     normal traffic
+  open       `failure_threshold` consecutive failures; no traffic until
+             `cooldown` seconds have passed
+  half_open  cooldown over; exactly one probe request is let through.
+             Success closes the breaker, failure re-opens it with the
+             cooldown doubled (up to `max_cooldown`).
+
+All methods take an internal lock, so worker threads and coroutines can
+share one scheduler.
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class MirrorHealth:
+    """Rolling health state for one mirror."""
+
+    def __init__(self, server, initial_latency):
+        self.server = server
+        self.latency = initial_latency      # EWMA seconds
+        self.error_rate = 0.0               # EWMA of 0/1 failures
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.probe_in_flight = False
+        self.current_weight = 0.0           # smooth weighted round-robin
+        self.requests = 0
+        self.failures = 0
+        self.trips = 0
+
+    def weight(self, error_penalty):
+        return 1.0 / (max(self.latency, 1e-3) * (1.0 + error_penalty * self.error_rate))
+
+
+class MirrorScheduler:
+    """
+    Choose a mirror for each request and learn from the outcome.
+
+    choose() returns a server URL; every choose() must be followed by one
+    record(server, latency, ok) once the request finishes.
+    """
+
+    def __init__(self, servers, alpha=0.2, initial_latency=0.5,
+                 failure_threshold=5, cooldown=30.0, max_cooldown=600.0,
+                 error_penalty=10.0, clock=time.monotonic):
+        self.servers = list(servers)
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.error_penalty = error_penalty
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._health = {s: MirrorHealth(s, initial_latency) for s in self.servers}
+
+    # --- Selection ---
+
+    def _refresh(self, h, now):
+        if h.state == OPEN and now - h.opened_at >= h.cooldown:
+            h.state = HALF_OPEN
+            h.probe_in_flight = False
+
+    def _eligible(self, h):
+        if h.state == CLOSED:
+            return True
+        return h.state == HALF_OPEN and not h.probe_in_flight
+
+    def choose(self, candidates=None):
+        """
+        Pick a mirror among `candidates` (default: all servers).
+
+        Mirrors with an open breaker are skipped. If every candidate is open,
+        the one whose cooldown ends first is returned, so callers never stall.
+        """
+        now = self._clock()
+        with self._lock:
+            pool = [self._health[s] for s in (candidates or self.servers)]
+            for h in pool:
+                self._refresh(h, now)
+            eligible = [h for h in pool if self._eligible(h)]
+            if not eligible:
+                h = min(pool, key=lambda h: h.opened_at + h.cooldown)
+                h.requests += 1
+                return h.server
+
+            # A half-open mirror gets its single probe before anything else
+            for h in eligible:
+                if h.state == HALF_OPEN:
+                    h.probe_in_flight = True
+                    h.requests += 1
+                    return h.server
+
+            total = 0.0
+            best = None
+            for h in eligible:
+                w = h.weight(self.error_penalty)
+                h.current_weight += w
+                total += w
+                if best is None or h.current_weight > best.current_weight:
+                    best = h
+            best.current_weight -= total
+            best.requests += 1
+            return best.server
+
+    def is_available(self, server):
+        """True if the mirror's breaker currently lets a request through."""
+        now = self._clock()
+        with self._lock:
+            h = self._health[server]
+            self._refresh(h, now)
+            return self._eligible(h)
+
+    # --- Feedback ---
+
+    def record(self, server, latency, ok):
+        """Update the EWMAs and breaker state after a request finishes."""
+        now = self._clock()
+        with self._lock:
+            h = self._health[server]
+            a = self.alpha
+            if latency is not None:
+                h.latency = (1 - a) * h.latency + a * latency
+            h.error_rate = (1 - a) * h.error_rate + a * (0.0 if ok else 1.0)
+
+            if ok:
+                h.consecutive_failures = 0
+                if h.state != CLOSED:
+                    h.state = CLOSED
+                    h.cooldown = 0.0
+                h.probe_in_flight = False
+                return
+
+            h.failures += 1
+            h.consecutive_failures += 1
+            if h.state == HALF_OPEN:
+                # Probe failed: back off harder
+                h.cooldown = min(max(h.cooldown * 2, self.base_cooldown),
+                                 self.max_cooldown)
+                h.state = OPEN
+                h.opened_at = now
+                h.probe_in_flight = False
+                h.trips += 1
+            elif (h.state == CLOSED
+                    and h.consecutive_failures >= self.failure_threshold):
+                h.cooldown = self.base_cooldown
+                h.state = OPEN
+                h.opened_at = now
+                h.trips += 1
+
+    # --- Reporting ---
+
+    def snapshot(self):
+        """Per-mirror health as plain dicts."""
+        with self._lock:
+            return {
+                h.server: {
+                    'state': h.state,
+                    'latency_ms': round(h.latency * 1000, 1),
+                    'error_rate': round(h.error_rate, 3),
+                    'requests': h.requests,
+                    'failures': h.failures,
+                    'breaker_trips': h.trips,
+                }
+                for h in self._health.values()
+            }
+
+    def report(self):
+        """Lines for the end-of-run summary, one per mirror."""
+        lines = []
+        for server, s in self.snapshot().items():
+            host = server.split('//', 1)[-1].split('/', 1)[0]
+            trips = f', tripped {s["breaker_trips"]}x' if s['breaker_trips'] else ''
+            lines.append(
+                f'{host}: {s["requests"]} requests, {s["latency_ms"]} ms EWMA, '
+                f'{s["error_rate"] * 100:.1f}% errors, {s["state"]}{trips}')
+        return lines
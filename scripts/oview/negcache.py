@@ -0,0 +1,104 @@
+"""
+Persistent negative cache of empty tile coordinates, one file per layer.
+
+In the bbox-grid downloaders most requests return nothing, and every run
+used to ask again for each of them (up to retries + 1 times). The cache
+remembers (level, row, col) coordinates the server answered with an empty
+body, so later runs skip them. Only real empty responses are cached; network
+failures are not.
+
+Entries expire after `ttl_days` so a republished layer is eventually
+re-checked. `refresh=True` (the scripts' --refresh-empty) ignores the cached
+entries for this run but still records what it sees.
+
+Files live in data/raw/NLSC_negative_cache/{layer}.json:
+  {"layer": "112_O", "entries": {"7/52/96": 1738900000.0, ...}}
+"""
+import json
+import os
+import time
+
+CACHE_DIR_NAME = 'NLSC_negative_cache'
+DEFAULT_TTL_DAYS = 30.0
+
+
+class NegativeCache:
+    """Empty (level, row, col) coordinates for one layer, with a TTL."""
+
+    def __init__(self, path, layer, ttl_days=DEFAULT_TTL_DAYS, refresh=False,
+                 clock=time.time):
+        self.path = path
+        self.layer = layer
+        self.ttl = ttl_days * 86400.0
+        self.refresh = refresh
+        self._clock = clock
+        self._entries = {}
+        self._dirty = False
+        self.avoided = 0      # requests skipped thanks to the cache
+        self.added = 0
+        self.load()
+
+    @classmethod
+    def for_layer(cls, raw_dir, layer, **kwargs):
+        path = os.path.join(raw_dir, CACHE_DIR_NAME, f'{layer}.json')
+        return cls(path, layer, **kwargs)
+
+    @staticmethod
+    def _key(level, row, col):
+        return f'{level}/{row}/{col}'
+
+    def load(self):
+        self._entries = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f).get('entries', {})
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_empty(self, level, row, col):
+        """
+        True if the coordinate is known to be empty and the entry is fresh.
+        Counts the hit as an avoided request.
+        """
+        if self.refresh:
+            return False
+        ts = self._entries.get(self._key(level, row, col))
+        if ts is None or self._clock() - ts > self.ttl:
+            return False
+        self.avoided += 1
+        return True
+
+    def add(self, level, row, col):
+        self._entries[self._key(level, row, col)] = self._clock()
+        self._dirty = True
+        self.added += 1
+
+    def discard(self, level, row, col):
+        """Forget a coordinate that turned out to have data."""
+        if self._entries.pop(self._key(level, row, col), None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """Write the cache (atomically) if anything changed."""
+        if not self._dirty:
+            return
+        now = self._clock()
+        entries = {k: ts for k, ts in self._entries.items() if now - ts <= self.ttl}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.part'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'layer': self.layer, 'entries': entries}, f,
+                      separators=(',', ':'), sort_keys=True)
+        os.replace(tmp, self.path)
+        self._entries = entries
+        self._dirty = False
+
+    def summary(self):
+        return (f'negative cache [{self.layer}]: {self.avoided} requests avoided, '
+                f'{self.added} new empty tiles, {len(self)} cached'
+                f'{" (refresh)" if self.refresh else ""}')
@@ -0,0 +1,365 @@
+"""
+Streaming download -> parse pipeline.
+
+The pipeline used to be strictly staged: 08 stored every tile, and only
+afterwards did a parse script list the dataset and read each tile back.
+With 08 --parse, tiles go from the downloader straight into the attribute
+parser while the download continues:
+
+  downloader --put(path, data)--> bounded queue --> parser thread
+                                                    --> BuildingCollector
+
+ParsePipeline holds at most `maxsize` tiles; put() blocks when the parser
+falls behind, so memory stays bounded. Under DownloadScheduler, put() is
+called on the event loop's thread, where blocking would stall every
+campus: there a tile that finds the queue full goes to a backlog and put()
+returns True, and the downloader yields Wait(pipeline.flush), which blocks
+on a worker thread until the backlog is in the queue. The downloader
+stops there, so at most the tiles of one fetch batch wait in the backlog.
+Raw tiles are still stored by the downloader as before. Parsing (gzip and
+attribute decoding) runs on its own thread while the downloader mostly
+waits on the network, so a campus takes about max(download, parse)
+instead of their sum.
+
+BuildingCollector is the per-campus filter of 07_parse_multi_campus.py
+(bbox, optional boundary polygon, BUILD_ID "first seen wins" dedup). New
+buildings are appended to a JSON Lines file as soon as their tile is
+parsed. Tiles arrive in download order, so finish() replays the parsed
+tiles in the order 07 reads a dataset (tilestore.dataset_order) to get the
+same building list a 07 parse of the finished download produces.
+
+07's campus filter settings (PARSE_CAMPUSES, TILE_MARGIN) and its output
+file (save_campus_buildings()) live here too, so 08 --parse writes the
+same result without loading 07.
+"""
+import asyncio
+import collections
+import json
+import queue
+import sys
+import threading
+import time
+
+DEFAULT_QUEUE_SIZE = 64
+
+# Tiles within this many degrees of a campus boundary polygon are parsed;
+# a building's centroid can sit just outside the tile holding its model
+TILE_MARGIN = 0.005
+
+_DONE = object()
+
+
+class ParsePipeline:
+    """
+    Parse tiles on a background thread: parse(data, path) -> result, then
+    consume(path, result). Errors of consume() are raised from put() or
+    close(); tiles that fail to parse are reported to `out` (default: the
+    sys.stdout of the caller) and skipped.
+    """
+
+    def __init__(self, parse, consume, maxsize=DEFAULT_QUEUE_SIZE, out=None,
+                 clock=time.monotonic):
+        self.parse = parse
+        self.consume = consume
+        self.out = sys.stdout if out is None else out
+        self._clock = clock
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self._backlog = collections.deque()     # put() on an event loop, queue full
+        self._error = None
+        self.parsed = 0
+        self.failed = 0
+        self.parse_seconds = 0.0
+        self.wait_seconds = 0.0     # downloader blocked on a full queue
+        self.drain_seconds = 0.0    # parsing left when the download ended
+        self.max_depth = 0
+        self._thread = threading.Thread(target=self._run, name='tile-parser', daemon=True)
+        self._thread.start()
+
+    def put(self, path, data):
+        """
+        Queue a tile. On an event loop this never blocks: it returns True
+        when the tile went to the backlog, and the caller should then wait
+        for flush() off the loop before downloading more.
+        """
+        if self._error is not None:
+            raise self._error
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._put((path, data))
+            return False
+        if not self._backlog:
+            try:
+                self._queue.put_nowait((path, data))
+                self.max_depth = max(self.max_depth, self._queue.qsize())
+                return False
+            except queue.Full:
+                pass
+        self._backlog.append((path, data))
+        return True
+
+    def flush(self):
+        """Block until the backlog is in the queue (run off the event loop)."""
+        while self._backlog:
+            self._put(self._backlog.popleft())
+
+    def _put(self, item):
+        self.max_depth = max(self.max_depth, self._queue.qsize() + 1)
+        if self._queue.full():
+            t0 = self._clock()
+            self._queue.put(item)
+            self.wait_seconds += self._clock() - t0
+        else:
+            self._queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if self._error is not None:
+                continue    # keep draining so put() never blocks forever
+            path, data = item
+            t0 = self._clock()
+            try:
+                result = self.parse(data, path)
+            except Exception as e:
+                # Same as a staged parse: a broken tile is reported and skipped
+                self.failed += 1
+                self.out.write(f'\n  ERROR parsing {path}: {e}\n')
+                continue
+            finally:
+                self.parse_seconds += self._clock() - t0
+            try:
+                self.consume(path, result)
+            except Exception as e:
+                self._error = e
+            self.parsed += 1
+
+    def close(self):
+        """Wait for the queued tiles to be parsed (blocks: off the event loop)."""
+        t0 = self._clock()
+        self.flush()
+        self._queue.put(_DONE)
+        self._thread.join()
+        self.drain_seconds = self._clock() - t0
+        if self._error is not None:
+            raise self._error
+
+    def summary(self):
+        text = (f'parse pipeline: {self.parsed} tiles parsed while downloading '
+                f'({self.parse_seconds:.2f}s parsing, {self.drain_seconds:.2f}s after '
+                f'the last tile, download blocked {self.wait_seconds:.2f}s on a '
+                f'full queue, max depth {self.max_depth})')
+        if self.failed:
+            text += f', {self.failed} tiles failed to parse'
+        return text
+
+
+class BuildingCollector:
+    """
+    Campus buildings from parsed tiles (nlsc_tile.parse_tile_bytes() results).
+
+    add() keeps the tile's buildings inside `bbox` (and `covering`, if
+    given) and streams those with a new BUILD_ID to `stream_path`;
+    finish() returns the deduplicated list in dataset order. add_parsed()
+    does the same for an nlsc_tile.ParsedTile (07 --workers).
+    """
+
+    def __init__(self, bbox, covering=None, stream_path=None):
+        self.bbox = bbox
+        self.covering = covering
+        self._tiles = []        # (path, buildings kept by the filter)
+        self._seen_ids = set()
+        self.unique = 0         # buildings kept so far, deduplicated
+        self._stream = open(stream_path, 'w', encoding='utf-8') if stream_path else None
+        self.stream_path = stream_path
+        self.total_raw_buildings = 0
+        self.tiles_with_data = 0
+        self.coord_stats = {'lon_min': 999, 'lon_max': -999, 'lat_min': 999, 'lat_max': -999}
+        self._lock = threading.Lock()
+
+    def add(self, path, result):
+        """Filter one parsed tile; returns its building count."""
+        bc = result.get('building_count', 0)
+        if bc == 0:
+            return 0
+        buildings = result.get('buildings', [])
+        coords = [(bldg.get('lon'), bldg.get('lat')) for bldg in buildings]
+        keep = self._filter(coords)
+        kept = [buildings[i] for i in keep]
+        return self._add_kept(path, result, kept)
+
+    def add_parsed(self, path, parsed):
+        """
+        add() for a ParsedTile: the filter runs on its lon/lat arrays, and
+        only the buildings it keeps are built as dicts.
+        """
+        bc = parsed.info.get('building_count', 0)
+        if bc == 0:
+            return 0
+        coords = [(lon, lat) if lon == lon else (None, None)
+                  for lon, lat in zip(parsed.lon, parsed.lat)]
+        kept = [parsed.building(i) for i in self._filter(coords)]
+        return self._add_kept(path, parsed.info, kept)
+
+    def _filter(self, coords):
+        """Indexes of the (lon, lat) pairs inside the bbox and covering."""
+        lon_min, lon_max, lat_min, lat_max = self.bbox
+        keep = []
+        stats = self.coord_stats
+        for i, (lon, lat) in enumerate(coords):
+            self.total_raw_buildings += 1
+
+            # Track coordinate range for debugging
+            if lon is not None and lat is not None:
+                stats['lon_min'] = min(stats['lon_min'], lon)
+                stats['lon_max'] = max(stats['lon_max'], lon)
+                stats['lat_min'] = min(stats['lat_min'], lat)
+                stats['lat_max'] = max(stats['lat_max'], lat)
+
+            # Skip if no coordinates
+            if lon is None or lat is None:
+                continue
+
+            # Bbox filter
+            if not (lon_min <= lon <= lon_max and lat_min <= lat <= lat_max):
+                continue
+            if self.covering is not None and not self.covering.contains_point(lon, lat):
+                continue
+            keep.append(i)
+        return keep
+
+    def _add_kept(self, path, result, kept):
+        bc = result.get('building_count', 0)
+        level = result.get('level', '?')
+        row = result.get('row', '?')
+        col = result.get('col', '?')
+        for bldg in kept:
+            bldg['_tile'] = f'L{level}/R{row}_C{col}'
+
+        with self._lock:
+            self.tiles_with_data += 1
+            self._tiles.append((path, kept))
+            for bldg in kept:
+                bid = bldg.get('BUILD_ID', '')
+                if bid and bid in self._seen_ids:
+                    continue
+                if bid:
+                    self._seen_ids.add(bid)
+                self.unique += 1
+                if self._stream is not None:
+                    self._stream.write(json.dumps(bldg, ensure_ascii=False) + '\n')
+            if self._stream is not None:
+                self._stream.flush()
+        return bc
+
+    def finish(self, key=None):
+        """
+        Buildings deduplicated by BUILD_ID (first seen wins), visiting the
+        tiles in order of key(path), or in the order they were added.
+        """
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        tiles = sorted(self._tiles, key=lambda t: key(t[0])) if key else self._tiles
+        buildings = []
+        seen_ids = set()
+        for _, kept in tiles:
+            for bldg in kept:
+                # Dedup by BUILD_ID
+                bid = bldg.get('BUILD_ID', '')
+                if bid and bid in seen_ids:
+                    continue
+                if bid:
+                    seen_ids.add(bid)
+                buildings.append(bldg)
+        return buildings
+
+
+# Campuses as 07 parses them (08 --parse uses the same bbox filter)
+PARSE_CAMPUSES = {
+    'boai': {
+        'name': '博愛校區',
+        'name_en': 'Boai Campus',
+        'tiles_dir': 'NLSC_3D_tiles_112_O_boai',
+        'layer': '112_O',
+        'bbox': (120.960, 120.978, 24.793, 24.810),  # slightly wider than download bbox
+    },
+    'yangming': {
+        'name': '陽明校區',
+        'name_en': 'Yangming Campus',
+        'tiles_dir': 'NLSC_3D_tiles_109_A_yangming',
+        'layer': '109_A',
+        'bbox': (121.505, 121.528, 25.109, 25.131),
+    },
+    'liujia': {
+        'name': '六家校區',
+        'name_en': 'Liujia Campus',
+        'tiles_dir': 'NLSC_3D_tiles_113_J_liujia',
+        'layer': '113_J',
+        'bbox': (121.005, 121.023, 24.830, 24.848),
+    },
+    'gueiren': {
+        'name': '歸仁校區',
+        'name_en': 'Gueiren Campus',
+        'tiles_dir': 'NLSC_3D_tiles_112_D_gueiren',
+        'layer': '112_D',
+        'bbox': (120.295, 120.315, 22.923, 22.943),
+    },
+}
+
+
+def save_campus_buildings(campus_key, campus, layer, all_buildings, collector,
+                          output_file, boundary=None):
+    """
+    Report, sort by height and save a campus's buildings (07's
+    process_campus(), and 08 --parse once the download is done).
+    """
+    lon_min, lon_max, lat_min, lat_max = collector.bbox
+    coord_stats = collector.coord_stats
+    print(f'\n\n  Raw buildings in all tiles: {collector.total_raw_buildings}')
+    print(f'  Tiles with building data: {collector.tiles_with_data}')
+    if collector.total_raw_buildings > 0:
+        print(f'  Coordinate range of ALL parsed buildings:')
+        print(f'    lon: [{coord_stats["lon_min"]:.6f}, {coord_stats["lon_max"]:.6f}]')
+        print(f'    lat: [{coord_stats["lat_min"]:.6f}, {coord_stats["lat_max"]:.6f}]')
+    print(f'  Buildings within campus {"boundary" if boundary else "bbox"}: '
+          f'{len(all_buildings)}')
+
+    # Sort by height descending
+    all_buildings.sort(key=lambda x: -float(x.get('BUILD_H', '0') or '0'))
+
+    # Save output
+    output_data = {
+        'campus': campus_key,
+        'name': campus['name'],
+        'name_en': campus['name_en'],
+        'layer': layer,
+        'bbox': {
+            'lon_min': lon_min, 'lon_max': lon_max,
+            'lat_min': lat_min, 'lat_max': lat_max,
+        },
+        'total_raw_buildings': collector.total_raw_buildings,
+        'buildings': all_buildings,
+        'total': len(all_buildings),
+    }
+    if boundary:
+        output_data['boundary'] = boundary
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    print(f'  Saved to {output_file}')
+
+    # Print top buildings
+    if all_buildings:
+        print(f'\n  Top 10 buildings by height:')
+        for i, b in enumerate(all_buildings[:10]):
+            bid = b.get('BUILD_ID', '?')
+            h = b.get('BUILD_H', '?')
+            name = b.get('BUILDNAME', '-')
+            lon = b.get('lon', '')
+            lat = b.get('lat', '')
+            print(f'    {i+1:2d}. {bid:15s} H={h:>6s}m  ({lon}, {lat})  {name}')
+
+    return output_data
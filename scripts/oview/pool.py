@@ -0,0 +1,201 @@
+"""
+Persistent HTTP/1.1 keep-alive connection pool for the NLSC mirrors.
+
+urllib.request opens a new TCP + TLS connection for every request, and for
+a few-hundred-byte tile the handshake costs more than the payload. The pool
+keeps a set of warm http.client connections per mirror host and resumes TLS
+sessions when a new connection has to be opened. It also sends
+Accept-Encoding: gzip and decodes gzip transfer encoding. (Many tiles are
+gzip files themselves; those bytes are returned untouched.)
+
+Per-mirror counters (connections opened, requests served on a reused
+connection, TLS sessions resumed) are kept so a run can confirm that the
+handshakes are gone.
+"""
+import gzip
+import http.client
+import ssl
+import threading
+import urllib.parse
+
+# Errors that mean a kept-alive connection was closed by the server while
+# idle; the request is retried once on a fresh connection.
+STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class _ResumingHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection that offers the last TLS session seen for its host."""
+
+    def __init__(self, host, port=None, session=None, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self._offer_session = session
+        self.session_reused = False
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self.host, session=self._offer_session)
+        self.session_reused = self.sock.session_reused
+
+
+class MirrorStats:
+    """Connection counters for one mirror host."""
+
+    __slots__ = ('opened', 'reused', 'resumed', 'requests', 'stale')
+
+    def __init__(self):
+        self.opened = 0     # new TCP (+TLS) connections
+        self.reused = 0     # requests served on an already-open connection
+        self.resumed = 0    # new TLS connections that resumed a session
+        self.requests = 0
+        self.stale = 0      # idle connections found closed by the server
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive connections keyed by (scheme, host, port).
+
+    get() is blocking and safe to call from the DownloadEngine worker threads;
+    each thread checks a connection out, uses it for one request and returns
+    it to the idle list.
+    """
+
+    def __init__(self, headers=None, max_idle_per_host=8):
+        self.headers = dict(headers or {})
+        self.headers.setdefault('Accept-Encoding', 'gzip')
+        self.headers.setdefault('Connection', 'keep-alive')
+        self.max_idle_per_host = max_idle_per_host
+        self._ssl_context = ssl.create_default_context()
+        self._idle = {}        # key -> [connection, ...]
+        self._sessions = {}    # host -> ssl.SSLSession
+        self._stats = {}       # netloc -> MirrorStats
+        self._lock = threading.Lock()
+
+    # --- Connection checkout ---
+
+    def _stats_for(self, netloc):
+        stats = self._stats.get(netloc)
+        if stats is None:
+            stats = self._stats[netloc] = MirrorStats()
+        return stats
+
+    def _checkout(self, key, timeout):
+        scheme, host, port = key
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            session = self._sessions.get(host)
+        if scheme == 'https':
+            conn = _ResumingHTTPSConnection(
+                host, port, session=session, timeout=timeout,
+                context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def _checkin(self, key, conn):
+        host = key[1]
+        with self._lock:
+            sock = getattr(conn, 'sock', None)
+            if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+                self._sessions[host] = sock.session
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    # --- Requests ---
+
+    def get(self, url, headers=None, timeout=30):
+        """
+        GET url over a pooled connection.
+
+        Returns (status, body, response_headers). Raises on network errors
+        after one retry for a stale kept-alive connection.
+        """
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        req_headers = dict(self.headers)
+        if headers:
+            req_headers.update(headers)
+
+        for attempt in range(2):
+            conn, reused = self._checkout(key, timeout)
+            try:
+                conn.request('GET', path, headers=req_headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except STALE_ERRORS:
+                conn.close()
+                if reused and attempt == 0:
+                    with self._lock:
+                        self._stats_for(parts.netloc).stale += 1
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+            with self._lock:
+                stats = self._stats_for(parts.netloc)
+                stats.requests += 1
+                if reused:
+                    stats.reused += 1
+                else:
+                    stats.opened += 1
+                    if getattr(conn, 'session_reused', False):
+                        stats.resumed += 1
+
+            try:
+                if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+                    body = gzip.decompress(body)
+            finally:
+                # The body was read in full, so the connection is reusable
+                # even when it does not decompress
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._checkin(key, conn)
+            resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+            return resp.status, body, resp_headers
+
+    def stats(self):
+        """Per-host counters as plain dicts."""
+        with self._lock:
+            return {host: s.as_dict() for host, s in sorted(self._stats.items())}
+
+    def report(self):
+        """Lines for the end-of-run summary, one per mirror."""
+        lines = []
+        for host, s in self.stats().items():
+            reuse = s['reused'] / s['requests'] * 100 if s['requests'] else 0.0
+            lines.append(
+                f'{host}: {s["requests"]} requests over {s["opened"]} connections '
+                f'({s["reused"]} reused, {reuse:.0f}%; '
+                f'{s["resumed"]} TLS resumed, {s["stale"]} stale)')
+        return lines
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
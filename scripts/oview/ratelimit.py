@@ -0,0 +1,163 @@
+"""
+Adaptive per-mirror rate limiting for the oview download engine.
+
+Politeness used to be a fixed sleep: every slot stayed busy for `delay`
+seconds after its response (0.03-0.05 s in 01, 06 and 08), and a failed
+request slept retry_delay (0.5 s) before its retry. The sleep was paid
+even when the server was idle, and nothing slowed down when the server
+started throttling.
+
+RateLimiter keeps one token bucket per mirror instead. Tokens refill at the
+mirror's current rate, capped by a configured ceiling (--rate, requests per
+second per mirror), and the bucket holds at most `burst` tokens. The rate
+follows AIMD:
+
+  success              rate += increase / rate   (about +increase req/s
+                                                  per second at full speed)
+  429, 5xx or timeout  rate *= decrease, at most once per `backoff_interval`
+                       (the failures of one overload arrive together);
+                       a Retry-After pauses the mirror for that long
+
+One limiter is shared by every worker of the engine, and so by all
+campuses of a run. All methods take an internal lock.
+"""
+import threading
+import time
+
+# Requests per second per mirror (--rate)
+DEFAULT_RATE = 20.0
+
+
+class TokenBucket:
+    """Token bucket with an adjustable refill rate and AIMD counters."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        self.paused_until = 0.0
+        self.last_backoff = None
+        self.backoffs = 0
+        self.waited = 0.0       # seconds requests spent waiting for a token
+
+    def refill(self, now):
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def reserve(self, now):
+        """Take a token, borrowing ahead if needed; returns seconds to wait."""
+        self.refill(now)
+        self.tokens -= 1
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 0:
+            wait += -self.tokens / self.rate
+        self.waited += wait
+        return wait
+
+
+class RateLimiter:
+    """
+    Per-mirror AIMD token buckets.
+
+    Call reserve(server) before each request and sleep for the returned
+    delay; then report the result with success(server) or
+    backoff(server, retry_after).
+    """
+
+    def __init__(self, servers, rate=DEFAULT_RATE, burst=None, min_rate=0.5,
+                 increase=1.0, decrease=0.5, backoff_interval=1.0,
+                 clock=time.monotonic):
+        self.min_rate = min_rate
+        self.ceiling = max(float(rate), min_rate)
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.backoff_interval = backoff_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        now = clock()
+        self._buckets = {s: TokenBucket(self.ceiling, self._burst(), now)
+                         for s in servers}
+
+    def _burst(self):
+        return self.burst or max(1.0, self.ceiling / 4)
+
+    def set_rate(self, rate):
+        """Change the ceiling (e.g. from --rate); buckets restart at it."""
+        with self._lock:
+            self.ceiling = max(float(rate), self.min_rate)
+            for bucket in self._buckets.values():
+                bucket.rate = self.ceiling
+                bucket.burst = self._burst()
+                bucket.tokens = min(bucket.tokens, bucket.burst)
+
+    def reserve(self, server):
+        """Seconds the caller must wait before sending its request."""
+        now = self._clock()
+        with self._lock:
+            return self._buckets[server].reserve(now)
+
+    def available(self, server):
+        """True if a request could be sent to `server` without waiting."""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets[server]
+            bucket.refill(now)
+            return bucket.tokens >= 1 and now >= bucket.paused_until
+
+    def success(self, server):
+        """Additive increase towards the ceiling."""
+        with self._lock:
+            bucket = self._buckets[server]
+            bucket.rate = min(self.ceiling, bucket.rate + self.increase / bucket.rate)
+
+    def backoff(self, server, retry_after=None):
+        """Multiplicative decrease after a 429, 5xx or timeout."""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets[server]
+            if retry_after:
+                bucket.refill(now)
+                bucket.paused_until = max(bucket.paused_until, now + retry_after)
+            if (bucket.last_backoff is not None
+                    and now - bucket.last_backoff < self.backoff_interval):
+                return
+            bucket.refill(now)
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            bucket.last_backoff = now
+            bucket.backoffs += 1
+
+    def snapshot(self):
+        """Per-mirror rate state as plain dicts."""
+        with self._lock:
+            return {
+                server: {
+                    'rate': round(b.rate, 2),
+                    'ceiling': self.ceiling,
+                    'backoffs': b.backoffs,
+                    'waited_s': round(b.waited, 1),
+                }
+                for server, b in self._buckets.items()
+            }
+
+    def report(self):
+        """Lines for the end-of-run summary, one per mirror."""
+        lines = []
+        for server, s in self.snapshot().items():
+            host = server.split('//', 1)[-1].split('/', 1)[0]
+            lines.append(
+                f'{host}: {s["rate"]:g}/{s["ceiling"]:g} req/s, '
+                f'{s["backoffs"]} backoffs, {s["waited_s"]} s total waiting for tokens')
+        return lines
+
+
+def retry_after_seconds(headers):
+    """Retry-After in seconds (numeric form only), or None."""
+    value = (headers or {}).get('retry-after')
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,372 @@
+"""
+Global download scheduler: every (campus, layer) job under one budget.
+
+main() in 06 and 08 used to download the campuses one after another, so
+they never overlapped and one slow campus (Gueiren over three layers with
+--all-layers) held up the rest. The downloaders now write their fetch
+loops as *steps* generators: instead of calling ENGINE.fetch_many() they
+yield a FetchBatch and receive its results, e.g.
+
+    results = yield FetchBatch(queries, on_result=on_result, with_outcome=True)
+
+run_steps(steps, engine) drives one generator with engine.fetch_many(), so
+a single job behaves exactly as before. DownloadScheduler drives all jobs
+together on one event loop:
+
+  - every request of every job goes into one priority queue, served by
+    per_mirror x mirrors workers on the shared engine, so the engine's
+    slots and rate limiter are the global concurrency and rate budget;
+  - a job's `priority(query)` ranks its requests (lower first, FIFO within
+    a rank); the downloaders rank tiles that had BUILD_ID in earlier
+    manifests, and their ancestors, ahead of the rest (building_ranks);
+  - a query already queued or in flight for another job (overlapping
+    campuses such as Guangfu and Boai) is not sent twice: the second job
+    gets the same answer;
+  - progress and ETA are printed per campus every `progress_interval`
+    seconds, measured against the tile count of the campus's previous
+    manifest when there is one.
+
+Job code (steps and on_result callbacks) runs on the event loop's thread,
+one job at a time, so the tile caches and journals need no locking. It
+must not block there: a step that has to wait for something else (a
+layer probe, a full parse queue) yields Wait(call, *args) instead, which
+the scheduler runs on a worker thread while the other jobs go on. Its
+output is buffered and printed as one block when the job finishes.
+"""
+import asyncio
+import contextlib
+import io
+import itertools
+import math
+import sys
+import time
+
+from .engine import NOT_MODIFIED, tile_query
+
+# building_ranks() ranks
+RANK_BUILDING = 0
+RANK_ANCESTOR = 1
+RANK_OTHER = 2
+
+
+class FetchBatch:
+    """One fetch_many() call, yielded by a steps generator."""
+
+    def __init__(self, queries, on_result=None, with_outcome=False, validators=None):
+        self.queries = list(queries)
+        self.on_result = on_result
+        self.with_outcome = with_outcome
+        self.validators = validators
+
+
+class Wait:
+    """
+    A blocking call(*args), yielded by a steps generator: its return value
+    is sent back, and its exception raised at the yield, as if it had been
+    called there. DownloadScheduler runs it on a worker thread.
+    """
+
+    def __init__(self, call, *args):
+        self.call = call
+        self.args = args
+
+
+def run_steps(steps, engine):
+    """Drive a steps generator with engine.fetch_many(); returns its value."""
+    try:
+        batch = next(steps)
+        while True:
+            if isinstance(batch, Wait):
+                try:
+                    result = batch.call(*batch.args)
+                except Exception as e:
+                    batch = steps.throw(e)
+                    continue
+                batch = steps.send(result)
+                continue
+            batch = steps.send(engine.fetch_many(
+                batch.queries, on_result=batch.on_result,
+                with_outcome=batch.with_outcome, validators=batch.validators))
+    except StopIteration as stop:
+        return stop.value
+
+
+def building_ranks(records, layers):
+    """
+    Query -> rank for tile records of earlier runs (level, row, col and
+    has_build_id): RANK_BUILDING for tiles with BUILD_ID, RANK_ANCESTOR for
+    the tiles above them. Queries are built for every layer in `layers`,
+    as building-bearing tiles rarely move between layer versions.
+    """
+    ranks = {}
+    for t in records:
+        if not t.get('has_build_id'):
+            continue
+        level, row, col = t['level'], t['row'], t['col']
+        ranks[(level, row, col)] = RANK_BUILDING
+        while level > 0:
+            level, row, col = level - 1, row // 2, col // 2
+            ranks.setdefault((level, row, col), RANK_ANCESTOR)
+    return {tile_query(layer, *key): rank
+            for layer in layers for key, rank in ranks.items()}
+
+
+def _has_tile(result):
+    """True if a fetch_many() result (any of its three shapes) holds a tile."""
+    if isinstance(result, tuple):
+        return result[1] is not None or result[0] == NOT_MODIFIED
+    return result is not None
+
+
+class Job:
+    """One steps generator with its priority function and progress counters."""
+
+    def __init__(self, name, steps, group=None, priority=None, expected=None):
+        self.name = name
+        self.steps = steps
+        self.group = group or name
+        self.priority = priority or (lambda query: RANK_OTHER)
+        self.expected = expected    # tiles expected (previous manifest), or None
+        self.output = io.StringIO()
+        self.requests = 0
+        self.answered = 0
+        self.tiles = 0
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+
+def _request_key(batch, i):
+    """Requests with the same key get the same answer."""
+    validators = None
+    if batch.validators is not None:
+        validators = tuple(sorted((batch.validators[i] or {}).items()))
+    return batch.queries[i], batch.with_outcome, batch.validators is not None, validators
+
+
+class _Pending:
+    """The outstanding requests of one batch."""
+
+    def __init__(self, job, batch, future):
+        self.job = job
+        self.batch = batch
+        self.future = future
+        self.results = [None] * len(batch.queries)
+        self.remaining = len(batch.queries)
+
+
+class DownloadScheduler:
+    """
+    Run many steps generators at once against one DownloadEngine.
+
+    add() jobs, then run(); results and errors are on the returned jobs.
+    """
+
+    def __init__(self, engine, progress_interval=5.0, out=None, clock=time.monotonic):
+        self.engine = engine
+        self.progress_interval = progress_interval
+        self.out = out
+        self._clock = clock
+        self.jobs = []
+        self._seq = itertools.count()
+        self._queue = None
+        self._waiting = {}      # request key -> [(pending batch, index), ...]
+        self.coalesced = 0
+        self.started = None
+        self.finished = None
+
+    def add(self, name, steps, group=None, priority=None, expected=None):
+        job = Job(name, steps, group=group, priority=priority, expected=expected)
+        self.jobs.append(job)
+        return job
+
+    def run(self):
+        """Run every job to completion; re-raises the first job error."""
+        out = self.out or sys.stdout
+        asyncio.run(self._run(out))
+        for job in self.jobs:
+            if job.error is not None:
+                raise job.error
+        return self.jobs
+
+    async def _run(self, out):
+        self._queue = asyncio.PriorityQueue()
+        self.started = self._clock()
+        workers = [asyncio.ensure_future(self._worker())
+                   for _ in range(self.engine.per_mirror * len(self.engine.servers))]
+        reporter = asyncio.ensure_future(self._report(out))
+        try:
+            await asyncio.gather(*(self._drive(job, out) for job in self.jobs))
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(reporter, *workers, return_exceptions=True)
+            self.finished = self._clock()
+
+    # --- Jobs ---
+
+    async def _drive(self, job, out):
+        job.started = self._clock()
+        try:
+            with contextlib.redirect_stdout(job.output):
+                batch = next(job.steps)
+            while True:
+                if isinstance(batch, Wait):
+                    try:
+                        result = await asyncio.get_running_loop().run_in_executor(
+                            None, batch.call, *batch.args)
+                    except Exception as e:
+                        with contextlib.redirect_stdout(job.output):
+                            batch = job.steps.throw(e)
+                        continue
+                    with contextlib.redirect_stdout(job.output):
+                        batch = job.steps.send(result)
+                    continue
+                results = await self._fetch(job, batch)
+                with contextlib.redirect_stdout(job.output):
+                    batch = job.steps.send(results)
+        except StopIteration as stop:
+            job.result = stop.value
+        except Exception as e:
+            job.error = e
+            job.output.write(f'\n  ERROR in {job.name}: {e!r}\n')
+        job.finished = self._clock()
+        # The job's own log, in one piece, then a progress line
+        out.write(job.output.getvalue())
+        out.write(f'\n[scheduler] {job.name} finished in '
+                  f'{job.finished - job.started:.1f}s: {job.tiles} tiles, '
+                  f'{job.requests} requests\n')
+        out.flush()
+
+    async def _fetch(self, job, batch):
+        if not batch.queries:
+            return []
+        pending = _Pending(job, batch, asyncio.get_running_loop().create_future())
+        for i, query in enumerate(batch.queries):
+            key = _request_key(batch, i)
+            waiters = self._waiting.get(key)
+            if waiters is not None:
+                waiters.append((pending, i))
+                self.coalesced += 1
+                continue
+            self._waiting[key] = [(pending, i)]
+            self._queue.put_nowait((job.priority(query), next(self._seq), key))
+            job.requests += 1
+        return await pending.future
+
+    # --- Workers ---
+
+    async def _worker(self):
+        engine = self.engine
+        while True:
+            _, _, key = await self._queue.get()
+            waiters = self._waiting[key]
+            if all(pending.future.done() for pending, _ in waiters):
+                del self._waiting[key]
+                continue    # every batch waiting for it already failed
+            pending, i = waiters[0]
+            query = key[0]
+            try:
+                if pending.batch.validators is not None:
+                    result = await engine.fetch_conditional(query, pending.batch.validators[i])
+                elif pending.batch.with_outcome:
+                    result = await engine.fetch_result(query)
+                else:
+                    result = await engine.fetch(query)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result, error = None, e
+            else:
+                error = None
+            # Requests coalesced meanwhile were appended to the same list
+            for pending, i in self._waiting.pop(key):
+                self._deliver(pending, i, result, error)
+
+    def _deliver(self, pending, i, result, error):
+        if pending.future.done():
+            return
+        job = pending.job
+        try:
+            if error is not None:
+                raise error
+            pending.results[i] = result
+            job.answered += 1
+            job.tiles += _has_tile(result)
+            if pending.batch.on_result is not None:
+                with contextlib.redirect_stdout(job.output):
+                    pending.batch.on_result(i, result)
+        except Exception as e:
+            pending.future.set_exception(e)
+            return
+        pending.remaining -= 1
+        if pending.remaining == 0:
+            pending.future.set_result(pending.results)
+
+    # --- Progress ---
+
+    async def _report(self, out):
+        if not self.progress_interval or self.progress_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            for line in self.progress_lines():
+                out.write(f'[scheduler] {line}\n')
+            out.flush()
+
+    def groups(self):
+        """Jobs by group (campus), in the order they were added."""
+        groups = {}
+        for job in self.jobs:
+            groups.setdefault(job.group, []).append(job)
+        return groups
+
+    def progress_lines(self):
+        """One line per campus: tiles, share of the expected count, rate and ETA."""
+        now = self._clock()
+        lines = []
+        for group, jobs in self.groups().items():
+            tiles = sum(j.tiles for j in jobs)
+            requests = sum(j.answered for j in jobs)
+            started = [j.started for j in jobs if j.started is not None]
+            elapsed = now - min(started) if started else 0.0
+            rate = requests / elapsed if elapsed > 0 else 0.0
+            text = f'{group:10s} {tiles} tiles, {requests} requests ({rate:.1f} req/s)'
+            if all(j.finished is not None for j in jobs):
+                end = max(j.finished for j in jobs)
+                lines.append(f'{text}, done in {end - min(started):.1f}s')
+                continue
+            expected = [j.expected for j in jobs if j.expected]
+            if expected and len(expected) == len(jobs):
+                total = sum(expected)
+                share = min(tiles / total, 0.99)
+                text += f', ~{share * 100:.0f}% of {total}'
+                if share > 0:
+                    text += f', ETA {_format_seconds(elapsed * (1 - share) / share)}'
+            lines.append(text)
+        return lines
+
+    def summary(self):
+        """End-of-run line: jobs, wall time and requests."""
+        if self.started is None:
+            return 'scheduler: not run'
+        wall = (self.finished or self._clock()) - self.started
+        requests = sum(j.requests for j in self.jobs)
+        failed = sum(1 for j in self.jobs if j.error is not None)
+        text = (f'scheduler: {len(self.jobs)} jobs in {wall:.1f}s, {requests} requests '
+                f'from one priority queue ({self.engine.per_mirror} in flight x '
+                f'{len(self.engine.servers)} mirrors)')
+        if self.coalesced:
+            text += f', {self.coalesced} coalesced with another job\'s request'
+        if failed:
+            text += f', {failed} failed'
+        return text
+
+
+def _format_seconds(seconds):
+    if not math.isfinite(seconds):
+        return '?'
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    return f'{minutes}:{seconds:02d}'
@@ -0,0 +1,335 @@
+"""
+Local stand-in for the NLSC oview servers, for benchmarks and regression
+runs of the downloaders without touching mapserver*.nlsc.gov.tw.
+
+StandinServer answers the same query API as the real mirrors
+(type=modelset&format=integrate&name=...&level=...&Row=...&Col=...&docname=NODE,
+and docname=LAYER). Tiles come from one of three sources:
+
+  StoreSource      a packed layer store (data/raw/NLSC_tile_store/{layer}.sqlite)
+  DirectorySource  a dataset folder with legacy L*/R*_C*.bin files
+  ManifestSource   a manifest.json alone: synthetic tiles with the recorded
+                   size, BUILD_ID flag and child list in the header, so
+                   the committed manifests can drive a benchmark
+
+Unknown tiles, other layers and terrain requests get an empty 200 answer,
+like the real servers. `aliases` serves the same tiles under more layer
+names, for runs that download several layers at once. Responses carry an ETag and honour If-None-Match.
+
+FaultProfile injects the failure modes seen in practice:
+
+  latency        'fixed:S', 'uniform:LO,HI' or 'lognormal:MEDIAN,SIGMA'
+                 (seconds; sleeps in the handler thread)
+  error_rate     share of requests answered 503
+  throttle_rps   requests per second above which the server answers 429
+                 with Retry-After: 1
+  truncate_rate  share of tile bodies cut off halfway (the full
+                 Content-Length is announced, then the connection closes)
+"""
+import collections
+import hashlib
+import http.server
+import json
+import math
+import os
+import random
+import struct
+import threading
+import time
+import urllib.parse
+
+from .tilestore import TileStore, bin_files, manifest_tiles, read_manifest, tile_key
+
+# Header layout read by the downloaders' parse_tile_header()
+HEADER_CHILDREN_OFFSET = 228
+BUILD_ID_MARKER = b'BUILD_ID'
+
+
+# --- Tile sources ---
+
+class StoreSource:
+    """Tiles of one layer from its packed TileStore (one connection per thread)."""
+
+    def __init__(self, raw_dir, layer):
+        if not TileStore.exists(raw_dir, layer):
+            raise FileNotFoundError(f'no tile store for layer {layer} in {raw_dir}')
+        self.raw_dir = raw_dir
+        self.layer = layer
+        self._local = threading.local()
+
+    def _store(self):
+        store = getattr(self._local, 'store', None)
+        if store is None:
+            store = self._local.store = TileStore.for_layer(self.raw_dir, self.layer)
+        return store
+
+    def get(self, level, row, col):
+        return self._store().get(level, row, col)
+
+    def keys(self):
+        return list(self._store().keys())
+
+    def layer_doc(self):
+        return f'stand-in LAYER {self.layer}'.encode('ascii')
+
+
+class DirectorySource:
+    """Tiles from a dataset folder's L*/R*_C*.bin files."""
+
+    def __init__(self, tiles_dir, layer=None):
+        manifest = read_manifest(tiles_dir) or {}
+        self.layer = layer or manifest.get('layer', 'local')
+        self.manifest = manifest or None
+        self._paths = {}
+        for parts, path in bin_files(tiles_dir).items():
+            key = tile_key(parts)
+            if key is not None:
+                self._paths[key] = path
+        self._layer_file = os.path.join(tiles_dir, 'LAYER.bin')
+
+    def get(self, level, row, col):
+        path = self._paths.get((level, row, col))
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def keys(self):
+        return list(self._paths)
+
+    def layer_doc(self):
+        if os.path.isfile(self._layer_file):
+            with open(self._layer_file, 'rb') as f:
+                return f.read()
+        return f'stand-in LAYER {self.layer}'.encode('ascii')
+
+
+class ManifestSource:
+    """
+    Synthetic tiles for the records of a manifest.json: level, row and col
+    at offset 0, the child id list at HEADER_CHILDREN_OFFSET, the BUILD_ID
+    marker when the record has one, zero-padded to the recorded size.
+    """
+
+    def __init__(self, manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.layer = self.manifest.get('layer', 'local')
+        self._records = {(t['level'], t['row'], t['col']): t
+                         for t in manifest_tiles(self.manifest)}
+
+    def get(self, level, row, col):
+        t = self._records.get((level, row, col))
+        if t is None:
+            return None
+        children = t.get('children', [])
+        data = bytearray(struct.pack('<III', level, row, col))
+        data += b'\0' * (HEADER_CHILDREN_OFFSET - len(data))
+        data += struct.pack('<I', len(children))
+        data += b''.join(struct.pack('<I', c) for c in children)
+        if t.get('has_build_id'):
+            data += BUILD_ID_MARKER
+        if len(data) < t.get('size', 0):
+            data += b'\0' * (t['size'] - len(data))
+        return bytes(data)
+
+    def keys(self):
+        return list(self._records)
+
+    def layer_doc(self):
+        return f'stand-in LAYER {self.layer}'.encode('ascii')
+
+
+def open_source(manifest=None, tiles_dir=None, store_layer=None, raw_dir=None):
+    """The source named by the command-line options (exactly one is set)."""
+    if manifest:
+        return ManifestSource(manifest)
+    if tiles_dir:
+        return DirectorySource(tiles_dir)
+    return StoreSource(raw_dir, store_layer)
+
+
+# --- Fault injection ---
+
+class FaultProfile:
+    """Latency distribution and failure rates of the stand-in server."""
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, throttle_rps=0.0,
+                 truncate_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+        self.truncate_rate = truncate_rate
+        self._kind, self._params = parse_latency(latency)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = collections.deque()
+
+    def delay(self):
+        with self._lock:
+            if self._kind == 'uniform':
+                return self._rng.uniform(*self._params)
+            if self._kind == 'lognormal':
+                median, sigma = self._params
+                return self._rng.lognormvariate(math.log(median), sigma)
+            return self._params[0]
+
+    def chance(self, rate):
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+
+    def throttled(self):
+        """True if this request exceeds throttle_rps over the last second."""
+        if self.throttle_rps <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.throttle_rps:
+                return True
+            self._recent.append(now)
+            return False
+
+    def describe(self):
+        return (f'latency {self.latency}, {self.error_rate * 100:g}% errors, '
+                f'throttle {self.throttle_rps:g} req/s, '
+                f'{self.truncate_rate * 100:g}% truncated')
+
+
+def parse_latency(spec):
+    """'fixed:S', 'uniform:LO,HI' or 'lognormal:MEDIAN,SIGMA' -> (kind, params)."""
+    kind, _, args = str(spec).partition(':')
+    if not args:
+        kind, args = 'fixed', kind
+    params = tuple(float(x) for x in args.split(','))
+    expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2}
+    if kind not in expected or len(params) != expected[kind]:
+        raise ValueError(f'bad latency spec {spec!r}: use fixed:S, uniform:LO,HI '
+                         f'or lognormal:MEDIAN,SIGMA')
+    return kind, params
+
+
+# --- Server ---
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server.standin
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        faults = server.faults
+        server.count('requests')
+
+        delay = faults.delay()
+        if delay > 0:
+            time.sleep(delay)
+        if faults.throttled():
+            server.count('throttled')
+            self._send(429, b'', {'Retry-After': '1'})
+            return
+        if faults.chance(faults.error_rate):
+            server.count('errors')
+            self._send(503, b'')
+            return
+
+        body = server.body(query)
+        if not body:
+            server.count('empty')
+            self._send(200, b'')
+            return
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+        if self.headers.get('If-None-Match') == etag:
+            server.count('not_modified')
+            self._send(304, b'', {'ETag': etag})
+            return
+        if faults.chance(faults.truncate_rate):
+            server.count('truncated')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        server.count('tiles')
+        self._send(200, body, {'ETag': etag})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class StandinServer:
+    """
+    Serve a tile source on localhost in a background thread.
+
+    Use as a context manager; `url` is the mirror URL for DownloadEngine.
+    """
+
+    def __init__(self, source, faults=None, host='127.0.0.1', port=0, aliases=()):
+        self.source = source
+        self.layers = {source.layer, *aliases}
+        self.faults = faults or FaultProfile()
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.standin = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/oview'
+
+    def body(self, query):
+        if query.get('name') not in self.layers or query.get('type') != 'modelset':
+            return b''
+        if query.get('docname') == 'LAYER':
+            self.count('layer')
+            return self.source.layer_doc()
+        try:
+            key = int(query['level']), int(query['Row']), int(query['Col'])
+        except (KeyError, ValueError):
+            return b''
+        return self.source.get(*key) or b''
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = collections.Counter()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
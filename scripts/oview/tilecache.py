@@ -0,0 +1,114 @@
+"""
+Layer-keyed tile cache shared by every campus and downloader.
+
+Guangfu and Boai both use layer 112_O and their areas overlap, so every
+tile from L0 down to about L10 over Hsinchu used to be downloaded twice,
+once into each campus directory (and again by 01 and 06). TileCache stores
+each tile once per layer, in that layer's packed TileStore (whose bodies
+are content-addressed, so identical tiles of different layers share one
+blob):
+
+  data/raw/NLSC_tile_store/{layer}.sqlite + blobs.sqlite
+
+Campus output directories keep manifest.json (and LAYER.bin); the tiles
+they list are read from the store (oview.tilestore.iter_dataset_tiles).
+With write_files=True (--write-bin) the legacy L*/R*_C*.bin files are also
+written into the campus directory. A tile that is already cached is used
+for a new campus without a request.
+
+Cached tiles are trusted until a refresh: with refresh=True (--refresh-tiles,
+and 08 --replay) the cache is not read, but fetched tiles still replace
+the cached copies; a refetched tile that hashes the same as the cached
+copy is counted as unchanged.
+"""
+import os
+
+from .tilestore import TileStore
+
+# Loose tiles written by earlier versions; 09_tile_store.py import packs them
+LEGACY_CACHE_DIR_NAME = 'NLSC_tile_cache'
+
+
+class TileCache:
+    """One TileStore per layer, plus hit/store/write counters."""
+
+    def __init__(self, raw_dir, refresh=False, write_files=False):
+        self.raw_dir = raw_dir
+        self.refresh = refresh
+        self.write_files = write_files
+        self._stores = {}
+        self.hits = 0
+        self.stored = 0
+        self.written = 0    # legacy .bin files written (write_files)
+
+    @classmethod
+    def for_raw_dir(cls, raw_dir, **kwargs):
+        return cls(raw_dir, **kwargs)
+
+    def store_for(self, layer):
+        store = self._stores.get(layer)
+        if store is None:
+            store = self._stores[layer] = TileStore.for_layer(self.raw_dir, layer)
+        return store
+
+    def read(self, layer, level, row, col):
+        """Cached tile bytes regardless of refresh, or None."""
+        return self.store_for(layer).get(level, row, col)
+
+    def get(self, layer, level, row, col):
+        """Cached tile bytes, or None. Counts the hit as an avoided request."""
+        if self.refresh:
+            return None
+        data = self.read(layer, level, row, col)
+        if data is not None:
+            self.hits += 1
+        return data
+
+    def put(self, layer, level, row, col, data, validators=None):
+        """Store a tile; False if the cached copy already had the same bytes."""
+        self.stored += 1
+        return self.store_for(layer).put(level, row, col, data, validators=validators)
+
+    def place(self, layer, level, row, col, dest):
+        """
+        Materialize a cached tile as the legacy file `dest`, if write_files
+        is set. Otherwise the campus manifest is the only reference needed.
+        """
+        if not self.write_files:
+            return
+        data = self.read(layer, level, row, col)
+        os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+        tmp = dest + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, dest)
+        self.written += 1
+
+    def store(self, layer, level, row, col, data, dest, validators=None):
+        """put() then place() into a campus directory; returns put()'s result."""
+        changed = self.put(layer, level, row, col, data, validators)
+        self.place(layer, level, row, col, dest)
+        return changed
+
+    def commit(self):
+        for store in self._stores.values():
+            store.commit()
+
+    def close(self):
+        for store in self._stores.values():
+            store.close()
+        self._stores = {}
+
+    def summary(self):
+        stores = self._stores.values()
+        new_blobs = sum(s.new_blobs for s in stores)
+        shared = sum(s.shared_blobs for s in stores)
+        unchanged = sum(s.unchanged for s in stores)
+        text = (f'tile cache: {self.hits} hits (requests avoided), '
+                f'{self.stored} tiles stored ({new_blobs} new blobs, '
+                f'{shared} deduplicated, {unchanged} unchanged)')
+        if self.write_files:
+            text += f', {self.written} .bin files written'
+        if self.refresh:
+            text += ' (refresh)'
+        return text
@@ -0,0 +1,481 @@
+"""
+Packed, content-addressed tile store.
+
+Every tile used to land as its own L{level}/R{row}_C{col}.bin, and with
+several layers and campuses os.walk in the parsers, rglob in the organizer
+and copytree in the backup scripts spent most of their time on per-file
+metadata calls. Many tiles are also byte-identical across layer versions
+(the L0-L4 roots of 109_A and 111_A, for example) and across re-downloads.
+The store keeps each distinct tile body once, keyed by its SHA-256, and one
+small index per layer that maps coordinates to hashes:
+
+  data/raw/NLSC_tile_store/blobs.sqlite
+    blobs(sha256, data, size)
+  data/raw/NLSC_tile_store/{layer}.sqlite
+    tiles(level, row, col, sha256, size, fetched_at, has_build_id,
+          etag, last_modified)
+
+Every layer's TileStore attaches the one blobs.sqlite, so a write to
+blob.blobs must never stay uncommitted: SQLite allows one writer per
+database file, and a second layer store (the scheduler runs several
+layers in one process, and other processes may write too) would wait out
+the busy timeout and fail with "database is locked". TileStore.put()
+therefore commits every tile whose body it writes right away; only
+writes to the layer's own index (unchanged tiles, touch()) are batched.
+
+`data` is the raw blob as served (gzip tiles stay gzipped). Comparing two
+layer versions, or a re-download with the stored copy, is a comparison of
+hashes (compare_layers(), TileStore.put()). The ETag / Last-Modified the
+server sent with a tile are kept for conditional refreshes. Blobs no
+longer referenced by any layer are removed by prune_blobs().
+
+Download directories keep manifest.json and LAYER.bin; their tile list is a
+view into the store. DatasetTiles reads such a directory (or a legacy one
+full of .bin files) for the parsers, and export_tiles() / import_tiles()
+convert between the store and the legacy layout (scripts/09_tile_store.py).
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+STORE_DIR_NAME = 'NLSC_tile_store'
+BLOB_DB_NAME = 'blobs.sqlite'
+
+TILE_PATH_RE = re.compile(r'L(\d+)/R(\d+)_C(\d+)\.bin')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tiles (
+    level        INTEGER NOT NULL,
+    row          INTEGER NOT NULL,
+    col          INTEGER NOT NULL,
+    sha256       TEXT    NOT NULL,
+    size         INTEGER NOT NULL,
+    fetched_at   REAL    NOT NULL,
+    has_build_id INTEGER NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (level, row, col)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+BLOB_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blob.blobs (
+    sha256 TEXT    PRIMARY KEY,
+    data   BLOB    NOT NULL,
+    size   INTEGER NOT NULL
+);
+'''
+
+
+def store_path(raw_dir, layer):
+    return os.path.join(raw_dir, STORE_DIR_NAME, f'{layer}.sqlite')
+
+
+def layer_store_paths(raw_dir):
+    """Index files of every stored layer."""
+    paths = glob.glob(os.path.join(raw_dir, STORE_DIR_NAME, '*.sqlite'))
+    return sorted(p for p in paths if os.path.basename(p) != BLOB_DB_NAME)
+
+
+def legacy_order(key):
+    """Sort key matching a sorted walk of the legacy L*/R*_C*.bin tree."""
+    level, row, col = key
+    return (f'L{level}', f'R{row}_C{col}.bin')
+
+
+def dataset_order(tiles_dir):
+    """
+    Sort key of paths under tiles_dir in the order the parsers have always
+    read a download directory: an os.walk() of tiles_dir, files sorted by
+    name within each directory (legacy_order()). Directories only in the
+    tile store (no .bin files on disk) follow the walked ones, by name.
+    """
+    walked = {}
+    for root, dirs, files in os.walk(tiles_dir):
+        walked[os.path.relpath(root, tiles_dir)] = len(walked)
+
+    def key(path):
+        folder, name = os.path.split(os.path.relpath(path, tiles_dir))
+        folder = folder or os.curdir
+        return walked.get(folder, len(walked)), folder, name
+    return key
+
+
+def has_build_id(data):
+    if data[:2] == b'\x1f\x8b':
+        try:
+            data = gzip.decompress(data)
+        except Exception:
+            pass
+    return b'BUILD_ID' in data
+
+
+class TileStore:
+    """
+    One layer's coordinate -> hash index, with the shared blob database
+    (blobs.sqlite next to it) attached.
+
+    Index-only writes (unchanged tiles, touch()) are batched: committed
+    every `commit_every` of them and on close(). A crash loses at most that
+    batch, which the fetch journal and the downloaders' cache checks simply
+    fetch again. A put() that writes to the shared blob database commits at
+    once (see the module docstring). get() treats a tile whose blob is
+    missing as not stored.
+    """
+
+    def __init__(self, path, layer=None, commit_every=64):
+        self.path = path
+        self.layer = layer
+        self.commit_every = commit_every
+        self._pending = 0
+        self.new_blobs = 0      # puts that added a blob
+        self.shared_blobs = 0   # puts whose blob was already stored
+        self.unchanged = 0      # puts identical to the tile already indexed
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('ATTACH DATABASE ? AS blob',
+                         (os.path.join(os.path.dirname(path), BLOB_DB_NAME),))
+        for schema in ('main', 'blob'):
+            self._db.execute(f'PRAGMA {schema}.journal_mode=WAL')
+            self._db.execute(f'PRAGMA {schema}.synchronous=NORMAL')
+        self._migrate_inline_blobs()
+        self._db.executescript(SCHEMA + BLOB_SCHEMA)
+        self._add_validator_columns()
+        if layer is not None:
+            self._db.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('layer', layer))
+        self._db.commit()
+
+    @classmethod
+    def for_layer(cls, raw_dir, layer, **kwargs):
+        return cls(store_path(raw_dir, layer), layer=layer, **kwargs)
+
+    @staticmethod
+    def exists(raw_dir, layer):
+        return os.path.exists(store_path(raw_dir, layer))
+
+    def _migrate_inline_blobs(self):
+        """Move tile bodies out of an index that still stores them inline."""
+        columns = [r[1] for r in self._db.execute('PRAGMA main.table_info(tiles)')]
+        if 'data' not in columns:
+            return
+        self._db.executescript(BLOB_SCHEMA)
+        self._db.execute('INSERT OR IGNORE INTO blob.blobs '
+                         'SELECT sha256, data, size FROM main.tiles')
+        self._db.execute('ALTER TABLE main.tiles RENAME TO tiles_inline')
+        self._db.executescript(SCHEMA)
+        self._db.execute('INSERT INTO main.tiles (level, row, col, sha256, size, '
+                         'fetched_at, has_build_id) SELECT level, row, col, sha256, '
+                         'size, fetched_at, has_build_id FROM main.tiles_inline')
+        self._db.execute('DROP TABLE main.tiles_inline')
+        self._db.commit()
+        self._db.execute('VACUUM main')
+
+    def _add_validator_columns(self):
+        columns = [r[1] for r in self._db.execute('PRAGMA main.table_info(tiles)')]
+        for name in ('etag', 'last_modified'):
+            if name not in columns:
+                self._db.execute(f'ALTER TABLE main.tiles ADD COLUMN {name} TEXT')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Tiles ---
+
+    def get(self, level, row, col):
+        """Raw tile bytes, or None."""
+        cur = self._db.execute(
+            'SELECT b.data FROM main.tiles t JOIN blob.blobs b ON b.sha256 = t.sha256 '
+            'WHERE t.level=? AND t.row=? AND t.col=?', (level, row, col))
+        hit = cur.fetchone()
+        return hit[0] if hit else None
+
+    def info(self, level, row, col):
+        """size / sha256 / fetched_at / has_build_id of a tile, or None."""
+        cur = self._db.execute(
+            'SELECT size, sha256, fetched_at, has_build_id FROM main.tiles '
+            'WHERE level=? AND row=? AND col=?', (level, row, col))
+        hit = cur.fetchone()
+        if hit is None:
+            return None
+        return {'size': hit[0], 'sha256': hit[1], 'fetched_at': hit[2],
+                'has_build_id': bool(hit[3])}
+
+    def validators(self, level, row, col):
+        """Stored ETag / Last-Modified of a tile, or None."""
+        hit = self._db.execute(
+            'SELECT etag, last_modified FROM main.tiles '
+            'WHERE level=? AND row=? AND col=?', (level, row, col)).fetchone()
+        if hit is None or (hit[0] is None and hit[1] is None):
+            return None
+        return {'etag': hit[0], 'last_modified': hit[1]}
+
+    def touch(self, level, row, col, validators=None, fetched_at=None):
+        """Mark a stored tile as confirmed unchanged (e.g. a 304 answer)."""
+        self._touch(level, row, col, validators or {},
+                    time.time() if fetched_at is None else fetched_at)
+        self._wrote()
+
+    def _touch(self, level, row, col, validators, fetched_at):
+        self._db.execute(
+            'UPDATE main.tiles SET fetched_at=?, etag=COALESCE(?, etag), '
+            'last_modified=COALESCE(?, last_modified) WHERE level=? AND row=? AND col=?',
+            (fetched_at, validators.get('etag'), validators.get('last_modified'),
+             level, row, col))
+
+    def _wrote(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def put(self, level, row, col, data, fetched_at=None, validators=None):
+        """
+        Index a tile, storing its body only if no layer has it yet.
+        Returns False if the tile was already stored with the same hash.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        validators = validators or {}
+        old = self.info(level, row, col)
+        if old is not None and old['sha256'] == digest:
+            self._touch(level, row, col, validators, fetched_at)
+            self.unchanged += 1
+            self._wrote()
+            return False
+
+        # A fresh transaction (no stale read snapshot of blobs.sqlite),
+        # committed below so the blob database's write lock is held briefly
+        self.commit()
+        cur = self._db.execute('INSERT OR IGNORE INTO blob.blobs VALUES (?, ?, ?)',
+                               (digest, sqlite3.Binary(data), len(data)))
+        if cur.rowcount:
+            self.new_blobs += 1
+        else:
+            self.shared_blobs += 1
+        self._db.execute(
+            'INSERT OR REPLACE INTO main.tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (level, row, col, digest, len(data), fetched_at,
+             int(has_build_id(data)), validators.get('etag'),
+             validators.get('last_modified')))
+        self.commit()
+        return True
+
+    def keys(self):
+        """All (level, row, col) in legacy walk order."""
+        rows = self._db.execute('SELECT level, row, col FROM main.tiles').fetchall()
+        return sorted(rows, key=legacy_order)
+
+    def hashes(self):
+        """(level, row, col) -> sha256 for every tile of the layer."""
+        return {(l, r, c): h for l, r, c, h in self._db.execute(
+            'SELECT level, row, col, sha256 FROM main.tiles')}
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM main.tiles').fetchone()[0]
+
+    def stats(self):
+        """Tile count, bytes, distinct blobs and levels, without reading any blob."""
+        count, total, distinct = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(DISTINCT sha256) '
+            'FROM main.tiles').fetchone()
+        levels = [r[0] for r in self._db.execute(
+            'SELECT DISTINCT level FROM main.tiles ORDER BY level')]
+        return {'tiles': count, 'bytes': total, 'distinct': distinct, 'levels': levels}
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+
+    def close(self):
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+def compare_layers(old, new):
+    """
+    Compare two TileStores (layer versions, or a layer before and after a
+    refresh) by hash. Returns {'same', 'changed', 'added', 'removed'}, each
+    a sorted list of (level, row, col).
+    """
+    a, b = old.hashes(), new.hashes()
+    result = {
+        'same': [k for k in a if k in b and a[k] == b[k]],
+        'changed': [k for k in a if k in b and a[k] != b[k]],
+        'added': [k for k in b if k not in a],
+        'removed': [k for k in a if k not in b],
+    }
+    return {k: sorted(v) for k, v in result.items()}
+
+
+def blob_stats(raw_dir):
+    """Distinct blobs and their bytes in the shared blob database."""
+    path = os.path.join(raw_dir, STORE_DIR_NAME, BLOB_DB_NAME)
+    if not os.path.exists(path):
+        return {'blobs': 0, 'bytes': 0}
+    db = sqlite3.connect(path)
+    try:
+        count, total = db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+    finally:
+        db.close()
+    return {'blobs': count, 'bytes': total}
+
+
+def prune_blobs(raw_dir):
+    """Delete blobs no layer index refers to; returns (blobs, bytes) removed."""
+    path = os.path.join(raw_dir, STORE_DIR_NAME, BLOB_DB_NAME)
+    if not os.path.exists(path):
+        return 0, 0
+    db = sqlite3.connect(path)
+    try:
+        db.execute('CREATE TEMP TABLE live (sha256 TEXT PRIMARY KEY)')
+        for layer_path in layer_store_paths(raw_dir):
+            db.execute('ATTACH DATABASE ? AS layer', (layer_path,))
+            db.execute('INSERT OR IGNORE INTO live SELECT sha256 FROM layer.tiles')
+            db.commit()
+            db.execute('DETACH DATABASE layer')
+        count, total = db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs '
+            'WHERE sha256 NOT IN (SELECT sha256 FROM live)').fetchone()
+        db.execute('DELETE FROM blobs WHERE sha256 NOT IN (SELECT sha256 FROM live)')
+        db.commit()
+        db.execute('VACUUM')
+    finally:
+        db.close()
+    return count, total
+
+
+# --- Download directories ---
+
+def read_manifest(tiles_dir):
+    """manifest.json of a download directory, or None."""
+    path = os.path.join(tiles_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def manifest_tiles(manifest):
+    """Tile records of a manifest (01 names the list building_tiles)."""
+    return manifest.get('tiles') or manifest.get('building_tiles') or []
+
+
+def tile_key(parts):
+    """(level, row, col) of a relative path ('L7', 'R52_C96.bin'), or None."""
+    m = TILE_PATH_RE.fullmatch('/'.join(parts))
+    return tuple(int(g) for g in m.groups()) if m else None
+
+
+def bin_files(tiles_dir):
+    """Tile .bin files under tiles_dir, keyed by relative path parts."""
+    found = {}
+    for root, dirs, files in os.walk(tiles_dir):
+        for fname in files:
+            if not fname.endswith('.bin') or fname == 'LAYER.bin':
+                continue
+            path = os.path.join(root, fname)
+            found[tuple(os.path.relpath(path, tiles_dir).split(os.sep))] = path
+    return found
+
+
+class DatasetTiles:
+    """
+    The tiles of one download directory, listed by legacy path.
+
+    Tiles in the directory's manifest.json come from the layer's TileStore;
+    .bin files present on disk (legacy directories, terrain tiles, or
+    --write-bin) are read directly. `paths` is in dataset_order(), the
+    order the parsers read a .bin tree in before the store existed.
+    """
+
+    def __init__(self, tiles_dir, raw_dir):
+        self.tiles_dir = tiles_dir
+        self._files = set(bin_files(tiles_dir).values())
+        self._stored = {}      # legacy path -> (level, row, col) in the store
+        self.store = None
+        manifest = read_manifest(tiles_dir)
+        if manifest and manifest.get('layer') and TileStore.exists(raw_dir, manifest['layer']):
+            self.store = TileStore.for_layer(raw_dir, manifest['layer'])
+            for t in manifest_tiles(manifest):
+                key = (t['level'], t['row'], t['col'])
+                path = os.path.join(tiles_dir, *legacy_order(key))
+                if path not in self._files:
+                    self._stored[path] = key
+        self.paths = sorted(self._files | set(self._stored), key=dataset_order(tiles_dir))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def read(self, path):
+        """Raw bytes of the tile at a legacy path, or None."""
+        if path in self._files:
+            with open(path, 'rb') as f:
+                return f.read()
+        return self.store.get(*self._stored[path]) if path in self._stored else None
+
+    def __iter__(self):
+        for path in self.paths:
+            data = self.read(path)
+            if data is not None:
+                yield path, data
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+
+def iter_dataset_tiles(tiles_dir, raw_dir):
+    """Yield (path, data) for every tile of a download directory."""
+    tiles = DatasetTiles(tiles_dir, raw_dir)
+    try:
+        yield from tiles
+    finally:
+        tiles.close()
+
+
+def export_tiles(store, output_dir, keys=None):
+    """Write tiles (default: all) to output_dir/L*/R*_C*.bin; returns count."""
+    count = 0
+    for key in (keys if keys is not None else store.keys()):
+        data = store.get(*key)
+        if data is None:
+            continue
+        level, row, col = key
+        path = os.path.join(output_dir, f'L{level}', f'R{row}_C{col}.bin')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        count += 1
+    return count
+
+
+def import_tiles(store, tiles_dir):
+    """Pack a legacy L*/R*_C*.bin tree into the store; returns count."""
+    count = 0
+    for parts, path in sorted(bin_files(tiles_dir).items()):
+        key = tile_key(parts)
+        if key is None:
+            continue    # terrain/ and other subtrees are not part of the layer
+        with open(path, 'rb') as f:
+            data = f.read()
+        store.put(*key, data, fetched_at=os.path.getmtime(path))
+        count += 1
+    store.commit()
+    return count